@@ -0,0 +1,71 @@
+"""menu ids are now integer codes
+
+Revision ID: 3d9a61c0f2b4
+Revises: b57e50910191
+Create Date: 2026-10-19 12:04:51.218307
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3d9a61c0f2b4'
+down_revision: Union[str, None] = 'b57e50910191'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+
+    # a bot that was started before the upgrade has already created the table, its codes are kept
+    menu_codes_columns = (sa.Column('code', sa.Integer, primary_key=True, autoincrement=False),
+                          sa.Column('menu_id', sa.String, unique=True, nullable=False))
+    if sa.inspect(conn).has_table('menu_codes'):
+        menu_codes = sa.table('menu_codes', *menu_codes_columns)
+        known_codes = dict(conn.execute(sa.select(menu_codes.c.menu_id, menu_codes.c.code)).all())
+    else:
+        menu_codes = op.create_table('menu_codes', *menu_codes_columns)
+        known_codes = {}
+
+    # every menu id users are in gets a code, the bot gives codes to the rest of its menus on startup
+    menu_ids = conn.execute(sa.text('SELECT current_menu_id FROM users WHERE current_menu_id IS NOT NULL '
+                                    'UNION SELECT previous_menu_id FROM users WHERE previous_menu_id IS NOT NULL'))
+    menu_ids = sorted(menu_id for menu_id, in menu_ids if menu_id not in known_codes)
+    if menu_ids:
+        first_code = max(known_codes.values(), default=0) + 1
+        op.bulk_insert(menu_codes, [{'code': code, 'menu_id': menu_id}
+                                    for code, menu_id in enumerate(menu_ids, first_code)])
+
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('current_menu_code', sa.Integer))
+        batch_op.add_column(sa.Column('previous_menu_code', sa.Integer))
+    op.execute('UPDATE users SET '
+               'current_menu_code = (SELECT code FROM menu_codes WHERE menu_id = users.current_menu_id), '
+               'previous_menu_code = (SELECT code FROM menu_codes WHERE menu_id = users.previous_menu_id)')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('current_menu_id')
+        batch_op.drop_column('previous_menu_id')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.alter_column('current_menu_code', new_column_name='current_menu_id')
+        batch_op.alter_column('previous_menu_code', new_column_name='previous_menu_id')
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('current_menu_name', sa.String))
+        batch_op.add_column(sa.Column('previous_menu_name', sa.String))
+    op.execute('UPDATE users SET '
+               'current_menu_name = (SELECT menu_id FROM menu_codes WHERE code = users.current_menu_id), '
+               'previous_menu_name = (SELECT menu_id FROM menu_codes WHERE code = users.previous_menu_id)')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('current_menu_id')
+        batch_op.drop_column('previous_menu_id')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.alter_column('current_menu_name', new_column_name='current_menu_id')
+        batch_op.alter_column('previous_menu_name', new_column_name='previous_menu_id')
+
+    op.drop_table('menu_codes')
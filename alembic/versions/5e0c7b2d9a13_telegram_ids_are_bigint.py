@@ -0,0 +1,29 @@
+"""Telegram ids are bigint
+
+Revision ID: 5e0c7b2d9a13
+Revises: 3d9a61c0f2b4
+Create Date: 2026-10-19 16:42:07.513284
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e0c7b2d9a13'
+down_revision: Union[str, None] = '3d9a61c0f2b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # INTEGER of SQLite is 64-bit already, other databases (e.g. PostgreSQL) have to widen the column
+    if op.get_bind().dialect.name != 'sqlite':
+        op.alter_column('users', 'userid', type_=sa.BigInteger, existing_type=sa.Integer)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'sqlite':
+        op.alter_column('users', 'userid', type_=sa.Integer, existing_type=sa.BigInteger)
@@ -0,0 +1,268 @@
+"""
+Drives main.py's handlers with synthetic traffic and reports throughput, latency percentiles
+and allocations per update type.
+
+Telegram is replaced with a fake transport recording the calls the bot makes (sends, edits, answers),
+the bot works with a temporary SQLite database and fixture caches, everything else is the bot as it runs.
+Needs the bot's config to import main.py; its data paths are redirected to a temporary folder.
+
+Usage:
+    python -m benchmarks.bot_load [--users 200] [--rounds 3]
+"""
+
+import argparse
+import asyncio
+from collections import Counter, defaultdict
+import json
+import logging
+from pathlib import Path
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pyrogram
+from pyrogram.enums import ChatType
+from pyrogram.types import CallbackQuery, Chat, InlineQuery, Message, User
+
+
+# noinspection PyPep8Naming
+from l10n import LocaleKeys as LK
+
+
+MENU_WALK = (LK.bot_servers_stats, LK.game_status_button_title, LK.stats_matchmaking_button_title, LK.bot_back,
+             LK.bot_extras, LK.valve_hqtime_button_title, LK.game_version_button_title, LK.bot_back)
+DC_LOOKUP = (LK.bot_servers_stats, LK.dc_status_title, LK.regions_europe, LK.dc_germany, LK.dc_sweden,
+             LK.bot_back, LK.regions_australia, LK.bot_back, LK.bot_back)
+INLINE_QUERIES = ('dc', 'dc germany', 'price', 'price eur', 'graph 24h')
+
+BOT_USER = User(id=1, is_self=True, is_bot=True, first_name='INCS2bot', username='INCS2bot')
+
+
+class FakeTransport:
+    """Replaces the ``pyrogram.Client`` methods the bot talks to Telegram with, recording the calls."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self._message_ids = iter(range(1_000_000, 10**9))
+        self._originals = {}
+
+    def _message(self, client, chat_id: int, message_id: int, text: str, reply_markup=None) -> Message:
+        chat = Chat(id=chat_id, type=ChatType.PRIVATE, first_name='Load', client=client)
+        return Message(id=message_id, chat=chat, from_user=BOT_USER, text=text, reply_markup=reply_markup,
+                       client=client)
+
+    def install(self):
+        transport = self
+
+        async def send_message(client, chat_id, text, *args, **kwargs):
+            transport.calls['send_message'] += 1
+            return transport._message(client, chat_id, next(transport._message_ids), text)
+
+        async def edit_message_text(client, chat_id, message_id, text, *args, **kwargs):
+            transport.calls['edit_message_text'] += 1
+            return transport._message(client, chat_id, message_id, text)
+
+        async def answer_inline_query(client, *args, **kwargs):
+            transport.calls['answer_inline_query'] += 1
+            return True
+
+        async def answer_callback_query(client, *args, **kwargs):
+            transport.calls['answer_callback_query'] += 1
+            return True
+
+        async def send_chat_action(client, *args, **kwargs):
+            transport.calls['send_chat_action'] += 1
+            return True
+
+        for func in (send_message, edit_message_text, answer_inline_query, answer_callback_query, send_chat_action):
+            self._originals[func.__name__] = getattr(pyrogram.Client, func.__name__)
+            setattr(pyrogram.Client, func.__name__, func)
+
+    def uninstall(self):
+        for name, func in self._originals.items():
+            setattr(pyrogram.Client, name, func)
+
+
+class TraceCollector:
+    """``Tracer`` exporter keeping how long every update kept the bot busy."""
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+
+    def export(self, trace):
+        self.durations[trace.kind].append(trace.busy)
+
+    def clear(self):
+        self.durations.clear()
+
+
+def write_fixtures(folder: Path):
+    from dcatlas import DatacenterAtlas
+    from utypes.game_data import ExchangeRateData
+
+    class AnyDatacenter(dict):
+        def get(self, key, default=None):
+            return {'capacity': 'full', 'load': 'medium'}
+
+    core_cache = {'api_timestamp': int(time.time()),
+                  'sessions_logon_state': 'normal',
+                  'matchmaking_scheduler_state': 'normal',
+                  'steam_community_state': 'normal',
+                  'webapi_state': 'normal',
+                  'game_coordinator_state': 'normal',
+                  'online_servers': 250_000,
+                  'active_players': 1_200_000,
+                  'searching_players': 15_000,
+                  'average_search_time': 37,
+                  'player_24h_peak': 1_500_000,
+                  'player_alltime_peak': 1_800_000,
+                  'monthly_unique_players': 28_000_000,
+                  'key_price': {currency: 250 for currency in ExchangeRateData._fields},
+                  'datacenters': {dc.id: dc.remap(AnyDatacenter()) for dc in DatacenterAtlas.available_dcs()}}
+    gc_cache = {'game_coordinator_state': 'normal',
+                'online_players': 1_000_000,
+                'cs2_client_version': 1234,
+                'cs2_server_version': 1234,
+                'cs2_patch_version': '1.40.0.0',
+                'cs2_version_timestamp': int(time.time())}
+
+    graph_cache = {'graph_url': 'https://example.com/14d.png',
+                   'graph_urls': {'24h': 'https://example.com/24h.png', '14d': 'https://example.com/14d.png'},
+                   'graph_file_ids': {'24h': 'graph-24h-file-id'}}
+
+    for name, cache in (('core_cache.json', core_cache), ('gc_cache.json', gc_cache),
+                        ('graph_cache.json', graph_cache), ('guns.json', [])):
+        (folder / name).write_text(json.dumps(cache), encoding='utf-8')
+
+
+def private_message(client, user: User, message_id: int, text: str) -> Message:
+    chat = Chat(id=user.id, type=ChatType.PRIVATE, first_name=user.first_name, client=client)
+    return Message(id=message_id, chat=chat, from_user=user, text=text, client=client)
+
+
+class LoadGenerator:
+    def __init__(self, main, inline, users: int):
+        self.main = main
+        self.inline = inline
+        self.bot = main.bot
+        self.users = users
+        self.bot_messages: dict[int, Message] = {}  # user id -> the message the menus are in
+        self._update_ids = iter(range(10**9))
+
+    def user(self, user_id: int) -> User:
+        return User(id=user_id, is_self=False, first_name=f'User {user_id}', language_code='en')
+
+    async def new_users(self, first_id: int):
+        for user_id in range(first_id, first_id + self.users):
+            user = self.user(user_id)
+            message = private_message(self.bot, user, next(self._update_ids), '/start')
+            await self.main.handle_messages(self.bot, message)
+        await self.bot.user_dispatcher.join()
+
+        if not self.bot_messages:  # the first batch of users goes on to walk the menus
+            for user_id in range(first_id, first_id + self.users):
+                self.bot_messages[user_id] = private_message(self.bot, BOT_USER, next(self._update_ids), '')
+                self.bot_messages[user_id].chat.id = user_id
+        return self.users
+
+    async def walk(self, path: tuple[str, ...]):
+        """Every user taps through ``path``, waiting for the bot to answer before the next tap."""
+
+        for data in path:
+            for user_id, bot_message in self.bot_messages.items():
+                query = CallbackQuery(id=str(next(self._update_ids)), from_user=self.user(user_id),
+                                      chat_instance='load', message=bot_message, data=data, client=self.bot)
+                await self.main.handle_callbacks(self.bot, query)
+            await self.bot.user_dispatcher.join()
+        return len(path) * len(self.bot_messages)
+
+    async def inline_queries(self, user_ids=None):
+        """Inline queries of the users walking the menus, or of ``user_ids`` the bot hasn't seen."""
+
+        user_ids = list(user_ids or self.bot_messages)
+        for query_text in INLINE_QUERIES:
+            for user_id in user_ids:
+                query = InlineQuery(id=str(next(self._update_ids)), from_user=self.user(user_id),
+                                    query=query_text, offset='', chat_type=ChatType.PRIVATE, client=self.bot)
+                await self.inline.sync_user_data_inline(self.bot, query)
+            await self.bot.user_dispatcher.join()
+        return len(INLINE_QUERIES) * len(user_ids)
+
+
+def report(name: str, updates: int, elapsed: float, durations: list[float], peak: int, retained: int):
+    ms = np.array(durations) * 1000 if durations else np.zeros(1)
+    p50, p95, p99 = np.percentile(ms, (50, 95, 99))
+    print(f'{name:<16} {updates / elapsed:>8,.0f} upd/s   p50 {p50:6.2f} ms   p95 {p95:6.2f} ms   p99 {p99:6.2f} ms   '
+          f'peak {peak / updates / 1024:6.1f} KiB/upd   retained {retained / updates:8,.0f} B/upd')
+
+
+async def run(args, folder: Path):
+    import config
+
+    config.DATA_FOLDER = folder
+    config.LOGS_FOLDER = folder / 'logs'
+    config.LOGS_FOLDER.mkdir()
+    config.CORE_CACHE_FILE_PATH = folder / 'core_cache.json'
+    config.GC_CACHE_FILE_PATH = folder / 'gc_cache.json'
+    config.GRAPH_CACHE_FILE_PATH = folder / 'graph_cache.json'
+    config.GUN_DATA_FILE_PATH = folder / 'guns.json'
+    config.USER_DB_FILE_PATH = folder / 'users.db'
+    write_fixtures(folder)
+
+    import main
+    import plugins.inline as inline
+    from db import db_session
+
+    logging.getLogger('INCS2bot').setLevel(logging.WARNING)  # every new session gets logged otherwise
+    await db_session.init(config.USER_DB_FILE_PATH)
+    await main.bot.load_menu_codes(db_session.store())
+
+    collector = TraceCollector()
+    main.bot.tracer.exporter = collector
+    generator = LoadGenerator(main, inline, args.users)
+
+    scenarios = {'new user /start': lambda rnd: generator.new_users(1_000_000 * (rnd + 1)),
+                 'menu walk': lambda rnd: generator.walk(MENU_WALK),
+                 'dc lookup': lambda rnd: generator.walk(DC_LOOKUP),
+                 'inline dc/price': lambda rnd: generator.inline_queries(),
+                 'inline, drive-by': lambda rnd: generator.inline_queries(range(10**8 * (rnd + 1),
+                                                                                10**8 * (rnd + 1) + args.users))}
+
+    print(f'{args.users} users, {args.rounds} rounds\n')
+    for rnd in range(args.rounds):
+        for name, scenario in scenarios.items():
+            collector.clear()
+            start = time.perf_counter()
+            updates = await scenario(2 * rnd)
+            elapsed = time.perf_counter() - start
+            durations = [d for kind in collector.durations.values() for d in kind]
+
+            tracemalloc.start()
+            before, _ = tracemalloc.get_traced_memory()
+            await scenario(2 * rnd + 1)
+            after, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            report(name, updates, elapsed, durations, peak - before, after - before)
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    transport = FakeTransport()
+    transport.install()
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            asyncio.run(run(args, Path(folder)))
+    finally:
+        transport.uninstall()
+    print('Telegram calls:', dict(transport.calls))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Compares deep-copying and re-translating a markup on every render (as ``ExtendedIKM.localed`` used to)
+with looking up its compiled variant.
+
+Usage:
+    python -m benchmarks.keyboards
+"""
+
+from copy import deepcopy
+import timeit
+
+import keyboards
+from l10n import get_available_languages, locale
+
+
+ROUNDS = 2000
+MARKUPS = {'language settings': keyboards.language_settings_markup,
+           'rifles': keyboards.rifles_markup,
+           'pistols': keyboards.pistols_markup,
+           'datacenters (Europe)': keyboards.dc_eu_markup,
+           'datacenters (US)': keyboards.dc_us_markup}
+
+
+def deepcopy_localed(markup, _locale):
+    copy = deepcopy(markup)
+    copy.update_locale(_locale)
+    return copy
+
+
+def main():
+    locales = [locale(lang_code) for lang_code in get_available_languages()]
+
+    for name, markup in MARKUPS.items():
+        buttons = sum(1 for _ in markup.iter_buttons())
+
+        def copied():
+            for _locale in locales:
+                deepcopy_localed(markup, _locale)
+
+        def compiled():
+            for _locale in locales:
+                markup(_locale)
+
+        copied_time = timeit.timeit(copied, number=ROUNDS) / ROUNDS / len(locales)
+        compiled_time = timeit.timeit(compiled, number=ROUNDS) / ROUNDS / len(locales)
+        print(f'{name} ({buttons} buttons): deepcopy {copied_time * 1e6:.1f} µs, '
+              f'compiled {compiled_time * 1e6:.2f} µs ({copied_time / compiled_time:,.0f}x faster)')
+
+
+if __name__ == '__main__':
+    main()
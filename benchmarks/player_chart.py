@@ -0,0 +1,73 @@
+"""
+Compares the old CSV player chart (read, trim, append, rewrite, 24h peak)
+with the memory-mapped ``PlayerChart`` (append, 24h peak).
+
+Usage:
+    python -m benchmarks.player_chart
+"""
+
+import datetime as dt
+from pathlib import Path
+import tempfile
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from utypes import PlayerChart
+
+
+MARKS = PlayerChart.DEFAULT_CAPACITY
+MARK_INTERVAL = 10 * 60
+DAY = 24 * 60 * 60
+ROUNDS = 200
+
+
+def make_csv(path: Path, start: float):
+    timestamps = start + np.arange(MARKS) * MARK_INTERVAL
+    players = np.random.default_rng(0).integers(600_000, 1_500_000, MARKS)
+    pd.DataFrame({'DateTime': pd.to_datetime(timestamps, unit='s').strftime('%Y-%m-%d %H:%M:%S'),
+                  'Players': players}).to_csv(path, index=False)
+
+
+def pandas_round(path: Path, now: dt.datetime):
+    old_player_data = pd.read_csv(path, parse_dates=['DateTime'])
+    remove_marks = len(old_player_data.index) - MARKS
+    old_player_data.drop(range(remove_marks + 1), axis=0, inplace=True)
+
+    temp_player_data = pd.DataFrame([[f'{now:%Y-%m-%d %H:%M:%S}', 1_000_000]], columns=['DateTime', 'Players'])
+    pd.concat([old_player_data, temp_player_data]).to_csv(path, index=False)
+
+    df = pd.read_csv(path, parse_dates=['DateTime'])
+    end_date = f'{now:%Y-%m-%d %H:%M:%S}'
+    start_date = f'{(now - dt.timedelta(days=1)):%Y-%m-%d %H:%M:%S}'
+    mask = (df['DateTime'] > start_date) & (df['DateTime'] <= end_date)
+    return int(df.loc[mask]['Players'].max())
+
+
+def chart_round(chart: PlayerChart, now: float):
+    chart.append(now, 1_000_000)
+    return chart.peak(now - DAY, now)
+
+
+def main():
+    now = dt.datetime.now(dt.UTC).replace(microsecond=0)
+    start = now.timestamp() - MARKS * MARK_INTERVAL
+
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_path = Path(workdir) / 'player_chart.csv'
+        make_csv(csv_path, start)
+
+        chart = PlayerChart.open(workdir)
+        import_time = timeit.timeit(lambda: chart.import_csv(csv_path), number=1)
+
+        pandas_time = timeit.timeit(lambda: pandas_round(csv_path, now), number=ROUNDS) / ROUNDS
+        chart_time = timeit.timeit(lambda: chart_round(chart, now.timestamp()), number=ROUNDS) / ROUNDS
+
+    print(f'CSV import ({MARKS} marks):        {import_time * 1000:.3f} ms')
+    print(f'pandas append + 24h peak:      {pandas_time * 1000:.3f} ms')
+    print(f'PlayerChart append + 24h peak: {chart_time * 1000:.3f} ms ({pandas_time / chart_time:,.0f}x faster)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Compares building a brand-new figure for every graph render (as the graph maker used to)
+with updating a persistent ``PlayerGraphRenderer``.
+
+Usage:
+    python -m benchmarks.player_graph
+"""
+
+from io import BytesIO
+import time
+import timeit
+
+import matplotlib.dates as mdates
+import matplotlib.pyplot as plt
+import numpy as np
+import seaborn as sns
+
+from functions.player_graph import (PlayerGraphRenderer, cmap, colorbar_ticks_format,
+                                    fig_ticks_format, mappable, norm, ticks)
+
+
+MARKS = 2016
+MARK_INTERVAL = 10 * 60
+ROUNDS = 20
+
+
+def make_data(shift: int):
+    timestamps = int(time.time()) - (MARKS - shift) * MARK_INTERVAL + np.arange(MARKS) * MARK_INTERVAL
+    players = np.random.default_rng(shift).integers(600_000, 1_500_000, MARKS)
+    return timestamps, players
+
+
+def fresh_figure_render(timestamps: np.ndarray, players: np.ndarray) -> BytesIO:
+    dates = timestamps.astype('datetime64[s]')
+
+    sns.set_style('whitegrid')
+
+    fig, ax = plt.subplots(figsize=(10, 2.5))
+    ax.scatter(dates, players, c=players, cmap=cmap, s=10, norm=norm, linewidths=0.7)
+    ax.fill_between(dates, players - 20_000, color=cmap(0.5), alpha=0.4)
+    ax.margins(x=0)
+
+    ax.grid(visible=True, axis='y', linestyle='--', alpha=0.3)
+    ax.grid(visible=False, axis='x')
+    ax.spines['bottom'].set_position('zero')
+    ax.spines['bottom'].set_color('black')
+    ax.set(xlabel='', ylabel='')
+    ax.xaxis.set_ticks_position('bottom')
+    ax.xaxis.set_major_locator(mdates.DayLocator())
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%b %d'))
+    ax.legend(loc='upper left')
+    ax.text(0.20, 0.88, 'Made by @INCS2\nupdates every 10 min',
+            ha='center', transform=ax.transAxes, color='black', size='8')
+    ax.set_yticks(ticks, fig_ticks_format)
+
+    fig.colorbar(mappable, ax=ax, ticks=ticks, format=colorbar_ticks_format, pad=0.01)
+    fig.subplots_adjust(top=0.933, bottom=0.077, left=0.03, right=1.07)
+
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png', dpi=PlayerGraphRenderer.DPI)
+    plt.close(fig)
+    return buffer
+
+
+def main():
+    datasets = [make_data(shift) for shift in range(ROUNDS)]
+    renderer = PlayerGraphRenderer()
+
+    def incremental():
+        for timestamps, players in datasets:
+            renderer.update(timestamps, players)
+            renderer.render()
+
+    def fresh():
+        for timestamps, players in datasets:
+            fresh_figure_render(timestamps, players)
+
+    fresh_time = timeit.timeit(fresh, number=1) / ROUNDS
+    incremental_time = timeit.timeit(incremental, number=1) / ROUNDS
+
+    print(f'fresh figure per render: {fresh_time * 1000:.1f} ms')
+    print(f'persistent renderer:     {incremental_time * 1000:.1f} ms ({fresh_time / incremental_time:.1f}x faster)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Compares saving user sessions one by one (a SELECT and an ORM update per session)
+with the write-behind bulk UPDATE of ``UserSessions.flush()``.
+
+Usage:
+    python -m benchmarks.session_flush [--sessions 100000]
+"""
+
+import argparse
+import asyncio
+import logging
+from pathlib import Path
+import tempfile
+import time
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from bottypes.sessions import UserSession, UserSessions
+from db import db_session, User as DBUser
+from db.stores import NewUser
+
+
+async def sync_with_db_session(session: UserSession, db_sess: AsyncSession):
+    """How a session used to be saved."""
+
+    dbuser = (await db_sess.execute(select(DBUser).where(DBUser.id == session.dbuser_id))).scalar()
+    dbuser.current_menu_id = session.current_menu_id
+    dbuser.previous_menu_id = session.previous_menu_id
+    dbuser.language = session.lang_code
+    dbuser.last_bot_pm_id = session.last_bot_pm_id
+
+
+async def run(sessions_count: int, folder: Path):
+    await db_session.init(folder / 'users.db')
+    dbusers = await db_session.store().add_many([NewUser(user_id, 'en', None) for user_id in range(sessions_count)])
+
+    sessions = UserSessions()
+    for user_id, dbuser in dbusers.items():
+        sessions[user_id] = UserSession(dbuser)
+
+    one_by_one = min(sessions_count, 5_000)  # the old way takes minutes for big numbers
+    start = time.perf_counter()
+    async with db_session.create_session() as db_sess:
+        for user_id in range(one_by_one):
+            await sync_with_db_session(sessions[user_id], db_sess)
+        await db_sess.commit()
+    per_session = (time.perf_counter() - start) / one_by_one
+    print(f'one by one:  {per_session * 1e6:8.1f} µs/session, {per_session * sessions_count:7.2f} s '
+          f'for {sessions_count:,} sessions (extrapolated from {one_by_one:,})')
+
+    for session in sessions.values():
+        session.current_menu_id = 1
+    start = time.perf_counter()
+    saved = await sessions.flush()
+    elapsed = time.perf_counter() - start
+    print(f'bulk flush:  {elapsed / saved * 1e6:8.1f} µs/session, {elapsed:7.2f} s for {saved:,} sessions')
+
+    start = time.perf_counter()
+    await sessions.flush()
+    print(f'clean flush: {(time.perf_counter() - start) * 1000:8.1f} ms for {sessions_count:,} unchanged sessions')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, default=100_000)
+    args = parser.parse_args()
+
+    logging.getLogger('INCS2bot').setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as folder:
+        asyncio.run(run(args.sessions, Path(folder)))
+
+
+if __name__ == '__main__':
+    main()
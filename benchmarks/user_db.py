@@ -0,0 +1,108 @@
+"""
+Compares the user database with SQLite's defaults (rollback journal, synchronous=FULL, ...)
+to the performance profile of ``db.stores.SQLITE_PRAGMAS`` (and a store in memory) on the bot's workloads:
+registering new users, saving sessions one by one and flushing them in bulk,
+and reading users while sessions are being saved.
+
+Usage:
+    python -m benchmarks.user_db [--users 5000]
+"""
+
+import argparse
+import asyncio
+import logging
+from pathlib import Path
+import tempfile
+import time
+
+from pyrogram.types import User
+
+from bottypes.sessions import UserSessions
+from db import db_session, MemoryStore, SQLiteStore
+from db.stores import POOL_SIZE, SQLITE_PRAGMAS
+
+
+SIGNUP_WAVE = 50  # users signing up at once
+SINGLE_SYNCS = 500
+READERS = 2
+MIXED_SECONDS = 3
+
+PROFILES = {'before (sqlite defaults, connection per session)':
+            lambda db_file: SQLiteStore(db_file, {name: None for name in SQLITE_PRAGMAS}, pool_size=0),
+            'after (performance profile, pool)': lambda db_file: SQLiteStore(db_file, pool_size=POOL_SIZE),
+            'in memory, for reference': lambda db_file: MemoryStore()}
+
+
+async def read_users(user_ids: list[int], stop: asyncio.Event) -> int:
+    reads = 0
+    while not stop.is_set():
+        await db_session.store().get(user_ids[reads % len(user_ids)])
+        reads += 1
+        await asyncio.sleep(0)  # a store in memory never yields
+    return reads
+
+
+async def write_sessions(sessions: UserSessions, stop: asyncio.Event) -> int:
+    writes = 0
+    while not stop.is_set():
+        session = sessions[writes % len(sessions)]
+        session.current_menu_id = writes
+        await session.sync_with_db()
+        writes += 1
+        await asyncio.sleep(0)
+    return writes
+
+
+async def run(users: int, store) -> dict[str, str]:
+    await db_session.init_store(store)
+    sessions = UserSessions()
+    results = {}
+
+    start = time.perf_counter()
+    for wave in range(0, users, SIGNUP_WAVE):
+        await asyncio.gather(*(sessions.register_session(User(id=user_id, language_code='en'), None)
+                               for user_id in range(wave, min(wave + SIGNUP_WAVE, users))))
+    results['register'] = f'{users / (time.perf_counter() - start):,.0f} users/s'
+
+    start = time.perf_counter()
+    for user_id in range(SINGLE_SYNCS):
+        sessions[user_id].current_menu_id = 1
+        await sessions[user_id].sync_with_db()
+    results['commit per session'] = f'{SINGLE_SYNCS / (time.perf_counter() - start):,.0f} sessions/s'
+
+    for session in sessions.values():
+        session.current_menu_id = 2
+    start = time.perf_counter()
+    await sessions.flush()
+    results['bulk flush'] = f'{(time.perf_counter() - start) * 1000:,.0f} ms'
+
+    stop = asyncio.Event()
+    user_ids = list(range(users))
+    tasks = [asyncio.create_task(write_sessions(sessions, stop)),
+             *(asyncio.create_task(read_users(user_ids, stop)) for _ in range(READERS))]
+    await asyncio.sleep(MIXED_SECONDS)
+    stop.set()
+    writes, *reads = await asyncio.gather(*tasks)
+    results['mixed: writes'] = f'{writes / MIXED_SECONDS:,.0f} sessions/s'
+    results['mixed: reads'] = f'{sum(reads) / MIXED_SECONDS:,.0f} reads/s'
+
+    await db_session.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=5000)
+    args = parser.parse_args()
+
+    logging.getLogger('INCS2bot').setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as folder:
+        for number, (name, make_store) in enumerate(PROFILES.items()):
+            results = asyncio.run(run(args.users, make_store(Path(folder) / f'{number}.db')))
+            print(f'{name}:')
+            for workload, result in results.items():
+                print(f'    {workload:<20} {result:>16}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
 from .botclient import *
 from .extended_ik import *
 from .logger import PlainBotLogger
-from .sessions import UserSession
+from .sessions import EphemeralSession, UserSession
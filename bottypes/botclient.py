@@ -1,13 +1,15 @@
 from __future__ import annotations
 
 import asyncio
+from collections import OrderedDict
 import datetime as dt
 import logging
-from typing import Type
+from pathlib import Path
+from typing import Callable, Type
 
 from pyrogram import Client
 from pyrogram.enums import ChatAction, ChatType, ParseMode
-from pyrogram.errors.exceptions.bad_request_400 import MessageIdInvalid
+from pyrogram.errors.exceptions.bad_request_400 import MessageIdInvalid, MessageNotModified
 from pyrogram.types import (CallbackQuery, InlineQuery, Message,
                             MessageEntity, InlineKeyboardMarkup,
                             ReplyKeyboardMarkup,
@@ -15,10 +17,14 @@ from pyrogram.types import (CallbackQuery, InlineQuery, Message,
 # noinspection PyUnresolvedReferences
 from pyropatch import pyropatch  # do not delete!!
 
+from db import SessionStore
+from functions.tracing import Tracer, name_trace, span
+
+from .dispatcher import UserDispatcher
 from .extended_ik import ExtendedIKM
 from .logger import BotLogger
-from .menu import Menu, NavMenu, FuncMenu
-from .sessions import UserSession, UserSessions
+from .menu import Menu, MenuCodes, NavMenu, FuncMenu
+from .sessions import EphemeralSession, UserSession, UserSessions
 from .stats import BotRegularStats
 
 __all__ = ('BotClient',)
@@ -27,17 +33,35 @@ __all__ = ('BotClient',)
 logger = logging.getLogger('INCS2bot')
 
 
+def _markup_key(reply_markup):
+    if reply_markup is None:
+        return
+    if isinstance(reply_markup, InlineKeyboardMarkup):
+        return tuple(tuple((button.text, button.callback_data, button.url, button.user_id,
+                            button.switch_inline_query, button.switch_inline_query_current_chat)
+                           for button in line)
+                     for line in reply_markup.inline_keyboard)
+    return str(reply_markup)
+
+
+def _content_hash(text: str, parse_mode, entities, disable_web_page_preview, reply_markup) -> int:
+    entities = tuple(map(str, entities)) if entities else None
+    return hash((text, parse_mode, entities, disable_web_page_preview, _markup_key(reply_markup)))
+
+
 class BotClient(Client):
     """
     Custom pyrogram.Client class to add custom properties and methods and stop PyCharm annoy me.
     """
 
     MAINLOOP_TIMEOUT = dt.timedelta(seconds=10)  # define how often mainloop tasks are being handled
+    REMEMBERED_MESSAGES = 10_000  # how many messages to remember the last sent content of
 
     WILDCARD = '_'
 
     def __init__(self, *args, telegram_logger: BotLogger,
-                 navigate_back_callback: str, commands_prefix: str = '/', **kwargs):
+                 navigate_back_callback: str, commands_prefix: str = '/', tracer: Tracer = None,
+                 max_concurrent_updates: int = 16, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.telegram_logger = telegram_logger
@@ -49,8 +73,9 @@ class BotClient(Client):
         self.commands_prefix = commands_prefix
 
         # menus
-        self._menus: dict[str, Menu] = {}
-        self._menu_routes: dict[str, Menu | dict[str, Menu]] = {}
+        self._menu_codes = MenuCodes()
+        self._menus: dict[int, Menu] = {}  # code -> menu
+        self._menu_routes: dict[str, Menu | dict[int, Menu]] = {}  # query -> menu, or code of came from -> menu
 
         self.is_in_mainloop = False
 
@@ -60,6 +85,10 @@ class BotClient(Client):
         self.startup_dt = None
 
         self.rstats = BotRegularStats()
+        self.tracer = tracer or Tracer()
+        self.user_dispatcher = UserDispatcher(max_concurrent_updates)
+
+        self._message_contents: OrderedDict[tuple[int | str, int], int] = OrderedDict()  # -> content hash
 
     @property
     def sessions(self) -> UserSessions:
@@ -68,6 +97,13 @@ class BotClient(Client):
     async def start(self):
         self.startup_dt = dt.datetime.now(dt.UTC)
         await super().start()
+        if self.telegram_logger is not None:
+            self.telegram_logger.start(self)
+
+    async def stop(self, *args, **kwargs):
+        if self.telegram_logger is not None:
+            await self.telegram_logger.stop()
+        return await super().stop(*args, **kwargs)
 
     async def mainloop(self):
         # ESSENTIALS FOR MAINLOOP
@@ -91,24 +127,54 @@ class BotClient(Client):
             task = asyncio.create_task(asyncio.sleep(self.MAINLOOP_TIMEOUT.total_seconds()))
             try:
                 await task
-                await self.telegram_logger.process_queue()
             except asyncio.CancelledError:
                 self.is_in_mainloop = False
 
     async def register_session(self, user: User, message: Message = None) -> UserSession:
-        session = await self._sessions.register_session(user, message)
+        with span('session'):
+            session = await self._sessions.register_session(user, message)
+        self.rstats.unique_users_served.add(user.id)
+        return session
+
+    def get_ephemeral_session(self, user: User) -> UserSession | EphemeralSession:
+        """
+        Session for updates outside PM (inline queries, commands in group chats): the one in memory,
+        or an ephemeral session that doesn't touch the db, so drive-by users don't get registered.
+        """
+
+        with span('session'):
+            session = self._sessions.get_or_ephemeral(user)
         self.rstats.unique_users_served.add(user.id)
         return session
 
-    async def dump_sessions(self):
+    async def dump_sessions(self, snapshot_path: Path = None):
+        """Save changed sessions, and with ``snapshot_path``, which of them are active, to load them on startup."""
+
         await self.clear_timeout_sessions()
-        await self._sessions.sync_with_db()
+        await self.flush_sessions()
+        if snapshot_path is not None:
+            self._sessions.dump_snapshot(snapshot_path)
+
+    async def load_sessions(self, snapshot_path: Path) -> int:
+        """Load sessions of the users that were active before the bot got restarted."""
+
+        return await self._sessions.load_snapshot(snapshot_path)
+
+    async def flush_sessions(self) -> int:
+        """Save sessions changed since the last flush to the db."""
+
+        return await self._sessions.flush()
 
     async def clear_timeout_sessions(self):
         """Clear all sessions that exceed a given lifetime."""
 
         return await self._sessions.clear_timeout_sessions()
 
+    def evict_timeout_sessions(self) -> int:
+        """Clear a small batch of the sessions that exceed a given lifetime, saving them with the next flush."""
+
+        return self._sessions.evict_timeout_sessions()
+
     def clear_sessions(self):
         self._sessions.clear()
 
@@ -165,7 +231,7 @@ class BotClient(Client):
 
             if self._menu_routes.get(query) is None:
                 self._menu_routes[query] = {}
-            self._menu_routes[query][came_from.id] = menu
+            self._menu_routes[query][came_from.code] = menu
 
             return menu
 
@@ -258,22 +324,62 @@ class BotClient(Client):
 
         return decorator
 
+    async def invoke(self, query, *args, **kwargs):
+        with span(f'telegram.{type(query).__name__}'):
+            return await super().invoke(query, *args, **kwargs)
+
+    def accepts_message(self, message: Message) -> bool:
+        """Whether ``handle_message()`` has anything to do with the message."""
+
+        if message.text is None or message.from_user is None:
+            return False
+        if message.text.startswith(self.commands_prefix):
+            return self.has_a_command(message.text)  # the rest are for other handlers (like /reply)
+        return message.chat.type == ChatType.PRIVATE
+
+    def dispatch_message(self, message: Message) -> bool:
+        """
+        Queues the message to be handled in order with other updates of its sender.
+        Returns ``False`` if the bot has nothing to do with it, so other handlers can take it.
+        """
+
+        if not self.accepts_message(message):
+            return False
+
+        self.user_dispatcher.dispatch(message.from_user.id, self.handle_message, message)
+        return True
+
+    def dispatch_callback(self, callback_query: CallbackQuery, handler: Callable = None):
+        """
+        Queues the callback query to be handled (by ``handler`` or ``handle_callback()``) in order
+        with other updates of its sender. A query still waiting in the queue is dropped when
+        the user presses another button on the same message.
+        """
+
+        self.user_dispatcher.dispatch(callback_query.from_user.id, handler or self.handle_callback, callback_query,
+                                      collapse_key=(callback_query.message.chat.id, callback_query.message.id))
+
     async def handle_message(self, message: Message):
         if message.text is None:
             return
 
+        with self.tracer.trace('message'):
+            return await self._handle_message(message)
+
+    async def _handle_message(self, message: Message):
+
         user = message.from_user
 
         if message.chat.type != ChatType.PRIVATE:
             text = message.text
             if text.startswith(self.commands_prefix) and self.has_a_command(text):
-                session = await self.register_session(user, message)  # early command handling in group chats
-                return await self.handle_command(session, message)    # of every single user of these
+                session = self.get_ephemeral_session(user)          # early command handling in group chats
+                return await self.handle_command(session, message)  # of every single user of these
             return
 
         session = await self.register_session(user, message)
 
-        current_menu = self.get_menu_by_id(session.current_menu_id)
+        current_menu = self.get_menu_by_code(session.current_menu_id)
         if isinstance(current_menu, NavMenu) and current_menu.has_message_process():
             if session.last_bot_pm_id is None:  # handling message processes after reload
                 menu = self.get_wildcard_menu()
@@ -314,8 +420,13 @@ class BotClient(Client):
         if callback_query.message.chat.type != ChatType.PRIVATE:
             return
 
+        with self.tracer.trace('callback'):
+            return await self._handle_callback(callback_query)
+
+    async def _handle_callback(self, callback_query: CallbackQuery):
         user = callback_query.from_user
-        session = self.sessions.get(user.id)
+        with span('session'):
+            session = self.sessions.get(user.id)
         if session is None:
             session = await self.register_session(user, callback_query.message)
 
@@ -343,14 +454,16 @@ class BotClient(Client):
             if wildcard_menu is None:
                 return
 
-            current_menu = self.get_menu_by_id(session.current_menu_id)
-            if current_menu is None:                        # happens if the user clicks on the menu
-                session.current_menu_id = wildcard_menu.id  # but there is no user data
+            current_menu = self.get_menu_by_code(session.current_menu_id)
+            if current_menu is None:                          # happens if the user clicks on the menu
+                session.current_menu_id = wildcard_menu.code  # but there is no user data
                 return await self.get_menu_by_callback(session, callback_query)
 
             if isinstance(current_menu, NavMenu) and current_menu.has_callback_process():
+                name_trace(current_menu.id)
                 try:
-                    return await current_menu.callback_process(self, session, callback_query)
+                    with span('handler'):
+                        return await current_menu.callback_process(self, session, callback_query)
                 except asyncio.exceptions.TimeoutError:
                     return
 
@@ -369,20 +482,45 @@ class BotClient(Client):
 
     def register_menu(self, menu: Menu):
         if menu not in self._menus.values():
-            self._menus[menu.id] = menu
+            menu.code = self._menu_codes[menu.id]
+            if menu.came_from_menu_id is not None:
+                menu.came_from_code = self._menu_codes[menu.came_from_menu_id]
+            self._menus[menu.code] = menu
 
-    def get_menu_by_id(self, _id: str):
-        return self._menus.get(_id)
+    async def load_menu_codes(self, store: SessionStore):
+        """
+        Replace codes of the menus with the ones persisted in the ``store``,
+        persisting codes of the menus that haven't been there yet.
+        """
+
+        new_codes = self._menu_codes.load(await store.get_menu_codes(),
+                                          {menu.id for menu in self._menus.values()})
+        if new_codes:
+            logger.info(f'New menu codes: {new_codes}')
+            await store.add_menu_codes(new_codes)
+
+        codes = {menu.code: self._menu_codes[menu.id] for menu in self._menus.values()}
+        for menu in self._menus.values():
+            menu.code = codes[menu.code]
+            if menu.came_from_menu_id is not None:
+                menu.came_from_code = self._menu_codes[menu.came_from_menu_id]
+        self._menus = {menu.code: menu for menu in self._menus.values()}
+        self._menu_routes = {query: menus if isinstance(menus, Menu)
+                             else {codes[code]: menu for code, menu in menus.items()}
+                             for query, menus in self._menu_routes.items()}
+
+    def get_menu_by_code(self, code: int | None):
+        return self._menus.get(code)
 
     def get_menus_by_query(self, query: str):
         return self._menu_routes.get(query)
 
-    def get_menu_by_query(self, current_menu_id: str, query: str):
+    def get_menu_by_query(self, current_menu_code: int | None, query: str):
         possible_menus = self.get_menus_by_query(query)
         if isinstance(possible_menus, Menu):
             return possible_menus
 
-        return possible_menus[current_menu_id]
+        return possible_menus[current_menu_code]
 
     def get_wildcard_menu(self):
         return self._menu_routes.get(self.WILDCARD)
@@ -397,7 +535,7 @@ class BotClient(Client):
         """
 
         if not menu.can_come_from(session.current_menu_id):
-            raise Exception(f"Can't access {menu} from {self.get_menu_by_id(session.current_menu_id)}")
+            raise Exception(f"Can't access {menu} from {self.get_menu_by_code(session.current_menu_id)}")
 
         return await self.jump_to_menu(session, bot_message, menu)
 
@@ -405,10 +543,12 @@ class BotClient(Client):
         """Sends user to a specific menu."""
 
         if isinstance(menu, NavMenu):
-            session.previous_menu_id = menu.came_from_menu_id
-            session.current_menu_id = menu.id
+            session.previous_menu_id = menu.came_from_code
+            session.current_menu_id = menu.code
 
-        result = await menu(self, session, bot_message)
+        name_trace(menu.id)
+        with span('handler'):
+            result = await menu(self, session, bot_message)
         if isinstance(result, Message):
             session.last_bot_pm_id = result.id
         return result
@@ -420,7 +560,7 @@ class BotClient(Client):
         return await menu(self, session, bot_message)
 
     async def go_back(self, session: UserSession, bot_message: Message):
-        previous_menu = self.get_menu_by_id(session.previous_menu_id)
+        previous_menu = self.get_menu_by_code(session.previous_menu_id)
         if previous_menu is None:
             previous_menu = self.get_wildcard_menu()
             if previous_menu is None:
@@ -428,12 +568,85 @@ class BotClient(Client):
 
         return await self.jump_to_menu(session, bot_message, previous_menu)
 
+    def _remember_content(self, chat_id: int | str, message_id: int, content_hash: int | None):
+        key = (chat_id, message_id)
+        if content_hash is None:
+            self._message_contents.pop(key, None)
+            return
+
+        self._message_contents[key] = content_hash
+        self._message_contents.move_to_end(key)
+        if len(self._message_contents) > self.REMEMBERED_MESSAGES:
+            self._message_contents.popitem(last=False)
+
+    async def send_message(self, chat_id: int | str, text: str,
+                           parse_mode: ParseMode = None,
+                           entities: list[MessageEntity] = None,
+                           disable_web_page_preview: bool = None,
+                           disable_notification: bool = None,
+                           reply_to_message_id: int = None,
+                           schedule_date: dt.datetime = None,
+                           protect_content: bool = None,
+                           reply_markup: InlineKeyboardMarkup | ReplyKeyboardMarkup |
+                           ReplyKeyboardRemove | ForceReply = None) -> Message:
+        message = await super().send_message(chat_id, text, parse_mode, entities, disable_web_page_preview,
+                                             disable_notification, reply_to_message_id, schedule_date,
+                                             protect_content, reply_markup)
+        if isinstance(message, Message) and message.chat is not None:
+            content_hash = _content_hash(text, parse_mode, entities, disable_web_page_preview, reply_markup)
+            self._remember_content(message.chat.id, message.id, content_hash)
+        return message
+
+    async def edit_message_text(self, chat_id: int | str, message_id: int, text: str,
+                                parse_mode: ParseMode = None,
+                                entities: list[MessageEntity] = None,
+                                disable_web_page_preview: bool = None,
+                                reply_markup: InlineKeyboardMarkup = None) -> Message:
+        """
+        Edits a message, unless it was last sent or edited with the exact same content:
+        then ``MessageNotModified`` is raised right away, just like Telegram would have done.
+        """
+
+        content_hash = _content_hash(text, parse_mode, entities, disable_web_page_preview, reply_markup)
+        if self._message_contents.get((chat_id, message_id)) == content_hash:
+            self._message_contents.move_to_end((chat_id, message_id))
+            self.rstats.message_edits_skipped += 1
+            raise MessageNotModified()
+
+        try:
+            message = await super().edit_message_text(chat_id, message_id, text, parse_mode, entities,
+                                                      disable_web_page_preview, reply_markup)
+        except MessageNotModified:
+            self._remember_content(chat_id, message_id, content_hash)
+            raise
+        except Exception:
+            self._remember_content(chat_id, message_id, None)
+            raise
+
+        self._remember_content(chat_id, message_id, content_hash)
+        return message
+
+    async def edit_message_reply_markup(self, chat_id: int | str, message_id: int,
+                                        reply_markup: InlineKeyboardMarkup = None) -> Message:
+        self._remember_content(chat_id, message_id, None)
+        return await super().edit_message_reply_markup(chat_id, message_id, reply_markup)
+
+    async def edit_message_caption(self, chat_id: int | str, message_id: int, *args, **kwargs) -> Message:
+        self._remember_content(chat_id, message_id, None)
+        return await super().edit_message_caption(chat_id, message_id, *args, **kwargs)
+
+    async def edit_message_media(self, chat_id: int | str, message_id: int, *args, **kwargs) -> Message:
+        self._remember_content(chat_id, message_id, None)
+        return await super().edit_message_media(chat_id, message_id, *args, **kwargs)
+
     # noinspection PyUnresolvedReferences
     async def listen_message(self,
                              chat_id: int,
                              filters=None,
                              timeout: int = None) -> Message:
-        return await super().listen_message(chat_id, filters, timeout)
+        with span('user_input', idle=True):
+            async with self.user_dispatcher.idle():
+                return await super().listen_message(chat_id, filters, timeout)
 
     # noinspection PyUnresolvedReferences
     async def ask_message(self,
@@ -470,11 +683,13 @@ class BotClient(Client):
                               inline_message_id: str = None,
                               filters=None,
                               timeout: int = None) -> CallbackQuery:
-        return await super().listen_callback(chat_id,
-                                             message_id,
-                                             inline_message_id,
-                                             filters,
-                                             timeout)
+        with span('user_input', idle=True):
+            async with self.user_dispatcher.idle():
+                return await super().listen_callback(chat_id,
+                                                     message_id,
+                                                     inline_message_id,
+                                                     filters,
+                                                     timeout)
 
     async def ask_message_silently(self, message: Message,
                                    text: str, *args,
@@ -508,7 +723,8 @@ class BotClient(Client):
         if self.test_mode:
             return
 
-        await self.telegram_logger.schedule_message_log(self, session, message)
+        with span('logger'):
+            await self.telegram_logger.schedule_message_log(self, session, message)
 
     async def log_callback(self, session: UserSession, callback_query: CallbackQuery):
         """Sends callback query log to the log channel."""
@@ -516,7 +732,8 @@ class BotClient(Client):
         if self.test_mode:
             return
 
-        await self.telegram_logger.schedule_callback_log(self, session, callback_query)
+        with span('logger'):
+            await self.telegram_logger.schedule_callback_log(self, session, callback_query)
 
     async def log_inline(self, session: UserSession, inline_query: InlineQuery):
         """Sends an inline query log to the log channel."""
@@ -524,4 +741,5 @@ class BotClient(Client):
         if self.test_mode:
             return
 
-        await self.telegram_logger.schedule_inline_log(self, session, inline_query)
+        with span('logger'):
+            await self.telegram_logger.schedule_inline_log(self, session, inline_query)
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+import itertools
+import logging
+from typing import Callable, Hashable
+
+
+__all__ = ('UserDispatcher',)
+
+
+logger = logging.getLogger('INCS2bot.dispatcher')
+
+
+class _Lane:
+    """Updates of one user: handled one at a time, in the order they came."""
+
+    __slots__ = ('lock', 'queued', 'latest')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()  # asyncio locks are fair, so waiters go in FIFO order
+        self.queued = 0
+        self.latest: dict[Hashable, int] = {}  # collapse key -> sequence number of its newest update
+
+
+class _Turn:
+    """What the update being handled holds: its user's lane and a slot of the global limit."""
+
+    __slots__ = ('lane', 'holds_lane', 'holds_slot')
+
+    def __init__(self, lane: _Lane):
+        self.lane = lane
+        self.holds_lane = False
+        self.holds_slot = False
+
+
+_current_turn: ContextVar[_Turn | None] = ContextVar('current_turn', default=None)
+
+
+class UserDispatcher:
+    """
+    Runs update handlers in background tasks, so Pyrogram's workers only have to hand updates over.
+
+    Updates of the same user are handled one after another, in order, so handlers never touch
+    the same ``UserSession`` at once; different users are handled concurrently, at most ``max_concurrency``
+    updates at a time. An update with a ``collapse_key`` (e.g. a callback with its message id) is dropped
+    if a newer one with the same key arrives while it's still queued: only the last tap on a message matters.
+
+    While a handler waits for the user to answer (``idle()``), it gives its slot and its lane away,
+    so neither other users nor the user's own next updates (a command, a tap on another message) are stuck
+    behind it for as long as the listen timeout, and takes them back before going on.
+    Updates that don't change the session (inline queries) can go in a lane of their own (``lane_name``).
+    """
+
+    def __init__(self, max_concurrency: int = 16):
+        self.max_concurrency = max_concurrency
+        self.dispatched = 0
+        self.collapsed = 0
+
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._lanes: dict[Hashable, _Lane] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._sequence = itertools.count()
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    def dispatch(self, user_id: int, func: Callable, *args,
+                 collapse_key: Hashable = None, lane_name: Hashable = None) -> asyncio.Task:
+        lane_key = user_id if lane_name is None else (user_id, lane_name)
+        lane = self._lanes.get(lane_key)
+        if lane is None:
+            lane = self._lanes[lane_key] = _Lane()
+
+        sequence = next(self._sequence)
+        if collapse_key is not None:
+            lane.latest[collapse_key] = sequence
+        lane.queued += 1
+        self.dispatched += 1
+
+        task = asyncio.create_task(self._run(user_id, lane_key, lane, sequence, collapse_key, func, *args))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, user_id: int, lane_key: Hashable, lane: _Lane, sequence: int, collapse_key: Hashable,
+                   func: Callable, *args):
+        turn = _Turn(lane)
+        _current_turn.set(turn)  # the task runs in its own copy of the context
+        try:
+            await lane.lock.acquire()
+            turn.holds_lane = True
+
+            if collapse_key is not None and lane.latest.get(collapse_key) != sequence:
+                self.collapsed += 1
+                return
+
+            await self._slots.acquire()
+            turn.holds_slot = True
+
+            # noinspection PyBroadException
+            try:
+                return await func(*args)
+            except Exception:
+                logger.exception(f'Caught exception while handling an update of {user_id}!')
+        finally:
+            self._release(turn)
+            lane.queued -= 1
+            if collapse_key is not None and lane.latest.get(collapse_key) == sequence:
+                del lane.latest[collapse_key]
+            if lane.queued == 0:
+                self._lanes.pop(lane_key, None)
+
+    def _release(self, turn: _Turn):
+        if turn.holds_slot:
+            self._slots.release()
+            turn.holds_slot = False
+        if turn.holds_lane:
+            turn.lane.lock.release()
+            turn.holds_lane = False
+
+    @asynccontextmanager
+    async def idle(self):
+        """Lets other updates through while the handler waits for the user, then waits for its turn again."""
+
+        turn = _current_turn.get()
+        if turn is None or not turn.holds_lane:
+            yield
+            return
+
+        self._release(turn)
+        try:
+            yield
+        finally:
+            await turn.lane.lock.acquire()
+            turn.holds_lane = True
+            await self._slots.acquire()
+            turn.holds_slot = True
+
+    async def join(self):
+        """Waits for every dispatched update to be handled."""
+
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
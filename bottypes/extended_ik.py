@@ -1,4 +1,6 @@
-from copy import deepcopy
+from __future__ import annotations
+
+from contextvars import ContextVar, Token
 
 from pyrogram.types import (CallbackGame,
                             InlineKeyboardButton,
@@ -9,7 +11,11 @@ from pyrogram.types import (CallbackGame,
 from l10n import Locale
 
 
-__all__ = ('ExtendedIKB', 'ExtendedIKM')
+__all__ = ('ExtendedIKB', 'ExtendedIKM', 'SelectedIKM', 'SelectionIndex')
+
+
+# id(markup) -> selected key, for the update being handled
+_selection_overlay: ContextVar[dict[int, str]] = ContextVar('selection_overlay', default={})
 
 
 class ExtendedIKB(InlineKeyboardButton):
@@ -42,6 +48,8 @@ class ExtendedIKB(InlineKeyboardButton):
         if self.url:
             self.url_key = self.url
 
+        self._compiled = {}  # (lang code, selected) -> InlineKeyboardButton
+
     def set_localed_text(self, locale: Locale):
         if self.translatable:
             self.text = locale.get(self.text_key)
@@ -53,16 +61,59 @@ class ExtendedIKB(InlineKeyboardButton):
         if self.selectable and self.selected:
             self.text = f'{self.SELECTION_INDICATOR} {self.text} {self.SELECTION_INDICATOR}'
 
+    def matches(self, key: str) -> bool:
+        return self.selectable and key is not None and (self.text_key == key or self.callback_data == key)
+
+    def compiled(self, locale: Locale, selected: bool = False) -> InlineKeyboardButton:
+        """
+        Returns a plain ``InlineKeyboardButton`` translated to ``locale``, built once and shared afterwards,
+        so it must not be modified.
+        """
+
+        cache_key = (locale.lang_code, selected)
+        button = self._compiled.get(cache_key)
+        if button is not None:
+            return button
+
+        text, url = self.text_key, self.url_key
+        if self.translatable:
+            text = locale.get(self.text_key)
+            if self.url_key:
+                url = locale.get(self.url_key)
+
+        if self.selectable and selected:
+            text = f'{self.SELECTION_INDICATOR} {text} {self.SELECTION_INDICATOR}'
+
+        button = InlineKeyboardButton(text, self.callback_data, url, self.web_app, self.login_url, self.user_id,
+                                      self.switch_inline_query, self.switch_inline_query_current_chat,
+                                      self.callback_game)
+        return self._compiled.setdefault(cache_key, button)
+
     def localed(self, locale: Locale):
-        copy = deepcopy(self)
-        copy.set_localed_text(locale)
-        return copy
+        return self.compiled(locale, self.selected)
 
     def __call__(self, locale: Locale):
         return self.localed(locale)
 
 
 class ExtendedIKM(InlineKeyboardMarkup):
+    """
+    Markup template: calling it with a locale returns a plain ``InlineKeyboardMarkup``, compiled once
+    per (locale, selected key) and shared by everyone asking for the same variant, so it must not be modified.
+
+    Selection is never stored in the template, it's applied at render time: either explicitly
+    with ``select()`` or by ``SelectionIndex`` for the update being handled.
+    """
+
+    def __init__(self, inline_keyboard: list[list[InlineKeyboardButton]]):
+        super().__init__(inline_keyboard)
+        self.selectable_keys = frozenset(key
+                                         for button in self.iter_buttons()
+                                         if isinstance(button, ExtendedIKB) and button.selectable
+                                         for key in (button.text_key, button.callback_data)
+                                         if key is not None)
+        self._compiled = {}  # (lang code, selected key) -> InlineKeyboardMarkup
+
     def iter_buttons(self):
         for line in self.inline_keyboard:
             for button in line:
@@ -73,15 +124,70 @@ class ExtendedIKM(InlineKeyboardMarkup):
             if isinstance(button, ExtendedIKB):
                 button.set_localed_text(locale)
 
+    def compiled(self, locale: Locale, selected_key: str = None) -> InlineKeyboardMarkup:
+        if selected_key not in self.selectable_keys:
+            selected_key = None  # keys selecting nothing share the unselected variant
+
+        cache_key = (locale.lang_code, selected_key)
+        markup = self._compiled.get(cache_key)
+        if markup is not None:
+            return markup
+
+        keyboard = tuple(tuple(button.compiled(locale, button.matches(selected_key))
+                               if isinstance(button, ExtendedIKB) else button
+                               for button in line)
+                         for line in self.inline_keyboard)
+        return self._compiled.setdefault(cache_key, InlineKeyboardMarkup(keyboard))
+
+    def select(self, key: str) -> SelectedIKM:
+        return SelectedIKM(self, key)
+
     def localed(self, locale: Locale):
-        copy = deepcopy(self)
-        copy.update_locale(locale)
-        return copy
+        return self.compiled(locale, _selection_overlay.get().get(id(self)))
 
     def __call__(self, locale: Locale):
         return self.localed(locale)
 
-    def select_button_by_key(self, key: str):
-        for button in self.iter_buttons():
-            if isinstance(button, ExtendedIKB) and button.selectable:
-                button.selected = (button.text_key == key or button.callback_data == key)
+
+class SelectedIKM:
+    """``ExtendedIKM`` with a button selected, renders the same way."""
+
+    __slots__ = ('markup', 'key')
+
+    def __init__(self, markup: ExtendedIKM, key: str):
+        self.markup = markup
+        self.key = key
+
+    def localed(self, locale: Locale):
+        return self.markup.compiled(locale, self.key)
+
+    def __call__(self, locale: Locale):
+        return self.localed(locale)
+
+
+class SelectionIndex:
+    """
+    Reverse index of callback keys to the markups that have a selectable button with that key,
+    used to show which button got pressed without touching the markups themselves.
+    """
+
+    def __init__(self, markups: tuple[ExtendedIKM, ...]):
+        self._markups: dict[str, tuple[ExtendedIKM, ...]] = {}
+        for markup in markups:
+            for key in markup.selectable_keys:
+                self._markups[key] = self._markups.get(key, ()) + (markup,)
+
+    def markups_with(self, key: str) -> tuple[ExtendedIKM, ...]:
+        return self._markups.get(key, ())
+
+    def select(self, key: str) -> Token:
+        """
+        Selects ``key`` in every indexed markup containing it, for the current context only
+        (concurrent updates don't see each other's selection). Pass the token to ``reset()`` when done.
+        """
+
+        return _selection_overlay.set({id(markup): key for markup in self.markups_with(key)})
+
+    @staticmethod
+    def reset(token: Token):
+        _selection_overlay.reset(token)
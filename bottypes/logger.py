@@ -1,80 +1,330 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
+import asyncio
+from collections import deque, OrderedDict
+from functools import partial
+import logging
+import time
 from typing import NamedTuple, TYPE_CHECKING
 
+from pyrogram.errors import FloodWait
+from pyrogram.types import InlineKeyboardMarkup, User
+
 if TYPE_CHECKING:
     from typing import Callable
 
     from pyrogram.enums import ParseMode
-    from pyrogram.types import CallbackQuery, InlineQuery, InlineKeyboardMarkup, Message, User
+    from pyrogram.types import CallbackQuery, InlineQuery, Message
 
     from .botclient import BotClient
     from .sessions import UserSession
 
 
-def limit_message_length(text: str, limit: int = 4000) -> str:
-    if len(text) <= limit:
+logger = logging.getLogger('INCS2bot.logger')
+
+MESSAGE_LIMIT = 4096  # in UTF-16 code units, the way Telegram counts them
+
+# Telegram lets bots send about 20 messages a minute to the same group or channel
+SEND_RATE = 20 / 60  # messages per second
+SEND_BURST = 3
+
+# budget of queued events, over it they get folded or dropped
+MAX_QUEUED_EVENTS = 10_000
+MAX_QUEUED_BYTES = 4 * 1024 ** 2  # of their text
+# budget of system logs (e.g. exceptions), events can't take it
+SYSTEM_LOGS_BYTES = 1024 ** 2
+
+MESSAGE, CALLBACK, INLINE = 'message', 'callback', 'inline'
+LOW_VALUE_EVENTS = frozenset((CALLBACK, INLINE))  # users click and type a lot of them
+
+
+def _text_length(text: str) -> int:
+    return len(text.encode('utf-16-le')) // 2
+
+
+def limit_message_length(text: str, limit: int = MESSAGE_LIMIT) -> str:
+    if _text_length(text) <= limit:
         return text
 
     warning_message = ('\n\n'
                        '(The original log message is too long to display fully.)\n'
                        '(Syb: looks like some shit really hit the fan)')
 
-    return text[:limit - len(warning_message) - 3] + '...' + warning_message
+    kept = text.encode('utf-16-le')[:(limit - len(warning_message) - 3) * 2].decode('utf-16-le', 'ignore')
+    return kept + '...' + warning_message
+
+
+class TokenBucket:
+    """Paces sending: ``rate`` tokens a second, with up to ``capacity`` of them saved up for bursts."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        self._refill()
+        while self._tokens < 1:
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+            self._refill()
+        self._tokens -= 1
+
+    def drain(self, seconds: float = 0):
+        """Spends all the tokens, and owes the ones of the next ``seconds`` (e.g. when Telegram asks to wait)."""
+
+        self._refill()
+        self._tokens = -seconds * self.rate
 
 
 class SystemLogPayload(NamedTuple):
-    client: BotClient
     text: str
     disable_notification: bool
     reply_markup: InlineKeyboardMarkup
     parse_mode: ParseMode
+    timestamp: float  # monotonic, of scheduling
+    repeats: int = 0  # of the same log, folded into this one
 
 
 class EventLogPayload(NamedTuple):
-    client: BotClient
-    user: User
-    session: UserSession
-    result_text: str
+    """Only what the log line needs, so the queue doesn't keep clients, users and sessions alive."""
+
+    kind: str
+    user_id: int
+    username: str | None
+    first_name: str | None
+    display_name: str
+    language_code: str | None  # of the Telegram client
+    lang_code: str  # of the session
+    text: str
+    timestamp: float  # monotonic, of scheduling
+    repeats: int = 0  # of the events of the same kind, folded into this one
+
+    @classmethod
+    def of(cls, kind: str, user: User, session: UserSession, text: str) -> EventLogPayload:
+        display_name = f'@{user.username}' if user.username is not None else f'{user.mention} (username hidden)'
+        return cls(kind, user.id, user.username, user.first_name, display_name, user.language_code,
+                   session.locale.lang_code, text, time.monotonic())
 
 
-SYSTEM = 'system'
+def _payload_size(payload: SystemLogPayload | EventLogPayload) -> int:
+    return sum(len(field.encode()) for field in payload if isinstance(field, str))
 
 
 class BotLogger(ABC):
-    def __init__(self, log_channel_id: int):
+    """
+    Queues logs and sends them to the log channel as they come, as fast as the channel's rate limits allow:
+    system logs first, one per message, then events of as many users as fit in one message.
+
+    Events have a limited budget (``max_events`` and ``max_bytes``). Over it, low-value events
+    are folded into the previous event of the same kind of the user, the rest gets dropped.
+    System logs have a budget of their own (``system_max_bytes``) and are never dropped:
+    over it, repeats of the last one are folded into it.
+    """
+
+    def __init__(self, log_channel_id: int, send_rate: float = SEND_RATE, send_burst: int = SEND_BURST,
+                 max_events: int = MAX_QUEUED_EVENTS, max_bytes: int = MAX_QUEUED_BYTES,
+                 system_max_bytes: int = SYSTEM_LOGS_BYTES):
         self.log_channel_id = log_channel_id
-        self._logs_queue: dict[str, list[SystemLogPayload | EventLogPayload]] = {}
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.system_max_bytes = system_max_bytes
+
+        self._system_logs: deque[SystemLogPayload] = deque()
+        self._system_bytes = 0
+        self._system_in_flight = 0
+        self._event_logs: OrderedDict[int, deque[EventLogPayload]] = OrderedDict()  # user id -> events
+        self._events_queued = 0
+        self._event_bytes = 0
+        self._events_in_flight: dict[int, int] = {}  # user id -> events being sent
+        self._has_logs = asyncio.Event()
+        self._bucket = TokenBucket(send_rate, send_burst)
+        self._drainer: asyncio.Task | None = None
+
+        # counters of queued logs, both system and events ones
+        self.sent_logs = 0
+        self.folded_events = 0
+        self.dropped_events = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Logs waiting to be sent."""
+
+        return len(self._system_logs) + self._events_queued
+
+    @property
+    def queued_bytes(self) -> int:
+        return self._system_bytes + self._event_bytes
+
+    @property
+    def lag(self) -> float:
+        """Seconds the log at the head of the queue has been waiting for."""
+
+        heads = [logs[0].timestamp for logs in (self._system_logs, next(iter(self._event_logs.values()), None))
+                 if logs]
+        return time.monotonic() - min(heads) if heads else 0.0
 
     def is_queue_empty(self):
-        return not bool(self._logs_queue)
-
-    def put_into_queue(self, _id: str, payload: SystemLogPayload | EventLogPayload):
-        if self._logs_queue.get(_id) is None:
-            self._logs_queue[_id] = []
-
-        self._logs_queue[_id].append(payload)
-
-    async def process_queue(self):
-        """If the queue is not empty, takes the first request from it, deserialize it and send as a log."""
+        return not self._system_logs and not self._event_logs
+
+    def put_into_queue(self, payload: SystemLogPayload | EventLogPayload):
+        if isinstance(payload, SystemLogPayload):
+            self._put_system_log(payload)
+        else:
+            self._put_event(payload)
+
+        self._has_logs.set()
+
+    def _put_system_log(self, payload: SystemLogPayload):
+        size = _payload_size(payload)
+        if self._system_bytes + size > self.system_max_bytes and len(self._system_logs) > self._system_in_flight:
+            last = self._system_logs[-1]
+            if last.text == payload.text:
+                self._system_logs[-1] = last._replace(repeats=last.repeats + 1)
+                self.folded_events += 1
+                return
+
+        self._system_logs.append(payload)
+        self._system_bytes += size
+
+    def _put_event(self, payload: EventLogPayload):
+        size = _payload_size(payload)
+        events = self._event_logs.get(payload.user_id)
+        if self._events_queued < self.max_events and self._event_bytes + size <= self.max_bytes:
+            if events is None:
+                events = self._event_logs[payload.user_id] = deque()
+            events.append(payload)
+            self._events_queued += 1
+            self._event_bytes += size
+            return
 
-        if self.is_queue_empty():
+        if (payload.kind in LOW_VALUE_EVENTS and events is not None
+                and len(events) > self._events_in_flight.get(payload.user_id, 0) and events[-1].kind == payload.kind):
+            last = events[-1]
+            events[-1] = payload._replace(timestamp=last.timestamp, repeats=last.repeats + 1)
+            self._event_bytes += size - _payload_size(last)
+            self.folded_events += 1
             return
 
-        userid = tuple(self._logs_queue)[0]
-        logged_events = self._logs_queue[userid]
+        self.dropped_events += 1
 
-        if userid == SYSTEM:  # invoked by system, not user
-            payload = logged_events.pop(0)
+    def start(self, client: BotClient):
+        """Starts sending logs with the ``client`` as they get queued."""
 
-            if not logged_events:  # if empty after popping
-                del self._logs_queue[userid]
+        if self._drainer is None:
+            self._drainer = asyncio.create_task(self.run(client))
 
-            return await self.send_system_log(payload)
+    async def stop(self):
+        if self._drainer is None:
+            return
 
-        del self._logs_queue[userid]
-        return await self.send_event_log(logged_events)
+        self._drainer.cancel()
+        try:
+            await self._drainer
+        except asyncio.CancelledError:
+            pass
+        self._drainer = None
+
+    async def run(self, client: BotClient):
+        while True:
+            await self._has_logs.wait()
+            await self._bucket.acquire()
+            try:
+                await self.process_queue(client)
+            except FloodWait as e:  # the ones longer than the client's sleep threshold
+                logger.warning(f'Log channel is flooded, waiting for {e.value} seconds')
+                self._bucket.drain(e.value)
+            except Exception:
+                logger.exception('Failed to send a log!')
+
+            if self.is_queue_empty():
+                self._has_logs.clear()
+
+    async def process_queue(self, client: BotClient):
+        """
+        Sends the next message of the queue. What doesn't get sent because of ``FloodWait`` stays in the queue,
+        because of other errors, gets dropped.
+        """
+
+        if self._system_logs:
+            count = 1
+            sending = self.send_system_log(client, self._system_logs[0])
+            forget = self._forget_system_log
+            self._system_in_flight = 1
+        elif self._event_logs:
+            text, users, taken = self._pack_events()
+            count = sum(taken.values())
+            sending = self.send_log(client, text, reply_markup=self.build_event_markup(users))
+            forget = partial(self._forget_events, taken)
+            self._events_in_flight = taken
+        else:
+            return
+
+        try:
+            await sending
+        except FloodWait:
+            raise
+        except Exception:
+            self.dropped_events += count
+            forget()
+            raise
+        finally:
+            self._system_in_flight = 0
+            self._events_in_flight = {}
+
+        self.sent_logs += count
+        forget()
+
+    def _pack_events(self) -> tuple[str, list[User], dict[int, int]]:
+        """Text of the events of the first users in the queue, the users and how many events of each got in."""
+
+        blocks, users, taken = [], [], {}
+        length = 0
+        for user_id, events in self._event_logs.items():
+            last = events[-1]
+            lines = [self.format_event_header(last)]
+            size = length + (2 if blocks else 0) + _text_length(lines[0])
+            for event in events:
+                line = self.format_event(event)
+                line_size = 1 + _text_length(line)
+                if size + line_size > MESSAGE_LIMIT:
+                    break
+                lines.append(line)
+                size += line_size
+
+            if len(lines) == 1:
+                if blocks:
+                    break
+                # an event too long for a message of its own
+                lines.append(limit_message_length(self.format_event(events[0]), MESSAGE_LIMIT - size - 1))
+
+            blocks.append('\n'.join(lines))
+            users.append(User(id=user_id, username=last.username, first_name=last.first_name))
+            taken[user_id] = len(lines) - 1
+            length = size
+            if taken[user_id] < len(events):  # the message is full
+                break
+
+        return '\n\n'.join(blocks), users, taken
+
+    def _forget_system_log(self):
+        self._system_bytes -= _payload_size(self._system_logs.popleft())
+
+    def _forget_events(self, taken: dict[int, int]):
+        for user_id, count in taken.items():
+            events = self._event_logs[user_id]
+            for _ in range(count):
+                self._event_bytes -= _payload_size(events.popleft())
+            if not events:
+                del self._event_logs[user_id]
+            self._events_queued -= count
 
     async def schedule_system_log(self, client: BotClient, text: str,
                                   disable_notification: bool = True,
@@ -82,29 +332,26 @@ class BotLogger(ABC):
                                   parse_mode: ParseMode = None):
         """Put sending a system log into the queue."""
 
-        self.put_into_queue(SYSTEM, SystemLogPayload(client, text, disable_notification, reply_markup, parse_mode))
+        self.put_into_queue(SystemLogPayload(text, disable_notification, reply_markup, parse_mode, time.monotonic()))
 
     async def schedule_message_log(self, client: BotClient, session: UserSession, message: Message):
         """Put sending a message log into the queue."""
 
-        user = message.from_user
         message_text = message.text if message.text is not None else ""
 
-        self.put_into_queue(str(message.from_user.id), EventLogPayload(client, user, session, f'✍️: "{message_text}"'))
+        self.put_into_queue(EventLogPayload.of(MESSAGE, message.from_user, session, f'✍️: "{message_text}"'))
 
     async def schedule_callback_log(self, client: BotClient, session: UserSession, callback_query: CallbackQuery):
         """Put sending a callback query log into the queue"""
 
-        user = callback_query.from_user
-
-        self.put_into_queue(str(user.id), EventLogPayload(client, user, session, f'🔀: {callback_query.data}'))
+        self.put_into_queue(EventLogPayload.of(CALLBACK, callback_query.from_user, session,
+                                               f'🔀: {callback_query.data}'))
 
     async def schedule_inline_log(self, client: BotClient, session: UserSession, inline_query: InlineQuery):
         """Put sending an inline query log into the queue."""
 
-        user = inline_query.from_user
-
-        self.put_into_queue(str(user.id), EventLogPayload(client, user, session, f'🛰: "{inline_query.query}"'))
+        self.put_into_queue(EventLogPayload.of(INLINE, inline_query.from_user, session,
+                                               f'🛰: "{inline_query.query}"'))
 
     async def send_log(self, client: BotClient, text: str,
                        disable_notification: bool = True,
@@ -117,16 +364,34 @@ class BotLogger(ABC):
                                   reply_markup=reply_markup,
                                   parse_mode=parse_mode)
 
-    @abstractmethod
-    async def send_system_log(self, payload: SystemLogPayload):
+    async def send_system_log(self, client: BotClient, payload: SystemLogPayload):
         """Sends log to the log channel immediately, avoiding the queue."""
 
-        raise NotImplementedError
+        text = payload.text
+        if payload.repeats:
+            text += f'\n\n(repeated {payload.repeats + 1} times)'
+        return await self.send_log(client, text,
+                                   payload.disable_notification,
+                                   payload.reply_markup,
+                                   payload.parse_mode)
+
+    @staticmethod
+    def format_event_header(payload: EventLogPayload) -> str:
+        return '\n'.join((f'👤: {payload.display_name}',
+                          f'ℹ️: {payload.user_id}',
+                          f'✈️: {payload.language_code}',
+                          f'⚙️: {payload.lang_code}',
+                          f'━━━━━━━━━━━━━━━━━━━━━━━'))
+
+    @staticmethod
+    def format_event(payload: EventLogPayload) -> str:
+        if payload.repeats:
+            return f'{payload.text} (+{payload.repeats} before it)'
+        return payload.text
 
     @abstractmethod
-    async def send_event_log(self, payload: list[EventLogPayload],
-                             reply_markup: InlineKeyboardMarkup = None):
-        """Sends log to the log channel immediately, avoiding the queue."""
+    def build_event_markup(self, users: list[User]) -> InlineKeyboardMarkup | None:
+        """Markup of a message with events of the ``users``."""
 
         raise NotImplementedError
 
@@ -134,62 +399,24 @@ class BotLogger(ABC):
 class PlainBotLogger(BotLogger):
     """Made to work in a pair with BotClient handling logging stuff."""
 
-    async def send_system_log(self, payload: SystemLogPayload):
-        """Sends log to the log channel immediately, avoiding the queue."""
-
-        return await self.send_log(payload.client,
-                                   payload.text,
-                                   payload.disable_notification,
-                                   payload.reply_markup,
-                                   payload.parse_mode)
-
-    async def send_event_log(self, payloads: list[EventLogPayload],
-                             reply_markup: InlineKeyboardMarkup = None):
-        """Sends log to the log channel immediately, avoiding the queue."""
-        client = payloads[-1].client
-        user = payloads[-1].user
-        session = payloads[-1].session
-        display_name = f'@{user.username}' if user.username is not None else f'{user.mention} (username hidden)'
-
-        text = [f'👤: {display_name}',
-                f'ℹ️: {user.id}',
-                f'✈️: {user.language_code}',
-                f'⚙️: {session.locale.lang_code}',
-                f'━━━━━━━━━━━━━━━━━━━━━━━'] + [event.result_text for event in payloads]
-
-        return await self.send_log(client, '\n'.join(text),
-                                   reply_markup=reply_markup)
+    def build_event_markup(self, users: list[User]) -> InlineKeyboardMarkup | None:
+        return None
 
 
 class ReplyBackBotLogger(BotLogger):
     def __init__(self, log_channel_id: int,
-                 event_reply_markup_builder: Callable[[User], InlineKeyboardMarkup] = lambda _: None):
-        super().__init__(log_channel_id)
+                 event_reply_markup_builder: Callable[[User], InlineKeyboardMarkup] = lambda _: None,
+                 **kwargs):
+        super().__init__(log_channel_id, **kwargs)
 
         self.event_reply_markup_builder = event_reply_markup_builder
 
-    async def send_system_log(self, payload: SystemLogPayload):
-        """Sends log to the log channel immediately, avoiding the queue."""
-
-        return await self.send_log(payload.client,
-                                   payload.text,
-                                   payload.disable_notification,
-                                   payload.reply_markup,
-                                   payload.parse_mode)
-
-    async def send_event_log(self, payloads: list[EventLogPayload],
-                             reply_markup: InlineKeyboardMarkup = None):
-        """Sends log to the log channel immediately, avoiding the queue."""
-        client = payloads[-1].client
-        user = payloads[-1].user
-        session = payloads[-1].session
-        display_name = f'@{user.username}' if user.username is not None else f'{user.mention} (username hidden)'
-
-        text = [f'👤: {display_name}',
-                f'ℹ️: {user.id}',
-                f'✈️: {user.language_code}',
-                f'⚙️: {session.locale.lang_code}',
-                f'━━━━━━━━━━━━━━━━━━━━━━━'] + [event.result_text for event in payloads]
+    def build_event_markup(self, users: list[User]) -> InlineKeyboardMarkup | None:
+        """Reply buttons of all the ``users``, one under another."""
 
-        return await self.send_log(client, '\n'.join(text),
-                                   reply_markup=self.event_reply_markup_builder(user))
+        rows = []
+        for user in users:
+            markup = self.event_reply_markup_builder(user)
+            if markup is not None:
+                rows += markup.inline_keyboard
+        return InlineKeyboardMarkup(rows) if rows else None
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import asyncio
 import typing
-from typing import Callable, TypeAlias
+from typing import Callable, Iterable, TypeAlias
 
 from pyrogram.errors import UserIsBlocked, MessageNotModified
 
@@ -16,6 +16,40 @@ if typing.TYPE_CHECKING:
     CallbackProcess: TypeAlias = Callable[[BotClient, UserSession, CallbackQuery], ...]
 
 
+class MenuCodes:
+    """
+    Small integer codes of menu ids. Ids are ``__qualname__``s and locale keys, so they are long
+    and change with refactors, while the codes are kept by every session and user in the db,
+    and once persisted, never change: a renamed menu keeps its code if its row gets renamed too.
+    """
+
+    def __init__(self):
+        self._codes: dict[str, int] = {}
+
+    def __len__(self):
+        return len(self._codes)
+
+    def __getitem__(self, menu_id: str) -> int:
+        """Code of the menu id; a new one gets the next free code."""
+
+        code = self._codes.get(menu_id)
+        if code is None:
+            code = self._codes[menu_id] = max(self._codes.values(), default=0) + 1
+        return code
+
+    def as_dict(self) -> dict[str, int]:
+        return self._codes.copy()
+
+    def load(self, persisted: dict[str, int], menu_ids: Iterable[str]) -> dict[str, int]:
+        """
+        Replaces the codes with the persisted ones. Returns codes given to the ``menu_ids``
+        that weren't persisted yet, which have to be persisted as well.
+        """
+
+        self._codes = dict(persisted)
+        return {menu_id: self[menu_id] for menu_id in menu_ids if menu_id not in persisted}
+
+
 class Menu:
     def __init__(self,
                  _id: str,
@@ -25,12 +59,14 @@ class Menu:
                  ignore_message_not_modified: bool,
                  **kwargs):
         self.id = _id
+        self.code: int | None = None  # what sessions and the db keep instead of the id, see ``MenuCodes``
 
         # menu functionality
         self.func = func
         self.args = args
         self.kwargs = kwargs
         self.came_from_menu_id = came_from_menu_id
+        self.came_from_code: int | None = None
 
         # utils
         self.ignore_message_not_modified = ignore_message_not_modified
@@ -48,10 +84,10 @@ class Menu:
             return
 
     def __repr__(self):
-        return f'<{self.__class__.__name__}(id={self.id}, func={self.func})>'
+        return f'<{self.__class__.__name__}(id={self.id}, code={self.code}, func={self.func})>'
 
-    def can_come_from(self, _id):
-        return self.came_from_menu_id == _id
+    def can_come_from(self, code: int | None):
+        return self.came_from_code == code
 
 
 class NavMenu(Menu):
@@ -1,54 +1,59 @@
 from __future__ import annotations
 
+from array import array
+import asyncio
+from collections import OrderedDict
 import datetime as dt
 import logging
+from pathlib import Path
+import time
+from typing import Collection
 
 from pyrogram.types import Message, User
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
 
-from db import db_session, User as DBUser
+from db import db_session
+from db.stores import NewUser, SessionStore, UserChanges, UserRecord
 
 
-__all__ = ('UserSession', 'UserSessions')
+__all__ = ('UserSession', 'EphemeralSession', 'UserSessions')
 
 
 logger = logging.getLogger('INCS2bot.sessions')
 
-
 class UserSession:
     __slots__ = ('dbuser_id', 'timestamp', 'current_menu_id',
                  'previous_menu_id', 'lang_code', 'last_bot_pm_id',
-                 'locale')
+                 'locale', 'dirty')
+
+    PERSISTED_FIELDS = frozenset(('current_menu_id', 'previous_menu_id', 'lang_code', 'last_bot_pm_id'))
 
-    def __init__(self, dbuser: DBUser):
+    def __init__(self, dbuser: UserRecord):
         from functions import locale
 
         self.dbuser_id = dbuser.id
-        self.timestamp = dt.datetime.now().timestamp()
-        self.current_menu_id = dbuser.current_menu_id
+        self.timestamp = time.monotonic()  # of the last access, only meaningful for expiry
+        self.current_menu_id = dbuser.current_menu_id  # codes of the menus, see ``MenuCodes``
         self.previous_menu_id = dbuser.previous_menu_id
         self.lang_code = dbuser.language
         self.last_bot_pm_id = dbuser.last_bot_pm_id
         self.locale = locale(self.lang_code)
+        self.dirty = False  # whether the session has changes the db doesn't have yet
 
-    async def sync_with_db_session(self, db_sess: AsyncSession):
-        """Don't forget to call ``await db_sess.commit()`` to save changes!!!"""
+    def __setattr__(self, name: str, value):
+        if name in self.PERSISTED_FIELDS and getattr(self, name, None) != value:
+            object.__setattr__(self, 'dirty', True)
+        object.__setattr__(self, name, value)
 
-        # noinspection PyTypeChecker
-        query = select(DBUser).where(DBUser.id == self.dbuser_id)
-        dbuser = (await db_sess.execute(query)).scalar()
-        dbuser.current_menu_id = self.current_menu_id
-        dbuser.previous_menu_id = self.previous_menu_id
-        dbuser.language = self.lang_code
-        dbuser.last_bot_pm_id = self.last_bot_pm_id
-        return dbuser
+    def as_row(self) -> UserChanges:
+        return UserChanges(self.dbuser_id, self.current_menu_id, self.previous_menu_id,
+                           self.lang_code, self.last_bot_pm_id)
 
     async def sync_with_db(self):
-        async with db_session.create_session() as db_sess:
-            dbuser = await self.sync_with_db_session(db_sess)
-            logger.info(f'UserSession synced with db! {dbuser=}')
-            await db_sess.commit()
+        """Saves this session alone, mostly the business of ``UserSessions.flush()``."""
+
+        self.dirty = False
+        await db_session.store().put_many((self.as_row(),))
+        logger.info(f'UserSession synced with db! {self.dbuser_id=}')
 
     def update_lang(self, lang_code: str):
         from functions import locale
@@ -57,60 +62,247 @@ class UserSession:
         self.locale = locale(self.lang_code)
 
 
-class UserSessions(dict[int, UserSession]):
+class EphemeralSession:
+    """
+    Session of a user the bot only answers in passing (inline queries, commands in group chats),
+    built from the user's Telegram language and never saved. Menu state is read-only,
+    the user gets a ``UserSession`` once they open the bot in PM.
+    """
+
+    __slots__ = ('lang_code', 'locale')
+
+    dbuser_id = None
+    current_menu_id = None
+    previous_menu_id = None
+    last_bot_pm_id = None
+    dirty = False
+
+    def __init__(self, lang_code: str | None):
+        from functions import locale
+
+        self.lang_code = lang_code
+        self.locale = locale(lang_code)
+
+
+class UserSessions(OrderedDict[int, UserSession]):
+    """
+    Sessions of the users the bot is talking to, written behind: changes stay in memory
+    and ``flush()`` saves the ones the db doesn't have yet in a single bulk UPDATE.
+
+    Sessions are kept in the order of access, the least recently used first,
+    so expired sessions are always at the front and evicting them doesn't look at the rest.
+    """
+
     SESSIONS_LIFETIME = dt.timedelta(hours=1)
+    EVICTION_BATCH = 1000
+    REGISTRATION_WINDOW = 0.005  # seconds to gather new sessions for, to look them up and insert in one go
+
+    clock = time.monotonic
+
+    def __init__(self, *args, store: SessionStore = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._store = store
+        self._evicted_rows: dict[int, UserChanges] = {}  # dbuser id -> unsaved changes of sessions already cleared
+        self._flush_lock = asyncio.Lock()
+
+        self._registering: dict[int, asyncio.Future[UserSession]] = {}  # user id -> registration in flight
+        self._registration_batch: dict[int, tuple[User, Message | None]] = {}
+        self._registration_task: asyncio.Task | None = None
+
+    @property
+    def store(self) -> SessionStore:
+        """Where the sessions are saved: the one given or the one ``db_session`` was initialized with."""
+
+        return self._store or db_session.store()
 
     def __getitem__(self, key: int):
         item = super().__getitem__(key)
-        item.timestamp = dt.datetime.now().timestamp()
+        item.timestamp = self.clock()
+        self.move_to_end(key)
         return item
 
-    async def sync_with_db(self):
-        async with db_session.create_session() as db_sess:
+    def __setitem__(self, key: int, value: UserSession):
+        value.timestamp = self.clock()
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+
+    def evict_timeout_sessions(self, limit: int | None = EVICTION_BATCH) -> int:
+        """
+        Clear up to ``limit`` sessions that exceed the lifetime, leaving their changes for the next flush.
+        Returns how many sessions were cleared.
+        """
+
+        deadline = self.clock() - self.SESSIONS_LIFETIME.total_seconds()
+
+        evicted = 0
+        while self and (limit is None or evicted < limit):
+            _id = next(iter(self))
+            session = super().__getitem__(_id)
+            if session.timestamp > deadline:
+                break
+
+            if session.dirty:
+                self._evicted_rows[session.dbuser_id] = session.as_row()
+            del self[_id]
+            evicted += 1
+
+        if evicted:
+            logger.debug(f'Cleared {evicted} timed-out sessions.')
+        return evicted
+
+    async def flush(self) -> int:
+        """Saves the changed sessions in one transaction. Returns how many of them were saved."""
+
+        async with self._flush_lock:
+            rows = self._evicted_rows
+            self._evicted_rows = {}
             for session in self.values():
-                await session.sync_with_db_session(db_sess)
+                if session.dirty:
+                    rows[session.dbuser_id] = session.as_row()
+                    session.dirty = False  # changes made while the rows are written make it dirty again
+
+            if not rows:
+                return 0
+
+            try:
+                await self.store.put_many(list(rows.values()))
+            except BaseException:
+                self._evicted_rows = rows | self._evicted_rows  # try again with the next flush
+                raise
 
-            logger.info(f'UserSessions synced with db! {len(self)} sessions were synced.')
-            await db_sess.commit()
+        logger.info(f'UserSessions flushed to db! {len(rows)} sessions were saved.')
+        return len(rows)
+
+    async def sync_with_db(self):
+        """Saves every session, changed or not."""
+
+        for session in self.values():
+            session.dirty = True
+        await self.flush()
+
+    def get_or_ephemeral(self, user: User) -> UserSession | EphemeralSession:
+        """The session of the user if there is one in memory, otherwise an ephemeral one: no db involved."""
+
+        if user.id in self:
+            return self[user.id]
+        return EphemeralSession(user.language_code)
 
     async def register_session(self, user: User, message: Message) -> UserSession:
+        """
+        Returns the session of the user, looking it up in the db (or adding the user there) if needed.
+        Concurrent calls for the same user share one registration, and registrations of different users
+        made within ``REGISTRATION_WINDOW`` share one query and one commit.
+        """
+
         if user.id in self:
             return self[user.id]
 
-        logger.info(f'Registering session with user {user.id=}, {user.username=}, {user.language_code=}')
+        future = self._registering.get(user.id)
+        if future is None:
+            logger.info(f'Registering session with user {user.id=}, {user.username=}, {user.language_code=}')
 
-        async with db_session.create_session() as db_sess:
-            query = select(DBUser).where(DBUser.userid == user.id)
-            dbuser = (await db_sess.execute(query)).scalar()
-            if dbuser is None:
-                dbuser = DBUser(userid=user.id,
-                                language=user.language_code,
-                                last_bot_pm_id=message.id if message else None)
-                db_sess.add(dbuser)
-                await db_sess.commit()
-                logger.info(f'New record in db! {dbuser=}')
-            else:
-                logger.info(f'Got existing record in db. {dbuser=}')
+            future = self._registering[user.id] = asyncio.get_running_loop().create_future()
+            self._registration_batch[user.id] = (user, message)
+            if self._registration_task is None:
+                self._registration_task = asyncio.create_task(self._register_batch())
 
-        self[user.id] = UserSession(dbuser)
+        return await asyncio.shield(future)  # a cancelled caller mustn't cancel the others
 
-        return self[user.id]
+    async def _register_batch(self):
+        await asyncio.sleep(self.REGISTRATION_WINDOW)
 
-    async def clear_timeout_sessions(self):
-        """Clear all sessions that exceed given timeout."""
+        batch = self._registration_batch
+        self._registration_batch = {}
+        self._registration_task = None  # users coming from now on go to the next batch
+
+        try:
+            store = self.store
+            dbusers = await self._get_records(batch)
+            logger.info(f'Got {len(dbusers)} existing records in db.')
+
+            new_users = [NewUser(user.id, user.language_code, message.id if message else None)
+                         for user, message in batch.values() if user.id not in dbusers]
+            if new_users:
+                new_dbusers = await store.add_many(new_users)
+                logger.info(f'{len(new_dbusers)} new records in db! {new_dbusers=}')
+                dbusers |= new_dbusers
+        except Exception as e:
+            for user_id in batch:
+                self._registering.pop(user_id).set_exception(e)
+            return
+        except BaseException:
+            for user_id in batch:
+                self._registering.pop(user_id).cancel()
+            raise
+
+        for user_id in batch:
+            self[user_id] = session = UserSession(dbusers[user_id])
+            self._registering.pop(user_id).set_result(session)
+
+    async def _get_records(self, user_ids: Collection[int]) -> dict[int, UserRecord]:
+        """Records of the users in the db, with the changes of their cleared sessions that aren't saved yet."""
 
-        now = dt.datetime.now()
+        async with self._flush_lock:  # rows being written are in the db after it, or back in ``_evicted_rows``
+            dbusers = await self.store.get_many(user_ids)
+            for user_id, record in dbusers.items():
+                changes = self._evicted_rows.get(record.id)
+                if changes is not None:
+                    dbusers[user_id] = record._replace(**changes._asdict())
+        return dbusers
 
-        sessions_timed_out = 0
-        async with db_session.create_session() as db_sess:
-            for _id, session in self.copy().items():
-                session_time = dt.datetime.fromtimestamp(session.timestamp)
-                if (now - session_time) > self.SESSIONS_LIFETIME:
-                    await session.sync_with_db_session(db_sess)
-                    del self[_id]
-                    sessions_timed_out += 1
+    def dump_snapshot(self, path: Path) -> int:
+        """
+        Writes which users are active and how long ago they were active, the least recent first:
+        the time of the dump, then pairs of user id and seconds since the last access, as 64-bit ints.
+        The sessions themselves are in the db (after a flush).
+        """
+
+        now = self.clock()
+        snapshot = array('q', [int(time.time())])
+        for user_id, session in self.items():
+            snapshot.extend((user_id, int(now - session.timestamp)))
+
+        with open(path, 'wb') as f:
+            snapshot.tofile(f)
+
+        logger.info(f'Dumped a snapshot of {len(self)} sessions.')
+        return len(self)
+
+    async def load_snapshot(self, path: Path) -> int:
+        """Brings back the sessions of a snapshot that haven't expired since. Returns how many were loaded."""
+
+        path = Path(path)
+        if not path.exists():
+            return 0
+
+        data = path.read_bytes()
+        snapshot = array('q')
+        if not data or len(data) % snapshot.itemsize:
+            logger.warning(f'Ignored an empty or broken snapshot of sessions ({len(data)} bytes).')
+            return 0
+        snapshot.frombytes(data)
+
+        downtime = time.time() - snapshot[0]
+        lifetime = self.SESSIONS_LIFETIME.total_seconds()
+        ages = {user_id: age + downtime for user_id, age in zip(snapshot[1::2], snapshot[2::2])
+                if age + downtime < lifetime and user_id not in self}
+
+        dbusers = await self._get_records(ages)
+
+        now = self.clock()
+        for user_id, age in ages.items():  # the least recent first, as they were
+            if user_id in dbusers:
+                self[user_id] = session = UserSession(dbusers[user_id])
+                session.timestamp = now - age
+
+        logger.info(f'Loaded {len(dbusers)} sessions from a snapshot.')
+        return len(dbusers)
+
+    async def clear_timeout_sessions(self):
+        """Clear all sessions that exceed given timeout."""
 
-            await db_sess.commit()
+        sessions_timed_out = self.evict_timeout_sessions(limit=None)
+        await self.flush()
 
         if sessions_timed_out != 0:
             logger.info(f'Cleared {sessions_timed_out} timed-out sessions.')
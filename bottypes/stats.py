@@ -7,9 +7,11 @@ class BotRegularStats:
     inline_queries_handled = 0
     unique_users_served = set()
     exceptions_caught = 0
+    message_edits_skipped = 0
 
     def clear(self):
         self.callback_queries_handled = 0
         self.inline_queries_handled = 0
         self.unique_users_served = set()
         self.exceptions_caught = 0
+        self.message_edits_skipped = 0
@@ -3,8 +3,6 @@ import datetime as dt
 import platform
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-import pandas as pd
-from pandas import DataFrame
 # noinspection PyPackageRequirements
 from pyrogram import Client
 if platform.system() == 'Linux':
@@ -18,7 +16,7 @@ from dcatlas import DatacenterAtlas
 from functions import caching, utime
 from functions.ulogging import get_logger
 from l10n import locale
-from utypes import ExchangeRate, GameServers, State, SteamWebAPI
+from utypes import ExchangeRate, GameServers, PlayerChart, PlayerCountBuffer, PlayerHistory, State, SteamWebAPI
 # from utypes import LeaderboardStats, LEADERBOARD_API_REGIONS
 
 execution_start_dt = dt.datetime.now()
@@ -28,6 +26,7 @@ update_cache_interval = 40
 unique_monthly_timing = 0
 check_currency_timing = 15
 fetch_leaderboard_timing = 30
+verify_alltime_peak_timing = 45
 
 loc = locale('ru')
 
@@ -42,18 +41,22 @@ bot = Client(config.BOT_CORE_MODULE_NAME,
              no_updates=True,
              workdir=config.SESS_FOLDER)
 steam_webapi = SteamWebAPI(config.STEAM_API_KEY, headers=config.REQUESTS_HEADERS)
+player_count_buffer = PlayerCountBuffer.open(config.DATA_FOLDER)
+player_chart = PlayerChart.open(config.DATA_FOLDER)
+player_history = PlayerHistory.open(config.DATA_FOLDER, player_chart)
 
 
 def remap_datacenters_info(info: dict[str, dict[str, str]]):
     return {dc.id: dc.remap(info) for dc in DatacenterAtlas.available_dcs()}
 
 
-def get_player_24h_peak(df: DataFrame):
-    now = utime.utcnow()
-    end_date = f'{now:%Y-%m-%d %H:%M:%S}'
-    start_date = f'{(now - dt.timedelta(days=1)):%Y-%m-%d %H:%M:%S}'
-    mask = (df['DateTime'] > start_date) & (df['DateTime'] <= end_date)
-    return int(df.loc[mask]['Players'].max())
+def get_player_24h_peak():
+    now = utime.utcnow().timestamp()
+    day_ago = now - 24 * 60 * 60
+
+    # high-resolution samples catch the spikes that happened between the chart marks
+    peaks = (player_chart.peak(day_ago, now), player_count_buffer.peak(day_ago, now))
+    return max((peak for peak in peaks if peak is not None), default=0)
 
 
 @scheduler.scheduled_job('interval', seconds=update_cache_interval)
@@ -80,8 +83,7 @@ async def update_cache_info():
                                   next_run_time=dt.datetime.now() + dt.timedelta(minutes=15), coalesce=True)
             cache['player_alltime_peak'] = cache['online_players']
 
-        df = pd.read_csv(config.PLAYER_CHART_FILE_PATH, parse_dates=['DateTime'])
-        cache['player_24h_peak'] = get_player_24h_peak(df)
+        cache['player_24h_peak'] = get_player_24h_peak()
 
         caching.dump_cache(config.CORE_CACHE_FILE_PATH, cache)
     except Exception:
@@ -126,6 +128,28 @@ async def check_currency():
         return await check_currency()
 
 
+@scheduler.scheduled_job('cron',
+                         hour=execution_cron.hour, minute=execution_cron.minute, second=verify_alltime_peak_timing)
+async def verify_alltime_peak():
+    """The recorded history can only be below the real all-time peak, so anything above the cached one got missed."""
+
+    # noinspection PyBroadException
+    try:
+        history_peak = player_history.peak()
+        if history_peak is None:
+            return
+
+        alltime_peak = caching.load_cache(config.CORE_CACHE_FILE_PATH).get('player_alltime_peak', 0)
+        if history_peak > alltime_peak:
+            logger.warning(f'All-time peak {alltime_peak:,} is below the recorded history peak {history_peak:,}, '
+                           f'fixing it.')
+            caching.dump_cache_changes(config.CORE_CACHE_FILE_PATH, {'player_alltime_peak': history_peak})
+        else:
+            logger.info(f'All-time peak {alltime_peak:,} checks out (recorded history peak: {history_peak:,}).')
+    except Exception:
+        logger.exception('Caught exception while verifying the all-time peak!')
+
+
 # fixme: doesn't work since Season 2
 # @scheduler.scheduled_job('cron',
 #                          hour=execution_cron.hour, minute=execution_cron.minute, second=fetch_leaderboard_timing)
@@ -1 +1 @@
-from . import users
+from . import menu_codes, users
@@ -1 +1,3 @@
+from .menu_codes import MenuCode
 from .users import User
+from .stores import MemoryStore, SessionStore, SQLAlchemyStore, SQLiteStore
@@ -0,0 +1,13 @@
+import sqlalchemy as sa
+
+from .db_session import SqlAlchemyBase
+
+
+class MenuCode(SqlAlchemyBase):
+    __tablename__ = 'menu_codes'
+
+    code = sa.Column(sa.Integer, primary_key=True, autoincrement=False)
+    menu_id = sa.Column(sa.String, unique=True, nullable=False)
+
+    def __repr__(self):
+        return f'<MenuCode(code={self.code}, menu_id={self.menu_id})>'
@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+import itertools
+import logging
+from pathlib import Path
+from typing import Collection, NamedTuple, Sequence
+
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+
+from .db_session import SqlAlchemyBase
+from .menu_codes import MenuCode
+from .users import User
+
+
+__all__ = ('UserRecord', 'NewUser', 'UserChanges',
+           'SessionStore', 'SQLAlchemyStore', 'SQLiteStore', 'MemoryStore',
+           'SQLITE_PRAGMAS', 'POOL_SIZE')
+
+
+logger = logging.getLogger('INCS2bot.db')
+
+# applied to every new connection, in this order; ``None`` in the ``pragmas`` of ``SQLiteStore`` turns one off
+SQLITE_PRAGMAS = {'busy_timeout': 5000,           # ms to wait for the write lock instead of failing at once
+                  'journal_mode': 'WAL',          # readers don't block the writer and vice versa
+                  'synchronous': 'NORMAL',        # no fsync per commit, still safe with WAL
+                  'mmap_size': 256 * 1024 ** 2,
+                  'cache_size': -64 * 1024,       # KiB
+                  'temp_store': 'MEMORY'}
+
+# aiosqlite runs every connection in its own thread, so they are kept open in a small pool
+# instead of opening one (and applying the pragmas) for every session; 0 opens one per session
+POOL_SIZE = 4
+
+
+class UserRecord(NamedTuple):
+    id: int  # of the row, not the Telegram one
+    userid: int
+    current_menu_id: int | None
+    previous_menu_id: int | None
+    language: str | None
+    last_bot_pm_id: int | None
+
+
+class NewUser(NamedTuple):
+    userid: int
+    language: str | None
+    last_bot_pm_id: int | None
+
+
+class UserChanges(NamedTuple):
+    id: int  # of the row, not the Telegram one
+    current_menu_id: int | None
+    previous_menu_id: int | None
+    language: str | None
+    last_bot_pm_id: int | None
+
+
+class SessionStore(ABC):
+    """
+    Where users of the bot are kept between their sessions. Every operation works on a batch,
+    so registering, loading and saving many sessions at once costs a query, not a query per session.
+    """
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def optimize(self):
+        """Periodic maintenance, if the store needs any."""
+
+    @abstractmethod
+    async def get_many(self, user_ids: Collection[int]) -> dict[int, UserRecord]:
+        """Users with the given Telegram ids that are in the store, by their Telegram ids."""
+
+    @abstractmethod
+    async def add_many(self, users: Sequence[NewUser]) -> dict[int, UserRecord]:
+        """Adds users that aren't in the store yet, in one transaction."""
+
+    @abstractmethod
+    async def put_many(self, changes: Sequence[UserChanges]):
+        """Saves changed users, in one transaction."""
+
+    @abstractmethod
+    async def get_menu_codes(self) -> dict[str, int]:
+        """Persisted codes of menus, by menu ids."""
+
+    @abstractmethod
+    async def add_menu_codes(self, codes: dict[str, int]):
+        """Persists codes of new menus, by menu ids."""
+
+    async def get(self, user_id: int) -> UserRecord | None:
+        return (await self.get_many((user_id,))).get(user_id)
+
+
+class SQLAlchemyStore(SessionStore):
+    """
+    Keeps users in a database of any SQLAlchemy async URL (e.g. ``postgresql+asyncpg://...``;
+    the driver has to be installed). The schema is created if there is none, Alembic migrates it.
+    """
+
+    QUERY_CHUNK = 30_000  # ids per ``IN (...)``, below the bound parameter limits of SQLite and asyncpg
+
+    _users = User.__table__
+    _menu_codes = MenuCode.__table__
+    _columns = tuple(User.__table__.c[name] for name in UserRecord._fields)
+    _UPDATE = (sa.update(_users)
+               .where(_users.c.id == sa.bindparam('row_id'))
+               .values(current_menu_id=sa.bindparam('current_menu_id'),
+                       previous_menu_id=sa.bindparam('previous_menu_id'),
+                       language=sa.bindparam('language'),
+                       last_bot_pm_id=sa.bindparam('last_bot_pm_id')))
+
+    def __init__(self, url: str, **engine_kwargs):
+        self.url = url
+        self.engine: AsyncEngine | None = None
+
+        self._engine_kwargs = engine_kwargs
+        self._factory: async_sessionmaker | None = None
+
+    async def open(self):
+        logger.info(f'Connecting to database in {self.url}')
+
+        self.engine = create_async_engine(self.url, echo=False, **self._engine_kwargs)
+        self._prepare_engine(self.engine)
+
+        async with self.engine.begin() as conn:
+            await conn.run_sync(SqlAlchemyBase.metadata.create_all)
+            await conn.run_sync(self._check_schema)
+
+        self._factory = async_sessionmaker(bind=self.engine, expire_on_commit=False)
+
+    def _prepare_engine(self, engine: AsyncEngine):
+        pass
+
+    @staticmethod
+    def _check_schema(conn: sa.Connection):
+        """``create_all`` only adds missing tables, so tables of an older schema have to be migrated first."""
+
+        columns = {column['name']: column['type'] for column in sa.inspect(conn).get_columns(User.__tablename__)}
+        if not isinstance(columns['current_menu_id'], sa.Integer):
+            raise RuntimeError(f'Menu ids of users are still {columns["current_menu_id"]}, not integer codes, '
+                               f'upgrade the database with "alembic upgrade head" first')
+
+    async def close(self):
+        if self.engine is not None:
+            await self.engine.dispose()
+
+    def create_session(self) -> AsyncSession:
+        return self._factory()
+
+    async def get_many(self, user_ids: Collection[int]) -> dict[int, UserRecord]:
+        user_ids = list(user_ids)
+        records = {}
+        async with self.engine.connect() as conn:
+            for i in range(0, len(user_ids), self.QUERY_CHUNK):
+                query = sa.select(*self._columns).where(self._users.c.userid.in_(user_ids[i:i + self.QUERY_CHUNK]))
+                records |= {row.userid: UserRecord(*row) for row in await conn.execute(query)}
+        return records
+
+    async def add_many(self, users: Sequence[NewUser]) -> dict[int, UserRecord]:
+        if not users:
+            return {}
+
+        query = sa.insert(self._users).returning(*self._columns)
+        async with self.engine.begin() as conn:
+            rows = await conn.execute(query, [user._asdict() for user in users])
+            return {row.userid: UserRecord(*row) for row in rows}
+
+    async def put_many(self, changes: Sequence[UserChanges]):
+        if not changes:
+            return
+
+        params = [{'row_id': row.id, 'current_menu_id': row.current_menu_id, 'previous_menu_id': row.previous_menu_id,
+                   'language': row.language, 'last_bot_pm_id': row.last_bot_pm_id} for row in changes]
+        async with self.engine.begin() as conn:
+            await conn.execute(self._UPDATE, params)
+
+    async def get_menu_codes(self) -> dict[str, int]:
+        async with self.engine.connect() as conn:
+            rows = await conn.execute(sa.select(self._menu_codes.c.menu_id, self._menu_codes.c.code))
+            return {menu_id: code for menu_id, code in rows}
+
+    async def add_menu_codes(self, codes: dict[str, int]):
+        if not codes:
+            return
+
+        async with self.engine.begin() as conn:
+            await conn.execute(sa.insert(self._menu_codes),
+                               [{'menu_id': menu_id, 'code': code} for menu_id, code in codes.items()])
+
+
+class SQLiteStore(SQLAlchemyStore):
+    """``SQLAlchemyStore`` of an SQLite file, tuned with ``SQLITE_PRAGMAS``."""
+
+    # executed by the driver as executemany, skipping SQLAlchemy's processing of every row
+    _DRIVER_UPDATE = ('UPDATE users SET current_menu_id = ?2, previous_menu_id = ?3, language = ?4, '
+                      'last_bot_pm_id = ?5 WHERE id = ?1')
+
+    def __init__(self, db_file: Path, pragmas: dict[str, str | int | None] = None, pool_size: int = POOL_SIZE):
+        if pool_size:
+            engine_kwargs = {'poolclass': AsyncAdaptedQueuePool, 'pool_size': pool_size, 'max_overflow': 0}
+        else:
+            engine_kwargs = {'poolclass': NullPool}
+        super().__init__(f'sqlite+aiosqlite:///{db_file}?check_same_thread=False', **engine_kwargs)
+
+        self.pragmas = {name: value for name, value in (SQLITE_PRAGMAS | (pragmas or {})).items()
+                        if value is not None}
+
+    def _prepare_engine(self, engine: AsyncEngine):
+        @event.listens_for(engine.sync_engine, 'connect')
+        def apply_pragmas(dbapi_connection, _):
+            cursor = dbapi_connection.cursor()
+            for name, value in self.pragmas.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+            cursor.close()
+
+    async def optimize(self):
+        """Lets SQLite refresh the statistics its query planner uses, if they are worth refreshing."""
+
+        async with self.engine.connect() as conn:
+            await conn.execute(sa.text('PRAGMA optimize'))
+
+    async def close(self):
+        if self.engine is not None:
+            await self.optimize()
+        await super().close()
+
+    async def put_many(self, changes: Sequence[UserChanges]):
+        if not changes:
+            return
+
+        async with self.engine.begin() as conn:
+            await conn.exec_driver_sql(self._DRIVER_UPDATE, list(changes))
+
+
+class MemoryStore(SessionStore):
+    """Keeps users in memory, for tests and benchmarks: nothing survives a restart."""
+
+    def __init__(self):
+        self._records: dict[int, UserRecord] = {}  # Telegram id -> record
+        self._userids: dict[int, int] = {}  # row id -> Telegram id
+        self._ids = itertools.count(1)
+        self._menu_codes: dict[str, int] = {}
+
+    async def get_many(self, user_ids: Collection[int]) -> dict[int, UserRecord]:
+        return {user_id: self._records[user_id] for user_id in user_ids if user_id in self._records}
+
+    async def add_many(self, users: Sequence[NewUser]) -> dict[int, UserRecord]:
+        if any(user.userid in self._records for user in users):
+            raise ValueError('Some of the users are already in the store!')
+
+        added = {}
+        for user in users:
+            record = UserRecord(next(self._ids), user.userid, None, None, user.language, user.last_bot_pm_id)
+            self._records[user.userid] = added[user.userid] = record
+            self._userids[record.id] = user.userid
+        return added
+
+    async def put_many(self, changes: Sequence[UserChanges]):
+        for row in changes:
+            userid = self._userids[row.id]
+            self._records[userid] = UserRecord(row.id, userid, *row[1:])
+
+    async def get_menu_codes(self) -> dict[str, int]:
+        return self._menu_codes.copy()
+
+    async def add_menu_codes(self, codes: dict[str, int]):
+        self._menu_codes |= codes
@@ -8,9 +8,9 @@ class User(SqlAlchemyBase, SerializerMixin):
     __tablename__ = 'users'
 
     id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
-    userid = sa.Column(sa.Integer, unique=True)
-    current_menu_id = sa.Column(sa.String)
-    previous_menu_id = sa.Column(sa.String)
+    userid = sa.Column(sa.BigInteger, unique=True)  # Telegram ids go past 2^31
+    current_menu_id = sa.Column(sa.Integer)  # codes of menus, see ``menu_codes``
+    previous_menu_id = sa.Column(sa.Integer)
     language = sa.Column(sa.String)
     last_bot_pm_id = sa.Column(sa.Integer)
 
@@ -1,15 +1,19 @@
 import json
 from pathlib import Path
 
+from .tracing import traced
+
 
 __all__ = ['load_cache', 'dump_cache', 'dump_cache_changes']
 
 
+@traced('cache.load')
 def load_cache(path: Path) -> dict[str, ...]:
     with open(path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
 
+@traced('cache.dump')
 def dump_cache(path: Path, cache: dict[str, ...]):
     with open(path, 'w', encoding='utf-8') as f:
         json.dump(cache, f, indent=4, ensure_ascii=False)
@@ -0,0 +1,39 @@
+import json
+from pathlib import Path
+import threading
+import time
+from typing import Iterator, NamedTuple
+
+
+__all__ = ['RecordedEvent', 'EventRecorder', 'read_events']
+
+
+class RecordedEvent(NamedTuple):
+    time: float
+    event: str
+    data: ...
+
+
+class EventRecorder:
+    """Appends events to a JSON Lines file, one ``{"time": ..., "event": ..., "data": ...}`` object per line."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def record(self, event: str, data):
+        line = json.dumps({'time': time.time(), 'event': event, 'data': data}, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_events(path: Path) -> Iterator[RecordedEvent]:
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield RecordedEvent(**json.loads(line))
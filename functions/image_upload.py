@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+import hashlib
+import logging
+import threading
+import time
+
+import requests
+
+
+__all__ = ['UploadHost', 'HostStats', 'ImageUploader', 'UploadError', 'supa_uploader', 'CATBOX']
+
+
+logger = logging.getLogger('INCS2bot.image_upload')
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadHost:
+    """A file host that takes a multipart POST and answers with the URL of the uploaded file as plain text."""
+
+    def __init__(self, name: str, url: str, field: str, data: dict = None):
+        self.name = name
+        self.url = url
+        self.field = field
+        self.data = data
+
+    def upload(self, image: bytes, filename: str, headers: dict = None, timeout: float = None) -> str:
+        response = requests.post(self.url,
+                                 headers=headers,
+                                 data=self.data,
+                                 files={self.field: (filename, image)},
+                                 timeout=timeout)
+
+        if response.status_code != 200:
+            raise UploadError(f'{self.name} answered {response.status_code} {response.reason}: {response.text}')
+
+        url = response.text.strip()
+        if not url.startswith(('http://', 'https://')):
+            raise UploadError(f'{self.name} answered with something that is not a URL: {url!r}')
+
+        return url
+
+    def __repr__(self):
+        return f'UploadHost({self.name!r})'
+
+
+def supa_uploader(host: str) -> UploadHost:
+    """One of the hosts running https://github.com/0Supa/uploader (i.supa.codes, kappa.lol, gachi.gay, femboy.beauty)."""
+
+    return UploadHost(host, f'https://{host}/api/upload', 'file')
+
+
+# might be blocked on some hostings
+CATBOX = UploadHost('catbox.moe', 'https://catbox.moe/user/api.php', 'fileToUpload', {'reqtype': 'fileupload'})
+
+
+@dataclass
+class HostStats:
+    successes: int = 0
+    failures: int = 0
+    latency: float | None = None  # exponential moving average of successful uploads, seconds
+
+    SMOOTHING = 0.3
+
+    @property
+    def failure_rate(self) -> float:
+        attempts = self.successes + self.failures
+        return self.failures / attempts if attempts else 0
+
+    def record_success(self, elapsed: float):
+        self.successes += 1
+        self.latency = elapsed if self.latency is None \
+            else self.SMOOTHING * elapsed + (1 - self.SMOOTHING) * self.latency
+
+    def record_failure(self):
+        self.failures += 1
+
+    def sort_key(self) -> tuple[float, float]:
+        return self.failure_rate, self.latency if self.latency is not None else 0  # untried hosts get a chance
+
+
+class ImageUploader:
+    """
+    Uploads images to several hosts at once and returns the first URL that comes back.
+
+    The best ``fanout`` hosts (lowest failure rate, then lowest latency) are raced first,
+    the rest are tried the same way if all of them fail. Images are content-addressed:
+    uploading the same bytes again returns the URL from last time without any request.
+    """
+
+    def __init__(self, hosts: list[UploadHost], headers: dict = None, timeout: float = 60,
+                 fanout: int = 2, remembered_urls: int = 64):
+        if not hosts:
+            raise ValueError('at least one upload host is required')
+
+        self.hosts = list(hosts)
+        self.headers = headers
+        self.timeout = timeout
+        self.fanout = fanout
+        self.stats = {host.name: HostStats() for host in self.hosts}
+
+        self._urls: OrderedDict[str, str] = OrderedDict()  # sha256 of the image -> URL
+        self._remembered_urls = remembered_urls
+        self._lock = threading.Lock()
+        # losers of a race keep their threads until they finish, so leave room for a few races at once
+        self._executor = ThreadPoolExecutor(4 * len(self.hosts), thread_name_prefix='image-upload')
+
+    def ranked_hosts(self) -> list[UploadHost]:
+        with self._lock:
+            return sorted(self.hosts, key=lambda host: self.stats[host.name].sort_key())
+
+    def _attempt(self, host: UploadHost, image: bytes, filename: str) -> str:
+        start = time.perf_counter()
+        try:
+            url = host.upload(image, filename, self.headers, self.timeout)
+        except Exception:
+            with self._lock:
+                self.stats[host.name].record_failure()
+            raise
+
+        with self._lock:
+            self.stats[host.name].record_success(time.perf_counter() - start)
+        return url
+
+    def _race(self, hosts: list[UploadHost], image: bytes, filename: str) -> str | None:
+        names = {self._executor.submit(self._attempt, host, image, filename): host.name for host in hosts}
+        pending: set[Future] = set(names)
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()  # losers keep running in the background and only update stats
+                logger.warning(f'Failed to upload {filename} to {names[future]}: {future.exception()}')
+
+    def upload(self, image: bytes, filename: str = 'image.png') -> str:
+        """Returns the URL of ``image``, uploading it only if these exact bytes haven't been uploaded before."""
+
+        digest = hashlib.sha256(image).hexdigest()
+        with self._lock:
+            if digest in self._urls:
+                self._urls.move_to_end(digest)
+                return self._urls[digest]
+
+        hosts = self.ranked_hosts()
+        for i in range(0, len(hosts), self.fanout):
+            url = self._race(hosts[i:i + self.fanout], image, filename)
+            if url is not None:
+                break
+        else:
+            raise UploadError(f'all hosts failed to upload {filename}')
+
+        with self._lock:
+            self._urls[digest] = url
+            while len(self._urls) > self._remembered_urls:
+                self._urls.popitem(last=False)
+        return url
+
+    def shutdown(self, wait: bool = False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
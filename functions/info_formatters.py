@@ -8,6 +8,7 @@ from jinja2 import Environment, FileSystemLoader
 
 from l10n import Locale
 from .locale import get_refined_lang_code
+from .tracing import traced
 from utypes import (DatacenterState, DatacenterRegionState, DatacenterGroupState,
                     DatacenterStateVariation, GameVersionData, ServerStatusData,
                     MatchmakingStatsData, States, LeaderboardStats, Datacenter, DatacenterRegion)
@@ -68,6 +69,7 @@ def format_latest_info_updated(latest_info_update_at: dt.datetime, locale: Local
     return locale.latest_data_update.format(format_datetime(latest_info_update_at, locale))
 
 
+@traced('format')
 def format_server_status(data: ServerStatusData, locale: Locale) -> str:
     if data is States.UNKNOWN:
         return locale.error_internal
@@ -93,13 +95,17 @@ def format_server_status(data: ServerStatusData, locale: Locale) -> str:
     return text
 
 
-def format_matchmaking_stats(data: MatchmakingStatsData, locale: Locale) -> str:
+@traced('format')
+def format_matchmaking_stats(data: MatchmakingStatsData, locale: Locale, graph_window: str = None) -> str:
+    """``graph_window`` picks the graph variant to link (e.g. ``'24h'``), the default one is linked if it's missing."""
+
     if data is States.UNKNOWN:
         return locale.error_internal
 
     game_servers_dt = format_datetime(data.info_requested_datetime, locale)
+    graph_url = data.graph_urls.get(graph_window) or data.graph_url
 
-    packed = (data.graph_url, data.online_servers, data.online_players,
+    packed = (graph_url, data.online_servers, data.online_players,
               data.active_players, data.searching_players, data.average_search_time)
     text = (
         f'{locale.stats_matchmaking_text.format(*packed)}'
@@ -115,6 +121,7 @@ def format_matchmaking_stats(data: MatchmakingStatsData, locale: Locale) -> str:
     return text
 
 
+@traced('format')
 def format_datacenter_state(state: DatacenterStateVariation, locale: Locale, latest_info_update_at: dt.datetime):
     if isinstance(state, DatacenterState):
         info = pack_formatting_singular_datacenter_state(state, locale)
@@ -172,6 +179,7 @@ def format_datacenter_state_summary(state: DatacenterState | DatacenterRegionSta
         return summaries
 
 
+@traced('format')
 def format_game_version_info(data: GameVersionData, locale: Locale) -> str:
     cs2_version_dt = (dt.datetime.fromtimestamp(data.cs2_version_timestamp)
                       .replace(tzinfo=VALVE_TIMEZONE).astimezone(dt.UTC))
@@ -181,6 +189,7 @@ def format_game_version_info(data: GameVersionData, locale: Locale) -> str:
     return locale.game_version_text.format(data.cs2_patch_version, data.cs2_client_version, cs2_version_dt)
 
 
+@traced('format')
 def format_valve_hq_time(locale: Locale) -> str:
     valve_hq_datetime = dt.datetime.now(tz=VALVE_TIMEZONE)
 
@@ -189,6 +198,7 @@ def format_valve_hq_time(locale: Locale) -> str:
     return locale.valve_hqtime_text.format(CLOCKS[valve_hq_datetime.hour % 12], valve_hq_dt_formatted)
 
 
+@traced('format')
 def format_user_game_stats(stats, locale: Locale) -> str:
     rendered_page = game_stats_template.render(**locale.to_dict())
 
@@ -202,6 +212,7 @@ def format_user_game_stats(stats, locale: Locale) -> str:
     return rendered_page.format(*stats)
 
 
+@traced('format')
 def format_game_world_leaderboard(data: list[LeaderboardStats], locale: Locale) -> str:
     text = f'{locale.game_leaderboard_header_world} (Season 1)\n\n'
 
@@ -225,6 +236,7 @@ def format_game_world_leaderboard(data: list[LeaderboardStats], locale: Locale)
     return text
 
 
+@traced('format')
 def format_game_regional_leaderboard(data: list[LeaderboardStats], locale: Locale) -> str:
     text = f'{locale.game_leaderboard_header_regional} (Season 1)\n\n'
 
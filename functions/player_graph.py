@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+from io import BytesIO
+from typing import Callable, NamedTuple, TYPE_CHECKING
+
+import matplotlib
+matplotlib.use('Agg')  # we only ever render to PNG, so don't let matplotlib pick an interactive backend
+
+# noinspection PyPep8
+from matplotlib.cm import ScalarMappable
+from matplotlib.colors import LinearSegmentedColormap
+import matplotlib.dates as mdates
+import matplotlib.pyplot as plt
+from matplotlib.ticker import FixedFormatter
+import numpy as np
+from PIL import Image
+import seaborn as sns
+
+if TYPE_CHECKING:
+    from utypes import PlayerCountBucket
+
+
+__all__ = ['GraphWindow', 'GRAPH_WINDOWS', 'DEFAULT_GRAPH_WINDOW', 'PlayerGraphRenderer', 'lttb']
+
+
+cmap = LinearSegmentedColormap.from_list('custom', [(1, 1, 0), (1, 0, 0)], N=100)
+norm = plt.Normalize(0, 2_000_000)
+mappable = ScalarMappable(norm=norm, cmap=cmap)
+
+ticks = [0, 250000, 500000, 750000, 1000000, 1250000, 1500000, 1750000, 2000000]
+colorbar_ticks_format = FixedFormatter(['0', '250K', '500K', '750K', '1M', '1.25M', '1.5M', '1.75M', '2M+'])
+fig_ticks_format = ['' for _ in ticks]
+
+FILL_OFFSET = 20_000
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+
+class GraphWindow(NamedTuple):
+    name: str
+    span: int  # seconds
+    locator: Callable[[], mdates.DateLocator]
+    date_format: str
+
+
+GRAPH_WINDOWS = (
+    GraphWindow('24h', DAY, lambda: mdates.HourLocator(byhour=range(0, 24, 3)), '%H:%M'),
+    GraphWindow('7d', 7 * DAY, mdates.DayLocator, '%b %d'),
+    GraphWindow('14d', 14 * DAY, mdates.DayLocator, '%b %d'),
+    GraphWindow('30d', 30 * DAY, lambda: mdates.DayLocator(interval=3), '%b %d'),
+    GraphWindow('1y', 365 * DAY, mdates.MonthLocator, '%b %Y'),
+)
+DEFAULT_GRAPH_WINDOW = '14d'  # what the single graph used to show, its URL stays under ``graph_url``
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling: returns indices of at most ``threshold`` points
+    that keep the visual shape of the series (peaks and dips survive, unlike with plain decimation).
+    """
+
+    n = x.size
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = x.astype('float64')
+    y = y.astype('float64')
+
+    # first and last points are always kept, the rest is split into ``threshold - 2`` buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype('int64')
+    indices = np.empty(threshold, dtype='int64')
+    indices[0], indices[-1] = 0, n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = hi, edges[i + 2] if i + 2 < edges.size else n
+        avg_x, avg_y = x[next_lo:next_hi].mean(), y[next_lo:next_hi].mean()
+
+        areas = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(areas.argmax())
+        indices[i + 1] = a
+
+    return indices
+
+
+class PlayerGraphRenderer:
+    """
+    Keeps one figure with all the static artists (grid, colorbar, labels, formatters) alive between renders,
+    so each render only updates the scatter, the fill polygon and the min/max spread, and re-draws.
+
+    The figure is created at the output DPI, so ``savefig`` doesn't have to re-layout it at another one,
+    and the canvas is encoded straight to an RGB PNG with fast zlib settings (an opaque graph needs no alpha,
+    and the default compression level costs more than drawing the whole figure).
+    """
+
+    DPI = 200
+    COMPRESS_LEVEL = 1
+
+    def __init__(self, caption: str = 'Made by @INCS2\nupdates every 10 min'):
+        sns.set_style('whitegrid')
+
+        self.fig, self.ax = plt.subplots(figsize=(10, 2.5), dpi=self.DPI)
+        ax = self.ax
+
+        self._scatter = ax.scatter([], [], c=[], cmap=cmap, s=10, norm=norm, linewidths=0.7)
+        self._fill = ax.fill_between([], [], color=cmap(0.5), alpha=0.4)
+        self._spread = ax.vlines([], [], [], colors=cmap(1.0), linewidths=0.7, alpha=0.6)
+
+        ax.xaxis_date()
+        ax.grid(visible=True, axis='y', linestyle='--', alpha=0.3)
+        ax.grid(visible=False, axis='x')
+        ax.spines['bottom'].set_position('zero')
+        ax.spines['bottom'].set_color('black')
+        ax.set(xlabel='', ylabel='')
+        ax.xaxis.set_ticks_position('bottom')
+        ax.xaxis.set_major_locator(mdates.DayLocator())
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%b %d'))
+        ax.legend(loc='upper left')
+        ax.text(0.20, 0.88, caption,
+                ha='center', transform=ax.transAxes, color='black', size='8')
+        ax.set_yticks(ticks, fig_ticks_format)
+
+        self.fig.colorbar(mappable, ax=ax,
+                          ticks=ticks,
+                          format=colorbar_ticks_format,
+                          pad=0.01)
+
+        self.fig.subplots_adjust(top=0.933, bottom=0.077, left=0.03, right=1.07)
+
+        self.buffer = BytesIO()
+        self.buffer.name = 'graph.png'  # so uploaders get a proper filename out of it
+
+    def set_window(self, window: GraphWindow):
+        """Switches date ticks to the ones that suit the time span of ``window``."""
+
+        self.ax.xaxis.set_major_locator(window.locator())
+        self.ax.xaxis.set_major_formatter(mdates.DateFormatter(window.date_format))
+
+    def update(self, timestamps: np.ndarray, players: np.ndarray, buckets: list[PlayerCountBucket] = ()):
+        """Replaces the plotted data. ``timestamps`` are UNIX timestamps in seconds, sorted."""
+
+        x = mdates.date2num(np.asarray(timestamps).astype('datetime64[s]'))
+        y = np.asarray(players, dtype='int64')
+
+        self._scatter.set_offsets(np.column_stack((x, y)))
+        self._scatter.set_array(y)
+
+        top = np.column_stack((x, y - FILL_OFFSET))
+        bottom = np.column_stack((x[::-1], np.zeros_like(x)))
+        self._fill.set_verts([np.concatenate((top, bottom))])
+
+        bucket_x = mdates.date2num(np.array([b.start for b in buckets], dtype='datetime64[s]'))
+        self._spread.set_segments([((bx, b.min), (bx, b.max)) for bx, b in zip(bucket_x, buckets)])
+
+        if x.size:
+            self.ax.set_xlim(x[0], x[-1])
+            y_max = max(int(y.max()), max((b.max for b in buckets), default=0))
+            self.ax.set_ylim(-0.05 * y_max, 1.05 * y_max)  # what autoscaling with default margins would give
+
+    def render(self, buffer: BytesIO = None) -> BytesIO:
+        """Saves the figure as PNG into ``buffer`` (the renderer's own reusable one by default) and returns it, rewound."""
+
+        if buffer is None:
+            buffer = self.buffer
+
+        canvas = self.fig.canvas
+        canvas.draw()
+        image = Image.fromarray(np.asarray(canvas.buffer_rgba())).convert('RGB')
+
+        buffer.seek(0)
+        buffer.truncate()
+        image.save(buffer, format='png', compress_level=self.COMPRESS_LEVEL)
+        buffer.seek(0)
+        return buffer
+
+    def close(self):
+        plt.close(self.fig)
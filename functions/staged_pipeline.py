@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+import logging
+import threading
+import time
+from typing import Callable, NamedTuple
+
+
+__all__ = ['Stage', 'StagedPipeline', 'PipelineRun']
+
+
+class Stage(NamedTuple):
+    name: str
+    func: Callable
+    timeout: float
+
+
+@dataclass
+class PipelineRun:
+    started: float
+    timings: dict[str, float] = field(default_factory=dict)
+    abandoned_stage: str | None = None
+    failed_stage: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.abandoned_stage is None and self.failed_stage is None
+
+    def summary(self) -> str:
+        timings = ', '.join(f'{name}: {elapsed:.2f}s' for name, elapsed in self.timings.items())
+        if self.abandoned_stage:
+            return f'abandoned at {self.abandoned_stage} ({timings})'
+        if self.failed_stage:
+            return f'failed at {self.failed_stage} ({timings})'
+        return f'done ({timings})'
+
+
+def _timed(func: Callable, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class StagedPipeline:
+    """
+    Runs stages one after another off the caller's thread, each on its own worker thread with its own deadline.
+    The result of a stage is passed to the next one.
+
+    A stage that misses its deadline is abandoned: the run stops there and its result is thrown away once it
+    eventually arrives. Threads can't be killed, so while an abandoned stage is still running, new runs are
+    refused instead of piling up behind it. With a ``deadline``, the whole run has to end within it as well,
+    so a run that is slow in every stage doesn't overlap the next one either.
+    """
+
+    def __init__(self, name: str, stages: list[Stage], logger: logging.Logger, history: int = 144,
+                 deadline: float = None):
+        self.name = name
+        self.stages = stages
+        self.deadline = deadline
+        self.logger = logger
+        self.runs: deque[PipelineRun] = deque(maxlen=history)
+
+        self._runner = ThreadPoolExecutor(1, thread_name_prefix=f'{name}')
+        self._workers = {stage.name: ThreadPoolExecutor(1, thread_name_prefix=f'{name}-{stage.name}')
+                         for stage in stages}
+        self._pending: list[Future] = []
+        self._lock = threading.Lock()
+
+    def _track(self, future: Future):
+        with self._lock:
+            self._pending.append(future)
+
+    def busy(self) -> bool:
+        with self._lock:
+            self._pending = [future for future in self._pending if not future.done()]
+            return bool(self._pending)
+
+    def submit(self, *args) -> Future | None:
+        """Starts a run with ``args`` passed to the first stage. Returns ``None`` if the previous run is still going."""
+
+        if self.busy():
+            self.logger.warning(f'{self.name}: previous run is still in progress, skipping this one.')
+            return
+
+        future = self._runner.submit(self._run, *args)
+        self._track(future)
+        return future
+
+    def _run(self, *args) -> PipelineRun:
+        run = PipelineRun(time.time())
+        self.runs.append(run)
+        started = time.monotonic()
+
+        for stage in self.stages:
+            timeout = stage.timeout
+            if self.deadline is not None:
+                timeout = min(timeout, self.deadline - (time.monotonic() - started))
+                if timeout <= 0:
+                    run.abandoned_stage = stage.name
+                    self.logger.error(f'{self.name}: no time left for {stage.name} within the {self.deadline}s '
+                                      f'deadline of the run, abandoned it.')
+                    break
+
+            future = self._workers[stage.name].submit(_timed, stage.func, *args)
+            self._track(future)
+
+            # noinspection PyBroadException
+            try:
+                result, run.timings[stage.name] = future.result(timeout=timeout)
+            except FutureTimeoutError:
+                run.abandoned_stage = stage.name
+                run.timings[stage.name] = timeout
+                self.logger.error(f'{self.name}: {stage.name} missed its {timeout:.0f}s deadline, abandoned the run.')
+                break
+            except Exception:
+                run.failed_stage = stage.name
+                self.logger.exception(f'{self.name}: caught exception in {stage.name}!')
+                break
+
+            args = (result,)
+
+        self.logger.info(f'{self.name}: {run.summary()}')
+        return run
+
+    def shutdown(self, wait: bool = False):
+        self._runner.shutdown(wait=wait, cancel_futures=True)
+        for worker in self._workers.values():
+            worker.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+
+import requests
+
+
+__all__ = ['TelegramPhotoChannel', 'TelegramAPIError']
+
+
+logger = logging.getLogger('INCS2bot.telegram_photos')
+
+
+class TelegramAPIError(Exception):
+    pass
+
+
+class TelegramPhotoChannel:
+    """
+    Publishes photos to a private chat through the Bot API to get their ``file_id``, so the bot can send them
+    by ``file_id`` and clients pull them from Telegram instead of a third-party host.
+
+    Every key gets one message whose photo is replaced on each publish, so the chat doesn't fill up.
+    ``photos`` (key -> ``message_id``, ``file_id``, ``sha256``) is meant to be persisted between runs;
+    publishing the same bytes under the same key again doesn't touch Telegram at all.
+    """
+
+    API_URL = 'https://api.telegram.org'
+
+    def __init__(self, token: str, chat_id: int, photos: dict[str, dict] = None, *,
+                 test_mode: bool = False, timeout: float = 60, api_url: str = API_URL):
+        self.chat_id = chat_id
+        self.photos = photos or {}
+        self.timeout = timeout
+        self._base_url = f'{api_url}/bot{token}/test' if test_mode else f'{api_url}/bot{token}'
+
+    def _call(self, method: str, data: dict, files: dict = None) -> dict:
+        response = requests.post(f'{self._base_url}/{method}', data=data, files=files, timeout=self.timeout)
+        result = response.json()
+        if not result.get('ok'):
+            raise TelegramAPIError(f'{method}: {result.get("error_code")} {result.get("description")}')
+
+        return result['result']
+
+    def _send(self, image: bytes, filename: str) -> dict:
+        return self._call('sendPhoto',
+                          {'chat_id': self.chat_id, 'disable_notification': True},
+                          {'photo': (filename, image)})
+
+    def _replace(self, message_id: int, image: bytes, filename: str) -> dict:
+        return self._call('editMessageMedia',
+                          {'chat_id': self.chat_id, 'message_id': message_id,
+                           'media': json.dumps({'type': 'photo', 'media': 'attach://photo'})},
+                          {'photo': (filename, image)})
+
+    def publish(self, key: str, image: bytes, filename: str) -> str:
+        """Returns ``file_id`` of the largest size of ``image`` as Telegram stored it."""
+
+        digest = hashlib.sha256(image).hexdigest()
+        photo = self.photos.get(key)
+        if photo is not None and photo['sha256'] == digest:
+            return photo['file_id']
+
+        message = None
+        if photo is not None:
+            try:
+                message = self._replace(photo['message_id'], image, filename)
+            except TelegramAPIError as e:  # the message got deleted or is too old to edit
+                logger.warning(f"Couldn't replace the {key} photo, sending a new one: {e}")
+
+        if message is None:
+            message = self._send(image, filename)
+
+        file_id = message['photo'][-1]['file_id']
+        self.photos[key] = {'message_id': message['message_id'], 'file_id': file_id, 'sha256': digest}
+        return file_id
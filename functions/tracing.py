@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import wraps
+import heapq
+import inspect
+import itertools
+import json
+import logging
+from pathlib import Path
+import time
+from typing import Callable
+
+
+__all__ = ['Span', 'Trace', 'LatencyHistogram', 'JSONLExporter', 'Tracer', 'span', 'traced', 'name_trace']
+
+
+logger = logging.getLogger('INCS2bot.tracing')
+
+_current_trace: ContextVar[Trace | None] = ContextVar('current_trace', default=None)
+
+
+@dataclass(slots=True)
+class Span:
+    name: str
+    start: float  # seconds since the start of the trace
+    duration: float
+    depth: int
+    idle: bool = False
+
+
+@dataclass
+class Trace:
+    kind: str  # callback, message, inline
+    name: str | None = None  # menu id (or inline route), set once the update gets dispatched
+    started: float = field(default_factory=time.time)
+    duration: float = 0
+    idle: float = 0  # time spent waiting for the user, not for the bot
+    spans: list[Span] = field(default_factory=list)
+
+    _perf_start: float = field(default_factory=time.perf_counter, repr=False)
+    _depth: int = field(default=0, repr=False)
+
+    @property
+    def busy(self) -> float:
+        return self.duration - self.idle
+
+    @property
+    def key(self) -> str:
+        return self.name or f'{self.kind}:unrouted'
+
+    def to_dict(self) -> dict:
+        return {'kind': self.kind,
+                'name': self.key,
+                'started': self.started,
+                'duration_ms': round(self.duration * 1000, 3),
+                'idle_ms': round(self.idle * 1000, 3),
+                'spans': [{'name': s.name,
+                           'start_ms': round(s.start * 1000, 3),
+                           'duration_ms': round(s.duration * 1000, 3),
+                           'depth': s.depth,
+                           'idle': s.idle} for s in self.spans]}
+
+
+@contextmanager
+def span(name: str, *, idle: bool = False):
+    """
+    Times the block as a part of the current trace. Does nothing outside a trace.
+    ``idle`` spans (waiting for the user to answer) don't count towards the latency of the update.
+    """
+
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    depth = trace._depth
+    trace._depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        trace._depth = depth
+        trace.spans.append(Span(name, start - trace._perf_start, end - start, depth, idle))
+        if idle:
+            trace.idle += end - start
+
+
+def traced(name: str = None):
+    """Decorator putting every call of a (sync or async) function into a span."""
+
+    def decorator(func: Callable):
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_inner(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_inner
+
+        @wraps(func)
+        def inner(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return inner
+
+    return decorator
+
+
+def name_trace(name: str):
+    """Names the current trace after the menu it got dispatched to, unless it's already named."""
+
+    trace = _current_trace.get()
+    if trace is not None and trace.name is None:
+        trace.name = name
+
+
+class LatencyHistogram:
+    """Counts durations in fixed exponential buckets, good enough for percentiles of a report."""
+
+    BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10_000, 30_000, float('inf'))
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * len(self.BOUNDS_MS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, duration: float):
+        ms = duration * 1000
+        self.counts[bisect_left(self.BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, q: float) -> float:
+        """Upper bound (ms) of the bucket holding the ``q``-th percentile, capped by the observed maximum."""
+
+        if not self.count:
+            return 0
+
+        rank = q / 100 * self.count
+        for bound, running in zip(self.BOUNDS_MS, itertools.accumulate(self.counts)):
+            if running >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class JSONLExporter:
+    """Appends every finished trace to a file, one JSON object per line."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = open(self.path, 'a', encoding='utf-8', buffering=1)
+
+    def export(self, trace: Trace):
+        self._file.write(json.dumps(trace.to_dict(), ensure_ascii=False) + '\n')
+
+    def close(self):
+        self._file.close()
+
+
+class Tracer:
+    """
+    Collects traces of handled updates: a latency histogram per menu (``total``) and per span name of that menu,
+    plus the ``slowest`` traces seen since the last ``clear()``.
+
+    Span histograms count self time (minus nested spans), so they add up to where the time actually went.
+    """
+
+    TOTAL = 'total'
+
+    def __init__(self, slowest: int = 20, exporter: JSONLExporter = None):
+        self.exporter = exporter
+        self.histograms: dict[str, dict[str, LatencyHistogram]] = {}
+
+        self._slowest_limit = slowest
+        self._slowest: list[tuple[float, int, Trace]] = []  # min-heap, so the fastest of them is dropped first
+        self._sequence = itertools.count()
+
+    @contextmanager
+    def trace(self, kind: str, name: str = None):
+        trace = Trace(kind, name)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+            trace.duration = time.perf_counter() - trace._perf_start
+            self._record(trace)
+
+    def _record(self, trace: Trace):
+        histograms = self.histograms.setdefault(trace.key, {})
+        histograms.setdefault(self.TOTAL, LatencyHistogram()).add(trace.busy)
+        nested = {}  # depth -> total duration of finished spans at that depth, not yet claimed by a parent
+        for s in trace.spans:  # spans are recorded as they finish, so children come before their parent
+            self_time = s.duration - nested.pop(s.depth + 1, 0)
+            nested[s.depth] = nested.get(s.depth, 0) + s.duration
+            if not s.idle:
+                histograms.setdefault(s.name, LatencyHistogram()).add(max(self_time, 0))
+
+        entry = (trace.busy, next(self._sequence), trace)
+        if len(self._slowest) < self._slowest_limit:
+            heapq.heappush(self._slowest, entry)
+        elif entry > self._slowest[0]:
+            heapq.heapreplace(self._slowest, entry)
+
+        if self.exporter is not None:
+            # noinspection PyBroadException
+            try:
+                self.exporter.export(trace)
+            except Exception:
+                logger.exception('Failed to export a trace!')
+
+    def slowest(self) -> list[Trace]:
+        return [trace for *_, trace in sorted(self._slowest, reverse=True)]
+
+    def report(self, top: int = 5) -> str:
+        """Menus with the highest p95, with the span that takes most of their time."""
+
+        rows = []
+        for key, histograms in self.histograms.items():
+            total = histograms[self.TOTAL]
+            spans = {name: h for name, h in histograms.items() if name != self.TOTAL}
+            heaviest = max(spans, key=lambda name: spans[name].total, default=None)
+            rows.append((total.percentile(95), key, total, heaviest))
+
+        rows.sort(key=lambda row: row[0], reverse=True)
+        lines = []
+        for p95, key, total, heaviest in rows[:top]:
+            line = f'{key}: p50 {total.percentile(50):.0f} ms, p95 {p95:.0f} ms, max {total.max:.0f} ms ({total.count})'
+            if heaviest is not None:
+                line += f', mostly {heaviest}'
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def clear(self):
+        self.histograms.clear()
+        self._slowest.clear()
@@ -22,8 +22,9 @@ if platform.system() == 'Linux':
 
 import config
 from functions import caching, locale, utime
+from functions.event_recording import EventRecorder
 from functions.ulogging import get_logger
-from utypes import GameVersion, States, GameVersionData
+from utypes import GameVersion, States, GameVersionData, PlayerCountBuffer
 
 VALVE_TIMEZONE = ZoneInfo('America/Los_Angeles')
 loc = locale('ru')
@@ -81,6 +82,8 @@ client.set_credential_location(config.STEAM_CREDS_PATH)
 cs = CSGOClient(client)
 gevent_scheduler = GeventScheduler()
 async_scheduler = AsyncIOScheduler()
+player_count_buffer = PlayerCountBuffer.open(config.DATA_FOLDER)
+recorder: EventRecorder | None = None  # run with --record to capture events for gc_replay.py
 
 going_to_shutdown = False  # can be used in jobs to safely call sys.exit() afterwards
 
@@ -135,6 +138,9 @@ def cs_launched():
 
 @cs.on('connection_status')
 def update_gc_status(status):
+    if recorder is not None:
+        recorder.record('connection_status', status)
+
     statuses = {0: States.NORMAL, 1: States.INTERNAL_SERVER_ERROR, 2: States.OFFLINE,
                 3: States.RELOADING, 4: States.INTERNAL_STEAM_ERROR}
     game_coordinator_state = statuses.get(status, States.UNKNOWN).literal
@@ -163,14 +169,21 @@ async def update_depots():
         logger.exception('Caught gevent.Timeout, we\'re going to shutdown...')
         return
 
-    cache = caching.load_cache(config.GC_CACHE_FILE_PATH)
-
     new_data = {
         'cs2_app_changenumber': cs2_app_change_number,
         'cs2_server_changenumber': cs2_server_change_number,
         'branches': current_branches
     }
 
+    if recorder is not None:
+        recorder.record('product_info', new_data)
+
+    await handle_depots(new_data)
+
+
+async def handle_depots(new_data: dict):
+    cache = caching.load_cache(config.GC_CACHE_FILE_PATH)
+
     for key, new_value in new_data.items():
         old_value = cache.get(key)
         if old_value is None or old_value == new_value:
@@ -237,6 +250,8 @@ async def check_for_branches_updates(cache: dict, cached_branches: dict, current
 
         if branch_name == 'public':
             game_version_data = await get_game_version_loop(cache.get('cs2_client_version'))
+            if recorder is not None:
+                recorder.record('game_version', game_version_data.asdict())
             cache.update(game_version_data.asdict())
             event = 'public_branch_updated'
         elif is_backup_branch(branch_name):
@@ -288,6 +303,14 @@ async def get_game_version(session: requests.Session, cs2_client_version: int |
 def online_players():
     player_count = client.get_player_count(730)
 
+    if recorder is not None:
+        recorder.record('player_count', player_count)
+
+    dump_player_count(player_count)
+
+
+def dump_player_count(player_count: int):
+    player_count_buffer.append(time.time(), player_count)
     caching.dump_cache_changes(config.GC_CACHE_FILE_PATH, {'online_players': player_count})
 
     logger.info(f'Successfully dumped player count: {player_count}')
@@ -371,4 +394,6 @@ async def main():
 
 
 if __name__ == '__main__':
+    if '--record' in sys.argv:
+        recorder = EventRecorder(config.DATA_FOLDER / 'gc_events.jsonl')
     asyncio.run(main())
@@ -0,0 +1,193 @@
+"""
+Replays game coordinator events recorded with ``python game_coordinator.py --record``
+through the same handlers, without Steam or Telegram.
+
+Usage:
+    python gc_replay.py data/gc_events.jsonl
+    python gc_replay.py --synthetic 30  # a month of generated events
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+from collections import Counter, deque
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Iterable
+from unittest import mock
+
+import config
+from functions import caching
+from functions.event_recording import RecordedEvent, read_events
+import game_coordinator as gc
+from utypes import GameVersionData, PlayerCountBuffer
+
+
+EVENTS_INTERVAL = 45  # both update_depots and online_players run every 45 seconds
+
+
+class VirtualClock:
+    """Drop-in replacement for the ``time`` module functions used by the game coordinator."""
+
+    def __init__(self, now: float = 0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def advance_to(self, timestamp: float):
+        self.now = max(self.now, timestamp)
+
+
+@dataclass
+class ReplayResult:
+    alerts: list[tuple[float, str]] = field(default_factory=list)
+    events_handled: Counter = field(default_factory=Counter)
+    elapsed: float = 0
+
+    @property
+    def events_per_second(self) -> float:
+        return sum(self.events_handled.values()) / self.elapsed if self.elapsed else 0
+
+    def summary(self) -> str:
+        lines = [f'Replayed {sum(self.events_handled.values())} events in {self.elapsed:.2f}s '
+                 f'({self.events_per_second:,.0f} events/s)']
+        lines += [f'  {event}: {count}' for event, count in sorted(self.events_handled.items())]
+        lines.append(f'Alerts captured: {len(self.alerts)}')
+        return '\n'.join(lines)
+
+
+class GameCoordinatorReplay:
+    """
+    Feeds recorded events through ``game_coordinator`` handlers at maximum speed.
+
+    The GC cache and the player count buffer live in a temporary folder,
+    alerts are captured instead of being sent and the game version is taken
+    from the recorded ``game_version`` events instead of being requested.
+    """
+
+    def __init__(self, events: Iterable[RecordedEvent], initial_cache: dict = None):
+        events = sorted(events, key=lambda e: e.time)
+        self.events = [e for e in events if e.event != 'game_version']
+        self.game_versions = deque(GameVersionData(**e.data) for e in events if e.event == 'game_version')
+        self.initial_cache = initial_cache or {}
+        self.clock = VirtualClock(self.events[0].time if self.events else 0)
+        self.result = ReplayResult()
+
+    async def _capture_alert(self, text: str):
+        self.result.alerts.append((self.clock.time(), text))
+
+    async def _recorded_game_version(self, cs2_client_version: int | None) -> GameVersionData:
+        if self.game_versions:
+            return self.game_versions.popleft()
+
+        cache = caching.load_cache(config.GC_CACHE_FILE_PATH)
+        return GameVersionData(cache.get('cs2_client_version', cs2_client_version),
+                               cache.get('cs2_server_version'),
+                               cache.get('cs2_patch_version'),
+                               cache.get('cs2_version_timestamp'))
+
+    async def _handle(self, event: RecordedEvent):
+        if event.event == 'product_info':
+            await gc.handle_depots(event.data)
+        elif event.event == 'player_count':
+            gc.dump_player_count(event.data)
+        elif event.event == 'connection_status':
+            gc.update_gc_status(event.data)
+        else:
+            return
+
+        self.result.events_handled[event.event] += 1
+
+    async def run(self) -> ReplayResult:
+        with tempfile.TemporaryDirectory() as workdir, ExitStack() as stack:
+            workdir = Path(workdir)
+            cache_path = workdir / 'gc_cache.json'
+            caching.dump_cache(cache_path, self.initial_cache)
+
+            stack.enter_context(mock.patch.object(config, 'GC_CACHE_FILE_PATH', cache_path))
+            stack.enter_context(mock.patch.object(gc, 'time', self.clock))
+            stack.enter_context(mock.patch.object(gc, 'recorder', None))
+            stack.enter_context(mock.patch.object(gc, 'player_count_buffer', PlayerCountBuffer.open(workdir)))
+            stack.enter_context(mock.patch.object(gc, 'send_text_alert', self._capture_alert))
+            stack.enter_context(mock.patch.object(gc, 'get_game_version_loop', self._recorded_game_version))
+            stack.enter_context(mock.patch.object(gc.logger, 'disabled', True))
+
+            start = time.perf_counter()
+            for event in self.events:
+                self.clock.advance_to(event.time)
+                await self._handle(event)
+            self.result.elapsed = time.perf_counter() - start
+
+        return self.result
+
+
+def synthesize_events(days: int, seed: int = 0) -> list[RecordedEvent]:
+    """Generates a plausible event stream: depots and player count every 45s, rare branch and GC changes."""
+
+    rng = random.Random(seed)
+    now = time.time() - days * 24 * 60 * 60
+
+    buildid = 13_000_000
+    app_changenumber = server_changenumber = 24_000_000
+    client_version = 1000
+    branches = {'public': {'buildid': str(buildid)}}
+
+    events = []
+    for i in range(days * 24 * 60 * 60 // EVENTS_INTERVAL):
+        t = now + i * EVENTS_INTERVAL
+        roll = rng.random()
+
+        if roll < 0.001:
+            buildid += 1
+            client_version += 1
+            branches['public'] = {'buildid': str(buildid)}
+            events.append(RecordedEvent(t + 1, 'game_version',
+                                        GameVersionData(client_version, client_version,
+                                                        f'1.40.{client_version}', t).asdict()))
+        elif roll < 0.002:
+            buildid += 1
+            branches[f'1.40.{rng.randint(0, client_version)}'] = {'buildid': str(buildid)}
+        elif roll < 0.0025 and len(branches) > 1:
+            del branches[rng.choice([name for name in branches if name != 'public'])]
+        elif roll < 0.004:
+            app_changenumber += 1
+        elif roll < 0.005:
+            server_changenumber += 1
+
+        events.append(RecordedEvent(t, 'product_info',
+                                    {'cs2_app_changenumber': app_changenumber,
+                                     'cs2_server_changenumber': server_changenumber,
+                                     'branches': {name: data.copy() for name, data in branches.items()}}))
+        events.append(RecordedEvent(t + 0.5, 'player_count', int(800_000 + 400_000 * rng.random())))
+        if roll > 0.999:
+            events.append(RecordedEvent(t + 0.7, 'connection_status', rng.choice((0, 0, 1, 2, 3))))
+
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('events_file', nargs='?', type=Path)
+    parser.add_argument('--synthetic', type=int, metavar='DAYS', help='replay generated events instead of a file')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        events = synthesize_events(args.synthetic)
+    elif args.events_file:
+        events = read_events(args.events_file)
+    else:
+        parser.error('either events_file or --synthetic is required')
+        return
+
+    result = asyncio.run(GameCoordinatorReplay(events).run())
+    print(result.summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,7 @@ from l10n import LocaleKeys as LK, get_available_languages
 
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, User
 
-from bottypes import ExtendedIKB, ExtendedIKM
+from bottypes import ExtendedIKB, ExtendedIKM, SelectionIndex
 
 
 # "Reply through logger" markup builder
@@ -314,3 +314,6 @@ language_settings_markup = ExtendedIKM(get_language_settings_layout())
 all_selectable_markups = (ss_markup, extra_markup,
                           dc_markup, dc_asia_markup, dc_eu_markup, dc_us_markup, dc_southamerica_markup,
                           pistols_markup, heavy_markup, smgs_markup, rifles_markup, language_settings_markup)
+
+# pressed buttons of these markups get selected when the markups are rendered during the same update
+selection_index = SelectionIndex(all_selectable_markups)
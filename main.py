@@ -3,6 +3,7 @@ from __future__ import annotations
 import asyncio
 import datetime as dt
 from json import JSONDecodeError
+from pathlib import Path
 import traceback
 from typing import TYPE_CHECKING
 from zoneinfo import ZoneInfo
@@ -18,14 +19,15 @@ from pyrogram.types import CallbackQuery, Message
 from pyropatch import pyropatch  # do not remove this!!
 from telegraph.aio import Telegraph
 
-from bottypes import BotClient, ExtendedIKB, ExtendedIKM
-from bottypes.logger import ReplyBackBotLogger
+from bottypes import BotClient, ExtendedIKB, ExtendedIKM, SelectedIKM
+from bottypes.logger import MAX_QUEUED_BYTES, MAX_QUEUED_EVENTS, ReplyBackBotLogger
 import config
 from dcatlas import DatacenterAtlas
 from db import db_session
 from functions import caching, info_formatters, utime
 from functions.decorators import ignore_message_not_modified
 from functions.locale import get_available_languages
+from functions.tracing import JSONLExporter, Tracer
 from functions.ulogging import get_logger
 import keyboards
 # noinspection PyPep8Naming
@@ -59,6 +61,19 @@ VALVE_TIMEZONE = ZoneInfo('America/Los_Angeles')
 
 logger = get_logger('INCS2bot', config.LOGS_FOLDER, config.LOGS_CONFIG_FILE_PATH)
 
+# set TRACES_FILE_PATH in config to get every handled update with its spans in a JSONL file
+TRACES_FILE_PATH = getattr(config, 'TRACES_FILE_PATH', None)
+# set USER_DB_URL in config to keep users in another database (e.g. postgresql+asyncpg://...) instead of SQLite
+USER_DB_URL = getattr(config, 'USER_DB_URL', None)
+# set USER_DB_PRAGMAS in config to override SQLite pragmas of db.stores.SQLITE_PRAGMAS (None turns one off)
+USER_DB_PRAGMAS = getattr(config, 'USER_DB_PRAGMAS', None)
+# set LOG_QUEUE_MAX_EVENTS and LOG_QUEUE_MAX_BYTES in config to change the budget of events waiting to be logged
+LOG_QUEUE_MAX_EVENTS = getattr(config, 'LOG_QUEUE_MAX_EVENTS', MAX_QUEUED_EVENTS)
+LOG_QUEUE_MAX_BYTES = getattr(config, 'LOG_QUEUE_MAX_BYTES', MAX_QUEUED_BYTES)
+# active sessions are saved there on shutdown and loaded back on startup
+SESSIONS_SNAPSHOT_FILE_PATH = getattr(config, 'SESSIONS_SNAPSHOT_FILE_PATH',
+                                      Path(config.DATA_FOLDER) / 'sessions.snapshot')
+
 bot = BotClient(config.BOT_NAME,
                 api_id=config.API_ID,
                 api_hash=config.API_HASH,
@@ -66,8 +81,10 @@ bot = BotClient(config.BOT_NAME,
                 plugins={'root': 'plugins'},
                 test_mode=config.TEST_MODE,
                 workdir=config.SESS_FOLDER,
-                telegram_logger=ReplyBackBotLogger(config.LOGCHANNEL, keyboards.event_log_markup_builder),
-                navigate_back_callback=LK.bot_back,)
+                telegram_logger=ReplyBackBotLogger(config.LOGCHANNEL, keyboards.event_log_markup_builder,
+                                                   max_events=LOG_QUEUE_MAX_EVENTS, max_bytes=LOG_QUEUE_MAX_BYTES),
+                navigate_back_callback=LK.bot_back,
+                tracer=Tracer(exporter=JSONLExporter(TRACES_FILE_PATH) if TRACES_FILE_PATH else None))
 
 telegraph = Telegraph(access_token=config.TELEGRAPH_ACCESS_TOKEN)
 
@@ -86,8 +103,7 @@ async def handle_exceptions_in_callback(client: BotClient, session: UserSession,
 
 @bot.on_message(~filters.me)
 async def handle_messages(client: BotClient, message: Message):
-    result = await client.handle_message(message)
-    if result is None:
+    if not client.dispatch_message(message):
         message.continue_propagation()
 
 
@@ -96,10 +112,15 @@ async def handle_callbacks(client: BotClient, callback_query: CallbackQuery):
     if callback_query.message.chat.id == client.telegram_logger.log_channel_id:
         return await handle_callbacks_in_logger(client, callback_query)
 
-    for markup in keyboards.all_selectable_markups:
-        markup.select_button_by_key(callback_query.data)
+    client.dispatch_callback(callback_query, lambda query: handle_user_callback(client, query))
 
-    return await client.handle_callback(callback_query)
+
+async def handle_user_callback(client: BotClient, callback_query: CallbackQuery):
+    selection = keyboards.selection_index.select(callback_query.data)
+    try:
+        return await client.handle_callback(callback_query)
+    finally:
+        keyboards.selection_index.reset(selection)
 
 
 async def handle_callbacks_in_logger(client: BotClient, callback_query: CallbackQuery):
@@ -635,10 +656,10 @@ async def send_game_leaderboard(_, session: UserSession, bot_message: Message,
                                 region: str = LK.game_leaderboard_world):
     """Sends the CS2 leaderboard (top-10), supports both world and regional"""
 
-    keyboards.leaderboard_markup.select_button_by_key(region)
+    reply_markup = keyboards.leaderboard_markup.select(region)
 
     await bot_message.edit(session.locale.bot_loading,
-                           reply_markup=keyboards.leaderboard_markup(session.locale))
+                           reply_markup=reply_markup(session.locale))
 
     core_cache = caching.load_cache(config.CORE_CACHE_FILE_PATH)
 
@@ -650,7 +671,7 @@ async def send_game_leaderboard(_, session: UserSession, bot_message: Message,
         data = LeaderboardStats.cached_regional_stats(core_cache, region)
         text = info_formatters.format_game_regional_leaderboard(data, session.locale)
 
-    await bot_message.edit(text, reply_markup=keyboards.leaderboard_markup(session.locale))
+    await bot_message.edit(text, reply_markup=reply_markup(session.locale))
 
 
 # cat: Crosshair editor
@@ -718,9 +739,8 @@ async def pistols_process(client: BotClient, session: UserSession, callback_quer
     bot_message = callback_query.message
 
     if chosen_gun in GUNS_INFO:
-        keyboards.pistols_markup.select_button_by_key(chosen_gun)
         return await send_gun_info(client, session, bot_message, pistols, GUNS_INFO[chosen_gun],
-                                   reply_markup=keyboards.pistols_markup)
+                                   reply_markup=keyboards.pistols_markup.select(chosen_gun))
     if chosen_gun == LK.bot_back:
         return await client.go_back(session, bot_message)
     return await unknown_request(client, session, bot_message, keyboards.pistols_markup)
@@ -749,9 +769,8 @@ async def heavy_process(client: BotClient, session: UserSession, callback_query:
     bot_message = callback_query.message
 
     if chosen_gun in GUNS_INFO:
-        keyboards.heavy_markup.select_button_by_key(chosen_gun)
         return await send_gun_info(client, session, bot_message, heavy, GUNS_INFO[chosen_gun],
-                                   reply_markup=keyboards.heavy_markup)
+                                   reply_markup=keyboards.heavy_markup.select(chosen_gun))
     if chosen_gun == LK.bot_back:
         return await client.go_back(session, bot_message)
     return await unknown_request(client, session, bot_message, keyboards.heavy_markup)
@@ -780,9 +799,8 @@ async def smgs_process(client: BotClient, session: UserSession, callback_query:
     bot_message = callback_query.message
 
     if chosen_gun in GUNS_INFO:
-        keyboards.smgs_markup.select_button_by_key(chosen_gun)
         return await send_gun_info(client, session, bot_message, smgs, GUNS_INFO[chosen_gun],
-                                   reply_markup=keyboards.smgs_markup)
+                                   reply_markup=keyboards.smgs_markup.select(chosen_gun))
     if chosen_gun == LK.bot_back:
         return await client.go_back(session, bot_message)
     return await unknown_request(client, session, bot_message, keyboards.smgs_markup)
@@ -811,16 +829,15 @@ async def rifles_process(client: BotClient, session: UserSession, callback_query
     bot_message = callback_query.message
 
     if chosen_gun in GUNS_INFO:
-        keyboards.rifles_markup.select_button_by_key(chosen_gun)
         return await send_gun_info(client, session, bot_message, rifles, GUNS_INFO[chosen_gun],
-                                   reply_markup=keyboards.rifles_markup)
+                                   reply_markup=keyboards.rifles_markup.select(chosen_gun))
     if chosen_gun == LK.bot_back:
         return await client.go_back(session, bot_message)
     return await unknown_request(client, session, bot_message, keyboards.rifles_markup)
 
 
 async def send_gun_info(client: BotClient, session: UserSession, bot_message: Message, _from: Callable,
-                        gun_info: GunInfo, reply_markup: ExtendedIKM):
+                        gun_info: GunInfo, reply_markup: ExtendedIKM | SelectedIKM):
     """Send archived data about guns"""
 
     try:
@@ -851,12 +868,10 @@ async def settings(_, session: UserSession, bot_message: Message):
 
 @bot.navmenu(LK.settings_language_button_title, came_from=settings, ignore_message_not_modified=True)
 async def language(client: BotClient, session: UserSession, bot_message: Message):
-    keyboards.language_settings_markup.select_button_by_key(session.locale.lang_code)
-
     chosen_lang = await client.ask_callback_silently(
         bot_message,
         session.locale.settings_language_choose.format(AVAILABLE_LANGUAGES.get(session.locale.lang_code)),
-        reply_markup=keyboards.language_settings_markup(session.locale),
+        reply_markup=keyboards.language_settings_markup.select(session.locale.lang_code)(session.locale),
         timeout=ASK_TIMEOUT
     )
 
@@ -906,7 +921,7 @@ async def welcome(client: BotClient, session: UserSession, message: Message):
 
     text = session.locale.bot_start_text.format(message.from_user.first_name)
 
-    session.current_menu_id = main_menu.id
+    session.current_menu_id = main_menu.code
     return await message.reply(text, reply_markup=keyboards.main_markup(session.locale))
 
 
@@ -930,7 +945,7 @@ async def reply_through_logger_command(client: BotClient, message: Message):
         recipient_pm_chat = await client.get_chat(recipient.username)
     except PeerIdInvalid:
         await message.reply("You can't send messages to this user (perhaps, they haven't interacted with the bot yet).")
-        session.current_menu_id = main_menu.id
+        session.current_menu_id = main_menu.code
         return await message.reply(session.locale.bot_choose_cmd,
                                    reply_markup=keyboards.main_markup(session.locale))
 
@@ -939,7 +954,7 @@ async def reply_through_logger_command(client: BotClient, message: Message):
                                                     f'<blockquote>{message_to_send}</blockquote>')
 
     await message.reply('Successfully sent the message.')
-    session.current_menu_id = main_menu.id
+    session.current_menu_id = main_menu.code
     return await message.reply(session.locale.bot_choose_cmd,
                                reply_markup=keyboards.main_markup(session.locale))
 
@@ -958,7 +973,7 @@ async def reply_through_logger_callback(client: BotClient, session: UserSession,
         recipient_pm_chat = await client.get_chat(recipient.username)
     except PeerIdInvalid:
         await e.edit("You can't send messages to this user (perhaps, they blocked the bot).")
-        session.current_menu_id = main_menu.id
+        session.current_menu_id = main_menu.code
         return await e.reply(session.locale.bot_choose_cmd,
                              reply_markup=keyboards.main_markup(session.locale))
 
@@ -973,14 +988,14 @@ async def reply_through_logger_callback(client: BotClient, session: UserSession,
     except asyncio.exceptions.TimeoutError:
         await e.reply("Timed out.")
 
-        session.current_menu_id = main_menu.id
+        session.current_menu_id = main_menu.code
         return await e.reply(session.locale.bot_choose_cmd,
                              reply_markup=keyboards.main_markup(session.locale))
 
     if message_to_send.text == '/cancel':
         await e.reply("Canceled.")
 
-        session.current_menu_id = main_menu.id
+        session.current_menu_id = main_menu.code
         return await e.reply(session.locale.bot_choose_cmd,
                              reply_markup=keyboards.main_markup(session.locale))
 
@@ -989,7 +1004,7 @@ async def reply_through_logger_callback(client: BotClient, session: UserSession,
                                                     f'<blockquote>{message_to_send.text}</blockquote>')
 
     await message_to_send.reply('Successfully sent the message.')
-    session.current_menu_id = main_menu.id
+    session.current_menu_id = main_menu.code
     return await message_to_send.reply(session.locale.bot_choose_cmd,
                                        reply_markup=keyboards.main_markup(session.locale))
 
@@ -1011,14 +1026,14 @@ async def pm_only(_, session: UserSession, message: Message):
 
 @ignore_message_not_modified
 async def send_about_maintenance(_, session: UserSession, bot_message: Message):
-    session.current_menu_id = main_menu.id
+    session.current_menu_id = main_menu.code
     await bot_message.edit(session.locale.valve_steam_maintenance_text,
                            reply_markup=keyboards.main_markup(session.locale))
 
 
 @ignore_message_not_modified
 async def something_went_wrong(_, session: UserSession, bot_message: Message):
-    session.current_menu_id = main_menu.id
+    session.current_menu_id = main_menu.code
     await bot_message.edit(session.locale.error_internal,
                            reply_markup=keyboards.main_markup(session.locale))
 
@@ -1042,6 +1057,14 @@ async def regular_stats_report(client: BotClient):
             f'• Callback queries handled: {client.rstats.callback_queries_handled}\n'
             f'• Inline queries handled: {client.rstats.inline_queries_handled}\n'
             f'• Exceptions caught: {client.rstats.exceptions_caught}\n'
+            f'• Identical message edits skipped: {client.rstats.message_edits_skipped}\n'
+            f'• Logs waiting to be sent: {client.telegram_logger.queue_depth} '
+            f'({client.telegram_logger.lag:.0f} s behind), folded: {client.telegram_logger.folded_events}, '
+            f'dropped: {client.telegram_logger.dropped_events}\n'
+            f'\n'
+            f'🐢 **Slowest menus:**\n'
+            f'\n'
+            f'{client.tracer.report() or "—"}\n'
             f'\n'
             f'📁 **Other stats:**\n'
             f'\n'
@@ -1049,6 +1072,7 @@ async def regular_stats_report(client: BotClient):
             f'• Is working for: {info_formatters.format_timedelta(now - client.startup_dt)}')
     await client.log(text, instant=True)
     client.rstats.clear()
+    client.tracer.clear()
 
 
 async def drop_cap_reset_in_10_minutes(client: BotClient):  # todo: finish testing this damn thing
@@ -1067,7 +1091,9 @@ async def drop_cap_reset_in_10_minutes(client: BotClient):  # todo: finish testi
 async def main():
     logger.info('Started.')
     scheduler = AsyncIOScheduler()
-    scheduler.add_job(bot.clear_timeout_sessions, 'interval', minutes=30)
+    scheduler.add_job(bot.evict_timeout_sessions, 'interval', seconds=10)
+    scheduler.add_job(bot.flush_sessions, 'interval', minutes=1)
+    scheduler.add_job(db_session.optimize, 'interval', hours=6)
     scheduler.add_job(regular_stats_report, 'interval', hours=8,
                       args=(bot,))
     scheduler.add_job(drop_cap_reset_in_10_minutes, 'cron', day_of_week=1, hour=16, minute=49, second=59,
@@ -1075,7 +1101,9 @@ async def main():
                       args=(bot,))
 
     try:
-        await db_session.init(config.USER_DB_FILE_PATH)
+        await db_session.init(USER_DB_URL or config.USER_DB_FILE_PATH, USER_DB_PRAGMAS)
+        await bot.load_menu_codes(db_session.store())
+        await bot.load_sessions(SESSIONS_SNAPSHOT_FILE_PATH)
         await bot.start()
         scheduler.start()
         await bot.log('Bot started.', instant=True)
@@ -1088,7 +1116,8 @@ async def main():
     finally:
         logger.info('Shutting down the bot...')
         await bot.log('Bot is shutting down...', instant=True)
-        await bot.dump_sessions()
+        await bot.dump_sessions(SESSIONS_SNAPSHOT_FILE_PATH)
+        await db_session.close()
         await bot.stop(block=False)
         logger.info('Terminated.')
 
@@ -1,161 +1,181 @@
 from __future__ import annotations
 
+from io import BytesIO
 import json
 import time
 from typing import TYPE_CHECKING
 
-import requests
 from apscheduler.schedulers.blocking import BlockingScheduler
-from matplotlib.colors import LinearSegmentedColormap
-from matplotlib.cm import ScalarMappable
-import matplotlib.dates as mdates
-import matplotlib.pyplot as plt
-from matplotlib.ticker import FixedFormatter
-import pandas as pd
-import seaborn as sns
+import requests
 
 import config
-from functions import utime
+from functions import caching, utime
+from functions.image_upload import CATBOX, ImageUploader, UploadError, supa_uploader
+from functions.player_graph import DEFAULT_GRAPH_WINDOW, GRAPH_WINDOWS, GraphWindow, PlayerGraphRenderer, lttb
+from functions.staged_pipeline import Stage, StagedPipeline
+from functions.telegram_photos import TelegramAPIError, TelegramPhotoChannel
 from functions.ulogging import get_logger
+from utypes import PlayerChart, PlayerCountBuffer, PlayerHistory
 
 if TYPE_CHECKING:
-    from typing import BinaryIO
+    import numpy as np
+
+    from utypes import PlayerCountBucket
 
 MINUTE = 60
 MAX_ONLINE_MARKS = (MINUTE // 10) * 24 * 7 * 2  # = 2016 marks - every 10 minutes for the last two weeks
+MARK_INTERVAL = 10 * MINUTE
+MIN_PLAYER_COUNT = 50_000  # anything lower is potentially Steam maintenance
+GRAPH_POINTS = 1008  # pixel budget of a graph, so a longer window doesn't mean a slower render
+RENDER_TIMEOUT = 2 * MINUTE
+UPLOAD_TIMEOUT = MINUTE
+# the whole run ends before the next tick, leaving a request of an abandoned stage the time to give up
+GRAPH_RUN_DEADLINE = MARK_INTERVAL - 2 * UPLOAD_TIMEOUT
 
 logger = get_logger('online_players_graph', config.LOGS_FOLDER, config.LOGS_CONFIG_FILE_PATH)
 
 scheduler = BlockingScheduler()
+player_count_buffer = PlayerCountBuffer.open(config.DATA_FOLDER)
+player_chart = PlayerChart.open(config.DATA_FOLDER, MAX_ONLINE_MARKS)
+if not len(player_chart) and config.PLAYER_CHART_FILE_PATH.exists():  # one-time migration from the CSV chart
+    player_chart.import_csv(config.PLAYER_CHART_FILE_PATH)
+player_history = PlayerHistory.open(config.DATA_FOLDER, player_chart)  # hourly and daily rollups of older marks
+
+renderer = PlayerGraphRenderer()
+images = {window.name: BytesIO() for window in GRAPH_WINDOWS}
+for name, image in images.items():
+    image.name = f'graph_{name}.png'
+
+uploader = ImageUploader([supa_uploader('i.supa.codes'), supa_uploader('kappa.lol'), CATBOX],
+                         headers=config.REQUESTS_HEADERS,
+                         timeout=UPLOAD_TIMEOUT)
+
+# every graph lives in one message in the log channel, which gets its photo replaced on every new render
+telegram_photos = TelegramPhotoChannel(config.BOT_TOKEN, config.LOGCHANNEL,
+                                       caching.load_cache(config.GRAPH_CACHE_FILE_PATH).get('graph_photos'),
+                                       test_mode=config.TEST_MODE,
+                                       timeout=UPLOAD_TIMEOUT)
+
 
-cmap = LinearSegmentedColormap.from_list('custom', [(1, 1, 0), (1, 0, 0)], N=100)
-norm = plt.Normalize(0, 2_000_000)
-mappable = ScalarMappable(norm=norm, cmap=cmap)
+def select_marks(window: GraphWindow, now: float) -> tuple[np.ndarray, np.ndarray, list[PlayerCountBucket]]:
+    """Picks timestamps and player counts of ``window``, downsampled to the graph's point budget, and their spread."""
 
-ticks = [0, 250000, 500000, 750000, 1000000, 1250000, 1500000, 1750000, 2000000]
-colorbar_ticks_format = FixedFormatter(['0', '250K', '500K', '750K', '1M', '1.25M', '1.5M', '1.75M', '2M+'])
-fig_ticks_format = ['' for _ in ticks]
+    start = now - window.span
 
-x_major_locator = mdates.DayLocator()
-x_major_formatter = mdates.DateFormatter('%b %d')
+    # raw samples are denser than the chart marks, so use them while they reach back far enough
+    samples = player_count_buffer.window(start, now)
+    if samples.size and samples['timestamp'][0] - start <= MARK_INTERVAL:
+        samples = samples[samples['players'] >= MIN_PLAYER_COUNT]
+        timestamps, players = samples['timestamp'], samples['players']
+    else:
+        # chart marks or, further back, hourly and daily rollups - whose peaks get plotted, just like the marks are
+        rows = player_history.range(start, now)
+        timestamps, players = rows['start'], rows['max']
 
+    keep = lttb(timestamps, players, GRAPH_POINTS)
+    buckets = player_count_buffer.buckets(max(MARK_INTERVAL, window.span // GRAPH_POINTS), start, now)
+    return timestamps[keep], players[keep], buckets
 
-def upload_image_online(image: BinaryIO, host: str) -> str:
-    allowed_hosts = {'i.supa.codes', 'kappa.lol', 'gachi.gay', 'femboy.beauty'}  # https://github.com/0Supa/uploader
 
-    if host not in allowed_hosts:
-        raise TypeError(f'unknown host, choose one of these: {allowed_hosts}')
+def render_graphs(selections: list[tuple[GraphWindow, np.ndarray, np.ndarray, list]]) -> dict[str, BytesIO]:
+    for window, timestamps, players, buckets in selections:
+        renderer.set_window(window)
+        renderer.update(timestamps, players, buckets)
+        renderer.render(images[window.name])
 
-    response = requests.post(f'https://{host}/api/upload',
-                             headers=config.REQUESTS_HEADERS,
-                             files={'file': image})
+    with open(config.GRAPH_IMG_FILE_PATH, 'wb') as f:
+        f.write(images[DEFAULT_GRAPH_WINDOW].getbuffer())
 
-    if response.status_code != 200:
-        logger.error(f'Caught error while uploading graph image to the file uploader ({host})!',
-                     response.status_code, response.reason, response.text)
-        return ''
+    return images
 
-    return response.text
 
+def publish_graph_photos(rendered: dict[str, BytesIO]) -> dict[str, BytesIO]:
+    """Puts graphs on Telegram and caches their file IDs, before and regardless of the external uploads."""
 
-def upload_image_to_catbox(image: BinaryIO) -> str:  # might be blocked on some hostings
-    response = requests.post('https://catbox.moe/user/api.php',
-                             headers=config.REQUESTS_HEADERS,
-                             data={'reqtype': 'fileupload'},
-                             files={'fileToUpload': image})
+    file_ids = {}
+    for name, image in rendered.items():
+        try:
+            file_ids[name] = telegram_photos.publish(name, image.getvalue(), image.name)
+        except (TelegramAPIError, requests.RequestException):
+            logger.exception(f'Caught exception while publishing {name} graph image to Telegram!')
+
+    cache = caching.load_cache(config.GRAPH_CACHE_FILE_PATH)
+    cache['graph_file_ids'] = cache.get('graph_file_ids', {}) | file_ids
+    cache['graph_file_id'] = cache['graph_file_ids'].get(DEFAULT_GRAPH_WINDOW, '')
+    cache['graph_photos'] = telegram_photos.photos
+    caching.dump_cache(config.GRAPH_CACHE_FILE_PATH, cache)
+    return rendered
+
+
+def upload_graphs(rendered: dict[str, BytesIO]) -> dict[str, str]:
+    """Returns URLs of the graphs that got uploaded (or didn't change since the last upload)."""
+
+    urls = {}
+    for name, image in rendered.items():
+        try:
+            urls[name] = uploader.upload(image.getvalue(), image.name)
+        except UploadError:
+            logger.error(f'Failed to upload {name} graph image to any of the file uploaders!')
 
-    if response.status_code != 200:
-        logger.error('Caught error while uploading graph image to the file uploader (catbox.moe)!',
-                     response.status_code, response.reason, response.text)
-        return ''
+    return urls
 
-    return response.text
+
+def store_graph_urls(urls: dict[str, str]):
+    with open(config.GRAPH_CACHE_FILE_PATH, encoding='utf-8') as f:
+        cache = json.load(f)
+
+    # graphs that failed to upload keep their previous URL instead of losing it
+    graph_urls = cache.get('graph_urls', {}) | urls
+    cache['graph_url'] = graph_urls.get(DEFAULT_GRAPH_WINDOW, cache.get('graph_url', ''))
+    cache['graph_urls'] = graph_urls
+
+    with open(config.GRAPH_CACHE_FILE_PATH, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, indent=4, ensure_ascii=False)
+    logger.info('Successfully plotted the player count graphs.')
+
+
+# rendering and uploading run off the scheduler, so a hung upload can't eat the next tick
+pipeline = StagedPipeline('graph', [Stage('render', render_graphs, RENDER_TIMEOUT),
+                                    Stage('telegram', publish_graph_photos, UPLOAD_TIMEOUT * len(GRAPH_WINDOWS)),
+                                    Stage('upload', upload_graphs, UPLOAD_TIMEOUT * len(GRAPH_WINDOWS)),
+                                    Stage('cache', store_graph_urls, MINUTE)],
+                          logger, deadline=GRAPH_RUN_DEADLINE)
 
 
 @scheduler.scheduled_job('cron', hour='*', minute='0,10,20,30,40,50', second='0')
 def graph_maker():
     # noinspection PyBroadException
     try:
-        old_player_data = pd.read_csv(config.PLAYER_CHART_FILE_PATH, parse_dates=['DateTime'])
-
-        marks_count = len(old_player_data.index)
-        if marks_count >= MAX_ONLINE_MARKS:
-            remove_marks = marks_count - MAX_ONLINE_MARKS
-            old_player_data.drop(range(remove_marks + 1), axis=0, inplace=True)
-
-        with open(config.GC_CACHE_FILE_PATH, encoding='utf-8') as f:
-            player_count = json.load(f).get('online_players', 0)
-
-        if player_count < 50_000:  # potentially Steam maintenance
-            player_count = old_player_data.iloc[-1]['Players']
-
-        temp_player_data = pd.DataFrame(
-            [[f'{utime.utcnow():%Y-%m-%d %H:%M:%S}', player_count]],
-            columns=['DateTime', 'Players'],
-        )
-
-        new_player_data = pd.concat([old_player_data, temp_player_data])
-
-        new_player_data.to_csv(config.PLAYER_CHART_FILE_PATH, index=False)
-
-        fig: plt.Figure
-        ax: plt.Axes
-
-        sns.set_style('whitegrid')
-
-        fig, ax = plt.subplots(figsize=(10, 2.5))
-        ax.scatter('DateTime', 'Players',
-                   data=new_player_data,
-                   c='Players', cmap=cmap, s=10, norm=norm, linewidths=0.7)
-        ax.fill_between(new_player_data['DateTime'],
-                        new_player_data['Players'] - 20_000,
-                        color=cmap(0.5), alpha=0.4)
-        ax.margins(x=0)
-
-        ax.grid(visible=True, axis='y', linestyle='--', alpha=0.3)
-        ax.grid(visible=False, axis='x')
-        ax.spines['bottom'].set_position('zero')
-        ax.spines['bottom'].set_color('black')
-        ax.set(xlabel='', ylabel='')
-        ax.xaxis.set_ticks_position('bottom')
-        ax.xaxis.set_major_locator(x_major_locator)
-        ax.xaxis.set_major_formatter(x_major_formatter)
-        ax.legend(loc='upper left')
-        ax.text(0.20, 0.88,
-                'Made by @INCS2\n'
-                'updates every 10 min',
-                ha='center', transform=ax.transAxes, color='black', size='8')
-        ax.set_yticks(ticks, fig_ticks_format)
-
-        fig.colorbar(mappable, ax=ax,
-                     ticks=ticks,
-                     format=colorbar_ticks_format,
-                     pad=0.01)
-
-        fig.subplots_adjust(top=0.933, bottom=0.077, left=0.03, right=1.07)
-
-        fig.savefig(config.GRAPH_IMG_FILE_PATH, dpi=200)
-        plt.close()
+        now = utime.utcnow()
 
-        try:
-            with open(config.GRAPH_IMG_FILE_PATH, 'rb') as f:
-                image_url = upload_image_online(f, 'i.supa.codes')
-        except requests.HTTPError:
-            logger.exception('Caught exception while uploading graph image to the file uploader!')
-            image_url = ''
+        # the highest sample of the last 10 minutes, so short spikes make it to the graph
+        player_count = player_count_buffer.peak(now.timestamp() - MARK_INTERVAL, now.timestamp())
+        if player_count is None:  # game coordinator hasn't sampled anything yet
+            with open(config.GC_CACHE_FILE_PATH, encoding='utf-8') as f:
+                player_count = json.load(f).get('online_players', 0)
 
-        with open(config.GRAPH_CACHE_FILE_PATH, encoding='utf-8') as f:
-            cache = json.load(f)
+        if player_count < MIN_PLAYER_COUNT:  # potentially Steam maintenance
+            player_count = player_chart.latest()
 
-        cache['graph_url'] = image_url
+        player_chart.append(now.timestamp(), player_count)
 
-        with open(config.GRAPH_CACHE_FILE_PATH, 'w', encoding='utf-8') as f:
-            json.dump(cache, f, indent=4, ensure_ascii=False)
-        logger.info('Successfully plotted the player count graph.')
+        # copies, rendered on another thread while the chart keeps being appended to
+        selections = [(window, *select_marks(window, now.timestamp())) for window in GRAPH_WINDOWS]
     except Exception:
         logger.exception('Caught exception in graph maker!')
-        time.sleep(MINUTE)
-        return graph_maker()
+        return
+
+    pipeline.submit(selections)
+
+
+@scheduler.scheduled_job('cron', hour='*', minute='5', second='0')
+def compact_history():
+    # noinspection PyBroadException
+    try:
+        hours, days = player_history.compact(time.time())
+        logger.info(f'Rolled up {hours} hours and {days} days of player count history.')
+    except Exception:
+        logger.exception('Caught exception while compacting player count history!')
 
 
 def main():
@@ -164,6 +184,9 @@ def main():
         logger.info('Started.')
     except KeyboardInterrupt:
         logger.info('Terminated.')
+    finally:
+        pipeline.shutdown()
+        uploader.shutdown()
 
 
 if __name__ == '__main__':
@@ -7,16 +7,18 @@ import traceback
 from typing import TYPE_CHECKING
 
 from pyrogram.enums import ParseMode
-from pyrogram.types import InlineQuery, InlineQueryResultArticle, InputTextMessageContent
+from pyrogram.types import (InlineQuery, InlineQueryResultArticle, InlineQueryResultCachedPhoto,
+                            InputTextMessageContent)
 
 from bottypes import BotClient, UserSession
 import config
 from dcatlas import DatacenterAtlas
 from functions import info_formatters, caching
+from functions.tracing import name_trace
 import keyboards
 from l10n import load_tags
 from utypes import (DatacenterInlineResult, ExchangeRate,
-                    GameServers, GameVersion,
+                    GameServers, GameVersion, States,
                     drop_cap_reset_timer)
 
 if TYPE_CHECKING:
@@ -91,8 +93,20 @@ def dc_articles_factory(dcs: list[DatacenterInlineResult],
 
 @BotClient.on_inline_query()
 async def sync_user_data_inline(client: BotClient, inline_query: InlineQuery):
+    # a query still waiting for its turn is superseded by the next one the user types;
+    # queries only read an ephemeral session, so they don't wait behind the user's other updates
+    client.user_dispatcher.dispatch(inline_query.from_user.id, handle_inline, client, inline_query,
+                                    collapse_key='inline', lane_name='inline')
+
+
+async def handle_inline(client: BotClient, inline_query: InlineQuery):
+    with client.tracer.trace('inline'):
+        return await route_inline(client, inline_query)
+
+
+async def route_inline(client: BotClient, inline_query: InlineQuery):
     user = inline_query.from_user
-    session = await client.register_session(user)
+    session = client.get_ephemeral_session(user)
 
     await client.log_inline(session, inline_query)
 
@@ -102,11 +116,18 @@ async def sync_user_data_inline(client: BotClient, inline_query: InlineQuery):
 
     # if-chain because it's a plugin
     if is_user_stats_page(inline_query):
+        name_trace('inline.share')
         return await share_inline(client, session, inline_query)
     if query.startswith('price'):
+        name_trace('inline.price')
         return await inline_exchange_rate(client, session, inline_query)
     if query.startswith('dc'):
+        name_trace('inline.dc')
         return await inline_datacenters(client, session, inline_query)
+    if query.startswith('graph'):
+        name_trace('inline.graph')
+        return await inline_graphs(client, session, inline_query)
+    name_trace('inline.default')
     return await default_inline(client, session, inline_query)
 
 
@@ -288,6 +309,51 @@ async def inline_datacenters(_, session: UserSession, inline_query: InlineQuery)
     await inline_query.answer(resulted_articles, cache_time=10)
 
 
+@log_exception_inline
+async def inline_graphs(client: BotClient, session: UserSession, inline_query: InlineQuery):
+    core_cache = caching.load_cache(config.CORE_CACHE_FILE_PATH)
+    gc_cache = caching.load_cache(config.GC_CACHE_FILE_PATH)
+    graph_cache = caching.load_cache(config.GRAPH_CACHE_FILE_PATH)
+
+    matchmaking_stats_data = GameServers.cached_matchmaking_stats(core_cache, gc_cache, graph_cache)
+    if matchmaking_stats_data is States.UNKNOWN:
+        return await default_inline(client, session, inline_query)
+
+    # windows in the order the graph maker renders them, e.g. "graph 24h" picks one
+    windows = list(dict.fromkeys((*matchmaking_stats_data.graph_file_ids, *matchmaking_stats_data.graph_urls)))
+    try:
+        query = inline_query.query.split()[1].strip().lower()
+        windows = [window for window in windows if window == query] or windows
+    except IndexError:
+        pass
+
+    inline_btn = keyboards.markup_inline_button(session.locale)
+
+    results = []
+    for i, window in enumerate(windows):
+        text = info_formatters.format_matchmaking_stats(matchmaking_stats_data, session.locale, graph_window=window)
+        title = f'{session.locale.stats_matchmaking_inline_title} ({window})'
+        file_id = matchmaking_stats_data.graph_file_ids.get(window)
+        if file_id:
+            results.append(InlineQueryResultCachedPhoto(file_id,
+                                                        f'{i}',
+                                                        title=title,
+                                                        description=session.locale.stats_matchmaking_inline_description,
+                                                        caption=text,
+                                                        reply_markup=inline_btn))
+        else:
+            results.append(InlineQueryResultArticle(title,
+                                                    InputTextMessageContent(text),
+                                                    f'{i}',
+                                                    description=session.locale.stats_matchmaking_inline_description,
+                                                    reply_markup=inline_btn,
+                                                    thumb_url="https://telegra.ph/file/57ba2b279c53d69d72481.jpg"))
+
+    if not results:
+        return await default_inline(client, session, inline_query)
+    await inline_query.answer(results, cache_time=10)
+
+
 @log_exception_inline
 async def default_inline(_, session: UserSession, inline_query: InlineQuery):
     core_cache = caching.load_cache(config.CORE_CACHE_FILE_PATH)
@@ -312,12 +378,21 @@ async def default_inline(_, session: UserSession, inline_query: InlineQuery):
                                              description=session.locale.game_status_inline_description,
                                              reply_markup=inline_btn,
                                              thumb_url="https://telegra.ph/file/8b640b85f6d62f8ed2900.jpg")
-    matchmaking_stats = InlineQueryResultArticle(session.locale.stats_matchmaking_inline_title,
-                                                 InputTextMessageContent(matchmaking_stats_text),
-                                                 '1',
-                                                 description=session.locale.stats_matchmaking_inline_description,
-                                                 reply_markup=inline_btn,
-                                                 thumb_url="https://telegra.ph/file/57ba2b279c53d69d72481.jpg")
+    if matchmaking_stats_data is not States.UNKNOWN and matchmaking_stats_data.graph_file_id:
+        # the graph is already on Telegram, so it doesn't have to be fetched from a file host as a link preview
+        matchmaking_stats = InlineQueryResultCachedPhoto(matchmaking_stats_data.graph_file_id,
+                                                         '1',
+                                                         title=session.locale.stats_matchmaking_inline_title,
+                                                         description=session.locale.stats_matchmaking_inline_description,
+                                                         caption=matchmaking_stats_text,
+                                                         reply_markup=inline_btn)
+    else:
+        matchmaking_stats = InlineQueryResultArticle(session.locale.stats_matchmaking_inline_title,
+                                                     InputTextMessageContent(matchmaking_stats_text),
+                                                     '1',
+                                                     description=session.locale.stats_matchmaking_inline_description,
+                                                     reply_markup=inline_btn,
+                                                     thumb_url="https://telegra.ph/file/57ba2b279c53d69d72481.jpg")
     valve_hq_time = InlineQueryResultArticle(session.locale.valve_hqtime_inline_title,
                                              InputTextMessageContent(valve_hq_time_text),
                                              '2',
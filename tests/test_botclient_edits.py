@@ -0,0 +1,41 @@
+import asyncio
+
+from pyrogram import Client
+from pyrogram.errors import MessageNotModified
+from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+import pytest
+
+from bottypes import BotClient
+
+
+def test_identical_edits_are_skipped(monkeypatch):
+    """
+    Test that an edit repeating the last content of a message raises MessageNotModified without an API call,
+    and that changed content, other messages and the LRU bound are all respected.
+    """
+
+    calls = []
+
+    async def edit_message_text(self, chat_id, message_id, text, *args):
+        calls.append((chat_id, message_id, text))
+
+    monkeypatch.setattr(Client, 'edit_message_text', edit_message_text)
+
+    client = BotClient('test', in_memory=True, telegram_logger=None, navigate_back_callback='back')
+    client.REMEMBERED_MESSAGES = 2
+    markup = InlineKeyboardMarkup([[InlineKeyboardButton('Refresh', 'refresh')]])
+    same_markup = InlineKeyboardMarkup([[InlineKeyboardButton('Refresh', 'refresh')]])
+
+    async def main():
+        await client.edit_message_text(1, 10, 'status', reply_markup=markup)
+        with pytest.raises(MessageNotModified):
+            await client.edit_message_text(1, 10, 'status', reply_markup=same_markup)
+
+        await client.edit_message_text(1, 10, 'status', reply_markup=None)  # markup differs
+        await client.edit_message_text(2, 10, 'status')                      # another chat
+        await client.edit_message_text(1, 11, 'status')                      # pushes (1, 10) out
+        await client.edit_message_text(1, 10, 'status')
+
+    asyncio.run(main())
+    assert len(calls) == 5
+    assert client.rstats.message_edits_skipped == 1
@@ -0,0 +1,136 @@
+import asyncio
+import random
+import time
+
+from bottypes.dispatcher import UserDispatcher
+
+
+USERS = 200
+UPDATES_PER_USER = 20
+HANDLER_TIME = 0.002
+MAX_CONCURRENCY = 32
+
+
+class SimulatedSession:
+    def __init__(self):
+        self.current_menu_id = 0
+        self.previous_menu_id = -1
+        self.busy = False
+        self.handled: list[int] = []
+
+
+def test_stress_users_are_serialized_and_concurrent():
+    """
+    Test with simulated users tapping away that updates of a user never overlap and keep their order,
+    sessions stay consistent, the global limit holds and different users are handled concurrently.
+    """
+
+    sessions = {user_id: SimulatedSession() for user_id in range(USERS)}
+    running = 0
+    peak_running = 0
+    overlaps = 0
+
+    async def handler(user_id: int, number: int):
+        nonlocal running, peak_running, overlaps
+
+        session = sessions[user_id]
+        if session.busy:
+            overlaps += 1
+        session.busy = True
+        running += 1
+        peak_running = max(peak_running, running)
+
+        previous = session.current_menu_id
+        await asyncio.sleep(random.uniform(0, 2 * HANDLER_TIME))  # the handler awaits Telegram in the middle
+        session.previous_menu_id, session.current_menu_id = previous, previous + 1
+        session.handled.append(number)
+
+        running -= 1
+        session.busy = False
+
+    async def main():
+        dispatcher = UserDispatcher(MAX_CONCURRENCY)
+        for number in range(UPDATES_PER_USER):
+            for user_id in random.sample(range(USERS), USERS):
+                dispatcher.dispatch(user_id, handler, user_id, number)
+            await asyncio.sleep(0)
+
+        start = time.perf_counter()
+        await dispatcher.join()
+        return dispatcher, time.perf_counter() - start
+
+    random.seed(0)
+    dispatcher, elapsed = asyncio.run(main())
+
+    assert overlaps == 0
+    assert peak_running == MAX_CONCURRENCY
+    for session in sessions.values():
+        assert session.handled == list(range(UPDATES_PER_USER))
+        assert session.current_menu_id == UPDATES_PER_USER
+        assert session.previous_menu_id == UPDATES_PER_USER - 1
+
+    updates = USERS * UPDATES_PER_USER
+    serial_time = updates * HANDLER_TIME
+    assert elapsed < serial_time / 4, f'{updates / elapsed:.0f} updates/s is too slow'
+    assert dispatcher.dispatched == updates
+    assert not dispatcher._lanes
+
+
+def test_superseded_callbacks_collapse_and_idle_lets_updates_through():
+    """
+    Test that queued updates with the same collapse key are dropped in favour of the newest one,
+    that a handler waiting for the user lets both other users and the user's next updates through
+    and goes on only once they are done, and that inline queries don't wait behind the user's busy lane.
+    """
+
+    handled = []
+
+    async def main():
+        dispatcher = UserDispatcher(1)
+        answer = asyncio.get_running_loop().create_future()  # resolved outside the dispatcher, like pyropatch does
+        release = asyncio.Event()
+
+        async def ask():
+            handled.append('ask')
+            async with dispatcher.idle():
+                handled.append(await answer)
+
+        async def tap(data: str):
+            handled.append(data)
+            await asyncio.sleep(0)
+
+        async def busy():
+            handled.append('busy')
+            await release.wait()
+
+        dispatcher.dispatch(1, ask)
+        await asyncio.sleep(0.01)
+        for data in ('first', 'second', 'third'):
+            dispatcher.dispatch(1, tap, data, collapse_key='message')
+        dispatcher.dispatch(2, tap, 'other user')
+        dispatcher.dispatch(1, tap, 'inline', collapse_key='inline', lane_name='inline')
+        await asyncio.sleep(0.01)
+        assert handled[0] == 'ask' and sorted(handled[1:]) == ['inline', 'other user', 'third']
+
+        answer.set_result('got answer')
+        await dispatcher.join()
+        assert handled[-1] == 'got answer'
+
+        handled.clear()
+        collapsed = dispatcher.collapsed
+        dispatcher = UserDispatcher(2)
+        dispatcher.dispatch(1, busy)
+        await asyncio.sleep(0.01)
+        dispatcher.dispatch(1, tap, 'command')
+        for query in ('c', 'cs', 'cs2'):
+            dispatcher.dispatch(1, tap, query, collapse_key='inline', lane_name='inline')
+        await asyncio.sleep(0.01)
+        assert handled == ['busy', 'cs2']  # the command waits for the user's lane, the query doesn't
+
+        release.set()
+        await dispatcher.join()
+        assert handled == ['busy', 'cs2', 'command']
+        assert (collapsed, dispatcher.collapsed) == (2, 2)
+        assert not dispatcher._lanes
+
+    asyncio.run(main())
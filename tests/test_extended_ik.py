@@ -0,0 +1,66 @@
+import asyncio
+from copy import deepcopy
+
+from bottypes import ExtendedIKB, ExtendedIKM, SelectionIndex
+from l10n import locale
+
+
+def layout(markup):
+    return [[(button.text, button.callback_data, button.url) for button in line] for line in markup.inline_keyboard]
+
+
+def make_markup():
+    return ExtendedIKM([[ExtendedIKB('bot_servers_stats'), ExtendedIKB('bot_profile_info')],
+                        [ExtendedIKB('English', 'en', translatable=False)],
+                        [ExtendedIKB('bot_author_text', url='bot_author_link')],
+                        [ExtendedIKB('bot_back', selectable=False)]])
+
+
+def test_compiled_markup_matches_translated_copy():
+    """
+    Test that a compiled markup looks exactly like a translated deep copy and is built once per variant.
+    """
+
+    markup = make_markup()
+
+    for lang_code in ('en', 'ru'):
+        for key in (None, 'bot_profile_info', 'en', 'bot_back'):
+            expected = deepcopy(markup)
+            for button in expected.iter_buttons():
+                button.selected = button.matches(key)
+            expected.update_locale(locale(lang_code))
+
+            compiled = markup.select(key)(locale(lang_code))
+            assert layout(compiled) == layout(expected)
+            assert markup.select(key)(locale(lang_code)) is compiled
+
+    # not selectable, so it's the same variant as no selection
+    assert markup.select('bot_back')(locale('en')) is markup(locale('en'))
+
+
+def test_selection_index_overlay_is_per_context():
+    """
+    Test that a selection made through SelectionIndex only shows up in markups containing the key,
+    only in the context that made it, and leaves the markups themselves untouched.
+    """
+
+    markup, other = make_markup(), ExtendedIKM([[ExtendedIKB('bot_settings')]])
+    index = SelectionIndex((markup, other))
+    assert index.markups_with('en') == (markup,)
+
+    async def render(key: str):
+        selection = index.select(key)
+        try:
+            await asyncio.sleep(0)  # let the other update select its key
+            return markup(locale('en')), other(locale('en'))
+        finally:
+            index.reset(selection)
+
+    async def main():
+        return await asyncio.gather(render('en'), render('bot_profile_info'))
+
+    (english, english_other), (profile, _) = asyncio.run(main())
+    assert english is markup.select('en')(locale('en'))
+    assert english_other is other(locale('en'))
+    assert profile is markup.select('bot_profile_info')(locale('en'))
+    assert markup(locale('en')) is markup.select(None)(locale('en'))
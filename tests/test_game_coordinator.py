@@ -0,0 +1,61 @@
+import asyncio
+
+from functions.event_recording import RecordedEvent
+from gc_replay import GameCoordinatorReplay
+import game_coordinator as gc
+
+
+def product_info(t: float, branches: dict, app_changenumber: int = 1, server_changenumber: int = 1):
+    return RecordedEvent(t, 'product_info', {'cs2_app_changenumber': app_changenumber,
+                                             'cs2_server_changenumber': server_changenumber,
+                                             'branches': branches})
+
+
+def replay(events, initial_cache=None):
+    return asyncio.run(GameCoordinatorReplay(events, initial_cache).run())
+
+
+def test_branch_alerts():
+    """
+    Test that branch creation, update and removal produce exactly one alert each.
+    """
+
+    public = {'public': {'buildid': '100'}}
+    events = [
+        product_info(0, public),
+        product_info(45, public | {'1.39.9.9': {'buildid': '101'}, 'beta': {'buildid': '102'}}),
+        product_info(90, public | {'1.39.9.9': {'buildid': '103'}, 'beta': {'buildid': '102'}}),
+        product_info(135, public | {'1.39.9.9': {'buildid': '103'}}),
+        product_info(180, public | {'1.39.9.9': {'buildid': '103'}}),
+    ]
+
+    result = replay(events, {'cs2_patch_version': '1.40.0.0'})
+    alerts = [text for _, text in result.alerts]
+
+    assert sorted(alerts[:2]) == sorted([gc.AVAILABLE_ALERTS['backup_branch_created'].format('1.39.9.9', '101'),
+                                         gc.AVAILABLE_ALERTS['misc_branch_created'].format('beta', '102')])
+    assert alerts[2:] == [gc.AVAILABLE_ALERTS['backup_branch_updated'].format('1.39.9.9', '103'),
+                          gc.AVAILABLE_ALERTS['branch_deleted'].format('beta', None)]
+    assert result.events_handled['product_info'] == len(events)
+
+
+def test_public_update_uses_recorded_game_version():
+    """
+    Test that a public branch update takes the recorded game version and alerts once per change number.
+    """
+
+    events = [
+        product_info(0, {'public': {'buildid': '100'}}),
+        product_info(45, {'public': {'buildid': '101'}}, app_changenumber=2),
+        RecordedEvent(46, 'game_version', {'cs2_client_version': 7, 'cs2_server_version': 7,
+                                           'cs2_patch_version': '1.40.0.7', 'cs2_version_timestamp': 0}),
+        RecordedEvent(50, 'player_count', 1_000_000),
+        RecordedEvent(55, 'connection_status', 0),
+    ]
+
+    result = replay(events)
+    alerts = [text for _, text in result.alerts]
+
+    assert alerts == [gc.AVAILABLE_ALERTS['cs2_app_changenumber'].format(2),
+                      gc.AVAILABLE_ALERTS['public_branch_updated'].format('101')]
+    assert result.events_handled == {'product_info': 2, 'player_count': 1, 'connection_status': 1}
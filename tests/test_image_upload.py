@@ -0,0 +1,78 @@
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+import pytest
+
+from functions.image_upload import ImageUploader, UploadError, UploadHost
+
+
+class StubUploadHandler(BaseHTTPRequestHandler):
+    """``/fast`` and ``/slow`` answer with a URL, ``/broken`` with a 500."""
+
+    requests = Counter()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.requests[self.path] += 1
+
+        if self.path == '/broken':
+            self.send_response(500)
+            self.end_headers()
+            return
+
+        if self.path == '/slow':
+            time.sleep(0.5)
+
+        body = f'http://{self.headers["Host"]}/files{self.path}.png'.encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_url():
+    StubUploadHandler.requests.clear()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubUploadHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+
+
+def stub_host(stub_url: str, path: str) -> UploadHost:
+    return UploadHost(path, f'{stub_url}/{path}', 'file')
+
+
+def test_first_success_wins_and_same_image_is_not_reuploaded(stub_url):
+    """
+    Test that the fastest working host's URL is returned and identical bytes don't hit the hosts again.
+    """
+
+    uploader = ImageUploader([stub_host(stub_url, 'broken'), stub_host(stub_url, 'slow'), stub_host(stub_url, 'fast')],
+                             fanout=3, timeout=5)
+
+    assert uploader.upload(b'png', 'graph.png').endswith('/files/fast.png')
+    assert uploader.upload(b'png', 'graph.png').endswith('/files/fast.png')
+    assert StubUploadHandler.requests['/fast'] == 1
+
+    uploader.shutdown(wait=True)
+    assert [host.name for host in uploader.ranked_hosts()] == ['fast', 'slow', 'broken']
+
+
+def test_failing_hosts_fall_back_then_give_up(stub_url):
+    """
+    Test that the next batch of hosts is tried when the first one fails, and that all failing raises UploadError.
+    """
+
+    uploader = ImageUploader([stub_host(stub_url, 'broken'), stub_host(stub_url, 'fast')], fanout=1, timeout=5)
+    assert uploader.upload(b'png').endswith('/files/fast.png')
+    assert uploader.stats['broken'].failures == 1
+
+    uploader = ImageUploader([stub_host(stub_url, 'broken')], timeout=5)
+    with pytest.raises(UploadError):
+        uploader.upload(b'png')
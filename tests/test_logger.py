@@ -0,0 +1,96 @@
+import asyncio
+from types import SimpleNamespace
+
+from pyrogram.errors import FloodWait
+from pyrogram.types import User
+
+from bottypes import PlainBotLogger
+from bottypes.logger import MESSAGE_LIMIT
+
+
+SESSION = SimpleNamespace(locale=SimpleNamespace(lang_code='en'))
+
+
+class FakeClient:
+    def __init__(self, failures: dict[int, Exception]):
+        self.calls = 0
+        self.failures = failures  # number of the call -> what it raises
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls += 1
+        if self.calls in self.failures:
+            raise self.failures[self.calls]
+        self.sent.append(text)
+
+
+def test_logs_are_packed_and_sent_as_they_come():
+    """
+    Test that the queue sends system logs first and packs events of many users into messages
+    within Telegram's limit, keeping what FloodWait didn't let through and counting what errors dropped.
+    """
+
+    async def main():
+        bot_logger = PlainBotLogger(-100, send_rate=1000, send_burst=1)
+        client = FakeClient({1: FloodWait(value=0), 3: RuntimeError('the channel is gone')})
+        users = [User(id=user_id, username=f'user{user_id}', language_code='en') for user_id in range(3)]
+
+        await bot_logger.schedule_system_log(client, 'system log')
+        for user in users:
+            await bot_logger.schedule_inline_log(client, SESSION, SimpleNamespace(from_user=user, query='dc'))
+        for _ in range(200):
+            await bot_logger.schedule_callback_log(client, SESSION, SimpleNamespace(from_user=users[0],
+                                                                                    data='x' * 50))
+        assert bot_logger.queue_depth == 204
+
+        bot_logger.start(client)
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if bot_logger.is_queue_empty():
+                break
+        await bot_logger.stop()
+
+        assert bot_logger.queue_depth == 0 and bot_logger.lag == 0
+        assert client.sent[0] == 'system log'  # sent again after FloodWait
+        assert bot_logger.sent_logs + bot_logger.dropped_events == 204
+        assert 0 < bot_logger.dropped_events < 200  # only the events of the failed message
+        assert all(len(text.encode('utf-16-le')) // 2 <= MESSAGE_LIMIT for text in client.sent)
+
+        packed = client.sent[-1]  # the rest of the callbacks, with the other users
+        assert all(f'@{user.username}' in packed for user in users) and packed.count('🔀') > 1
+
+    asyncio.run(main())
+
+
+def test_queue_stays_within_its_budget():
+    """
+    Test that over the budget, repeated callbacks of a user get folded and other events dropped,
+    while system logs have a budget of their own and only get folded, and that nothing live is kept.
+    """
+
+    async def main():
+        bot_logger = PlainBotLogger(-100, max_events=3, max_bytes=10_000, system_max_bytes=100)
+        client = FakeClient({})
+        user, other_user = User(id=1, username='user1'), User(id=2, username='user2')
+
+        for data in ('a', 'b', 'c', 'd', 'e'):
+            await bot_logger.schedule_callback_log(client, SESSION, SimpleNamespace(from_user=user, data=data))
+        await bot_logger.schedule_message_log(client, SESSION, SimpleNamespace(from_user=user, text='hi'))
+        await bot_logger.schedule_callback_log(client, SESSION, SimpleNamespace(from_user=other_user, data='f'))
+        assert (bot_logger.queue_depth, bot_logger.folded_events, bot_logger.dropped_events) == (3, 2, 2)
+
+        for _ in range(10):
+            await bot_logger.schedule_system_log(client, 'x' * 30)
+        await bot_logger.schedule_system_log(client, 'exception')
+        assert bot_logger.queue_depth == 3 + 4 and bot_logger.folded_events == 2 + 7
+
+        for payload in (*bot_logger._system_logs, *bot_logger._event_logs[1]):
+            assert all(field is None or isinstance(field, (str, int, float, bool)) for field in payload)
+
+        while not bot_logger.is_queue_empty():
+            await bot_logger.process_queue(client)
+        assert client.sent[2] == 'x' * 30 + '\n\n(repeated 8 times)' and client.sent[3] == 'exception'
+        assert client.sent[4].endswith('🔀: a\n🔀: b\n🔀: e (+2 before it)')
+        assert bot_logger.queued_bytes == 0
+
+    asyncio.run(main())
@@ -0,0 +1,56 @@
+import asyncio
+
+from bottypes import BotClient
+from db import MemoryStore
+
+
+def make_client() -> BotClient:
+    client = BotClient('test', in_memory=True, telegram_logger=None, navigate_back_callback='back')
+
+    @client.navmenu('main')
+    async def main_menu(*_):
+        pass
+
+    @client.navmenu('settings', came_from=main_menu)
+    async def settings(*_):
+        pass
+
+    @client.funcmenu('language', came_from=settings)
+    async def language(*_):
+        pass
+
+    return client
+
+
+def test_menu_codes_survive_restarts():
+    """
+    Test that menus get integer codes at registration, that persisted codes replace them
+    along with the routes keyed by them, and that a restart with a new menu keeps the old codes.
+    """
+
+    store = MemoryStore()
+
+    async def main():
+        await store.add_menu_codes({'removed_menu': 1, 'make_client.<locals>.language': 7})
+
+        client = make_client()
+        main_menu = client.get_menu_by_query(None, 'main')
+        settings = client.get_menu_by_query(main_menu.code, 'settings')
+        assert settings.came_from_code == main_menu.code
+
+        await client.load_menu_codes(store)
+        codes = await store.get_menu_codes()
+        assert codes['removed_menu'] == 1 and codes['make_client.<locals>.language'] == 7
+        assert len(set(codes.values())) == len(codes) == 4
+
+        language = client.get_menu_by_query(settings.code, 'language')
+        assert language.code == 7 and language.came_from_code == settings.code == codes[settings.id]
+        assert client.get_menu_by_code(main_menu.code) is main_menu
+        assert settings.can_come_from(main_menu.code)
+
+        client = make_client()
+        await client.load_menu_codes(store)
+        assert await store.get_menu_codes() == codes
+        assert client.get_menu_by_query(None, 'main').code == codes[main_menu.id]
+
+    asyncio.run(main())
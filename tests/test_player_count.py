@@ -0,0 +1,38 @@
+import numpy as np
+
+from utypes import PlayerChart, PlayerCountBuffer
+
+
+def test_window_over_a_wrapped_ring(tmp_path):
+    """Test that windows of a ring that wrapped around are contiguous, in order and bounded by the data."""
+
+    buffer = PlayerCountBuffer(tmp_path / 'test.ring', capacity=8)
+    assert len(buffer) == 0 and buffer.latest() is None and buffer.peak(0) is None
+    assert buffer.window(0).size == 0 and buffer.buckets(60, 0) == []
+
+    for i in range(5):
+        buffer.append(100 + i * 10, i)
+    buffer.extend(np.arange(150, 250, 10), np.arange(5, 15))  # 15 records in total, 7 get overwritten
+
+    assert len(buffer) == 8 and buffer.latest() == 14
+    assert buffer.records()['timestamp'].tolist() == list(range(170, 250, 10))
+    assert buffer.window(195, 225)['players'].tolist() == [10, 11, 12]
+    assert buffer.window(0)['players'].tolist() == list(range(7, 15))  # longer than the data
+    assert buffer.window(1000).size == 0
+    assert buffer.peak(0, 200) == 10
+
+
+def test_import_csv(tmp_path):
+    """Test that the chart imports the latest rows of the old CSV chart, in order."""
+
+    csv_path = tmp_path / 'player_chart.csv'
+    csv_path.write_text('DateTime,Players\n'
+                        '2024-01-01 00:00:00,100.0\n'
+                        '2024-01-01 00:10:00,200\n'
+                        '2024-01-01 00:20:00,300\n', encoding='utf-8')
+
+    chart = PlayerChart.open(tmp_path, capacity=2)
+    chart.import_csv(csv_path)
+    assert chart.records()['players'].tolist() == [200, 300]
+    assert chart.records()['timestamp'].tolist() == [1704067800, 1704068400]
+
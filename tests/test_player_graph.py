@@ -0,0 +1,24 @@
+import numpy as np
+
+from functions.player_graph import lttb
+
+
+def test_lttb_keeps_shape_within_budget():
+    """
+    Test that LTTB keeps the endpoints and the extremes while fitting into the point budget.
+    """
+
+    x = np.arange(10_000)
+    y = np.full(x.size, 1_000_000)
+    y[1234], y[8765] = 1_900_000, 100_000
+
+    keep = lttb(x, y, 500)
+
+    assert keep.size == 500
+    assert keep[0] == 0 and keep[-1] == x.size - 1
+    assert np.all(np.diff(keep) > 0)
+    assert {1234, 8765} <= set(keep.tolist())
+
+
+def test_lttb_leaves_short_series_alone():
+    assert lttb(np.arange(10), np.arange(10), 500).tolist() == list(range(10))
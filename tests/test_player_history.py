@@ -0,0 +1,99 @@
+import numpy as np
+
+from utypes import PlayerChart, PlayerHistory
+from utypes.player_history import DAY, HOUR
+
+
+MARK_INTERVAL = 10 * 60
+
+
+def make_history(tmp_path, days: int, capacity: int = None):
+    chart = PlayerChart.open(tmp_path, capacity or days * DAY // MARK_INTERVAL)
+    timestamps = np.arange(days * DAY // MARK_INTERVAL) * MARK_INTERVAL
+    players = np.random.default_rng(0).integers(600_000, 1_500_000, timestamps.size)
+    chart.extend(timestamps, players)
+    return PlayerHistory.open(tmp_path, chart), timestamps, players
+
+
+def test_compact_rolls_up_finished_hours_and_days(tmp_path):
+    """
+    Test that compaction rolls up only finished periods, exactly once, with correct min/max/mean.
+    """
+
+    history, timestamps, players = make_history(tmp_path, 3)
+    now = 2 * DAY + 5 * HOUR + 1
+
+    assert history.compact(now) == (2 * 24 + 5, 2)
+    assert history.compact(now) == (0, 0)
+
+    first_hour = players[:HOUR // MARK_INTERVAL]
+    hourly = history.hourly.range(0, HOUR)
+    assert (hourly['min'][0], hourly['max'][0]) == (first_hour.min(), first_hour.max())
+    assert np.isclose(hourly['mean'][0], first_hour.mean())
+
+    assert history.daily.range()['max'].tolist() == [players[:144].max(), players[144:288].max()]
+    assert history.peak() == players.max()
+
+
+def test_range_uses_finest_covering_tier(tmp_path):
+    """
+    Test that range queries older than the raw marks are answered from the rollups.
+    """
+
+    history, _, _ = make_history(tmp_path, 4, capacity=DAY // MARK_INTERVAL)
+
+    # the ring only kept the last day, so roll up the first days from a full copy first
+    (tmp_path / 'full').mkdir()
+    full, _, _ = make_history(tmp_path / 'full', 4)
+    full.compact(4 * DAY)
+    for tier in ('hourly', 'daily'):
+        getattr(history, tier).append(getattr(full, tier).range())
+
+    assert history.range(3 * DAY + HOUR).size == (DAY - HOUR) // MARK_INTERVAL
+    assert history.range(DAY, 2 * DAY).size == 24
+    history.hourly.trim(4 * DAY)
+    assert history.range(DAY, 2 * DAY).size == 1
+
+
+def test_range_includes_what_is_not_rolled_up_yet(tmp_path):
+    """
+    Test that ranges answered from the rollups end with the hours and marks that aren't rolled up yet.
+    """
+
+    history, timestamps, _ = make_history(tmp_path, 3, capacity=DAY // MARK_INTERVAL)
+
+    # the last rollups are of 2 days 5 hours ago, the marks since then are only in the ring
+    (tmp_path / 'full').mkdir()
+    full, _, _ = make_history(tmp_path / 'full', 3)
+    full.compact(2 * DAY + 5 * HOUR + 1)
+    for tier in ('hourly', 'daily'):
+        getattr(history, tier).append(getattr(full, tier).range())
+
+    recent_marks = (DAY - 5 * HOUR) // MARK_INTERVAL
+    rows = history.range(0)
+    assert rows.size == 2 * 24 + 5 + recent_marks and rows['start'][-1] == timestamps[-1]
+
+    history.hourly.trim(2 * DAY)
+    rows = history.range(0)
+    assert rows['start'][:3].tolist() == [0, DAY, 2 * DAY] and rows.size == 2 + 5 + recent_marks
+    assert np.all(np.diff(rows['start']) > 0)
+
+
+def test_interrupted_append_is_realigned(tmp_path):
+    """
+    Test that a half-written row left by an interrupted append is dropped before the next append.
+    """
+
+    history, _, _ = make_history(tmp_path, 1)
+    history.compact(DAY)
+
+    with open(history.hourly._path('max'), 'ab') as f:
+        f.write(b'\x00\x00')  # half-written row
+
+    reopened = PlayerHistory.open(tmp_path, history.raw)
+    assert len(reopened.hourly) == 24
+
+    reopened.raw.append(DAY, 1_000_000)
+    reopened.compact(DAY + HOUR)
+    assert len(reopened.hourly) == 25
+    assert reopened.hourly._path('max').stat().st_size == 25 * 4
@@ -0,0 +1,190 @@
+import asyncio
+
+from pyrogram.types import User
+import pytest
+from sqlalchemy import event, func
+from sqlalchemy.future import select
+
+from bottypes.sessions import EphemeralSession, UserSession, UserSessions
+from db import db_session, MemoryStore, User as DBUser
+from db.stores import UserRecord
+
+
+def test_flush_writes_only_dirty_sessions(tmp_path, monkeypatch):
+    """
+    Test that sessions track their own changes, a flush saves only the changed ones in one go,
+    and changes of timed-out sessions are saved after they are cleared.
+    """
+
+    monkeypatch.setattr(db_session, '_store', None)
+    now = 0
+
+    async def stored() -> dict[int, DBUser]:
+        async with db_session.create_session() as db_sess:
+            return {dbuser.userid: dbuser for dbuser in (await db_sess.execute(select(DBUser))).scalars()}
+
+    async def main():
+        await db_session.init(tmp_path / 'users.db')
+        sessions = UserSessions()
+        sessions.clock = lambda: now
+        for user_id in (1, 2, 3):
+            await sessions.register_session(User(id=user_id, language_code='en'), None)
+
+        assert not any(session.dirty for session in sessions.values())
+        assert await sessions.flush() == 0
+
+        sessions[1].current_menu_id = 1
+        sessions[2].update_lang('ru')
+        sessions[3].last_bot_pm_id = sessions[3].last_bot_pm_id  # nothing actually changes
+        assert [user_id for user_id, session in sessions.items() if session.dirty] == [1, 2]
+        assert await sessions.flush() == 2
+        assert await sessions.flush() == 0
+
+        dbusers = await stored()
+        assert dbusers[1].current_menu_id == 1
+        assert dbusers[2].language == 'ru'
+
+        sessions[3].current_menu_id = 2
+        sessions.clock = lambda: now + sessions.SESSIONS_LIFETIME.total_seconds() + 1
+        _ = sessions[1], sessions[2]  # these two get used again
+        await sessions.clear_timeout_sessions()
+        assert 3 not in sessions
+        assert (await stored())[3].current_menu_id == 2
+
+    asyncio.run(main())
+
+
+def test_eviction_pops_only_expired_sessions_in_batches():
+    """Test that sessions are evicted least recently used first, in batches, without touching live ones."""
+
+    lifetime = UserSessions.SESSIONS_LIFETIME.total_seconds()
+    now = 0
+
+    sessions = UserSessions()
+    sessions.clock = lambda: now
+    for user_id in range(10):
+        sessions[user_id] = UserSession.__new__(UserSession)
+        sessions[user_id].dirty = False
+        now += 1
+
+    _ = sessions[0]  # the oldest session gets used again
+    now = lifetime + 5.5  # sessions 1..5 have expired by now
+
+    assert sessions.evict_timeout_sessions(limit=3) == 3
+    assert list(sessions)[:3] == [4, 5, 6]
+    assert sessions.evict_timeout_sessions(limit=3) == 2
+    assert sessions.evict_timeout_sessions(limit=3) == 0
+    assert list(sessions) == [6, 7, 8, 9, 0]
+
+
+def test_user_coming_back_before_a_flush_keeps_unsaved_changes():
+    """Test that a session registered again before the changes of its cleared one are saved starts with them."""
+
+    now = 0
+
+    async def main():
+        sessions = UserSessions(store=MemoryStore())
+        sessions.clock = lambda: now
+        session = await sessions.register_session(User(id=1, language_code='en'), None)
+        session.update_lang('ru')
+        session.current_menu_id = 5
+
+        sessions.clock = lambda: now + sessions.SESSIONS_LIFETIME.total_seconds() + 1
+        assert sessions.evict_timeout_sessions() == 1
+
+        session = await sessions.register_session(User(id=1, language_code='en'), None)
+        assert (session.lang_code, session.current_menu_id) == ('ru', 5)
+        assert await sessions.flush() == 1
+        assert (await sessions.store.get(1)).language == 'ru'
+
+    asyncio.run(main())
+
+
+def test_concurrent_registrations_share_queries_and_commits(tmp_path, monkeypatch):
+    """
+    Test that concurrent registrations of the same new user share one session and one db row,
+    and registrations of many users coming at once are committed together.
+    """
+
+    monkeypatch.setattr(db_session, '_store', None)
+    commits = 0
+
+    def count_commit(_):
+        nonlocal commits
+        commits += 1
+
+    async def main():
+        await db_session.init(tmp_path / 'users.db')
+        event.listen(db_session.store().engine.sync_engine, 'commit', count_commit)
+
+        sessions = UserSessions()
+        users = [User(id=user_id, language_code='en') for user_id in range(50)]
+        registered = await asyncio.gather(*(sessions.register_session(user, None) for user in users + users))
+
+        assert registered[:50] == registered[50:]
+        assert len(set(map(id, registered))) == 50
+        assert commits == 1
+
+        async with db_session.create_session() as db_sess:
+            assert (await db_sess.execute(select(func.count(DBUser.id)))).scalar() == 50
+
+        await sessions.register_session(users[0], None)
+        assert commits == 1
+        assert not sessions._registering
+
+    asyncio.run(main())
+
+
+def test_snapshot_brings_back_active_sessions(tmp_path, monkeypatch):
+    """Test that a snapshot restores active sessions in their order and age, with expired ones left out."""
+
+    monkeypatch.setattr(db_session, '_store', None)
+    lifetime = UserSessions.SESSIONS_LIFETIME.total_seconds()
+    now = 0
+
+    async def main():
+        nonlocal now
+
+        await db_session.init(tmp_path / 'users.db')
+        sessions = UserSessions()
+        sessions.clock = lambda: now
+        for user_id in range(5):
+            await sessions.register_session(User(id=user_id, language_code='en'), None)
+            now += lifetime / 4
+        sessions[0].update_lang('ru')
+        await sessions.flush()
+
+        assert sessions.dump_snapshot(tmp_path / 'sessions.snapshot') == 5
+        assert (tmp_path / 'sessions.snapshot').stat().st_size == 8 * (1 + 2 * 5)
+
+        restored = UserSessions()
+        restored.clock = lambda: 10 * lifetime
+        assert await restored.load_snapshot(tmp_path / 'sessions.snapshot') == 4  # session 1 is too old
+        assert list(restored) == [2, 3, 4, 0]
+        assert restored.get(0).lang_code == 'ru'
+        assert [int(10 * lifetime - session.timestamp) for session in restored.values()] == \
+               [int(now - sessions.get(user_id).timestamp) for user_id in restored]
+
+        assert await UserSessions().load_snapshot(tmp_path / 'missing.snapshot') == 0
+
+    asyncio.run(main())
+
+
+def test_drive_by_users_get_ephemeral_sessions():
+    """
+    Test that users without a session get an ephemeral one in their Telegram language without touching the db,
+    and users with a session get theirs.
+    """
+
+    sessions = UserSessions()  # no store: the db mustn't be needed
+    session = sessions.get_or_ephemeral(User(id=1, language_code='ru'))
+
+    assert isinstance(session, EphemeralSession)
+    assert session.locale.lang_code == 'ru'
+    assert session.current_menu_id is None and not session.dirty
+    with pytest.raises(AttributeError):
+        session.current_menu_id = 1
+    assert 1 not in sessions
+
+    sessions[1] = UserSession(UserRecord(1, 1, 1, None, 'uk', None))
+    assert sessions.get_or_ephemeral(User(id=1, language_code='ru')) is sessions[1]
@@ -0,0 +1,62 @@
+import logging
+import threading
+import time
+
+from functions.staged_pipeline import Stage, StagedPipeline
+
+
+logger = logging.getLogger('test_staged_pipeline')
+
+
+def test_stages_pass_results_along():
+    """
+    Test that every stage gets the previous stage's result and gets timed.
+    """
+
+    pipeline = StagedPipeline('test', [Stage('double', lambda x: x * 2, 1),
+                                       Stage('format', lambda x: f'<{x}>', 1)], logger)
+
+    run = pipeline.submit(21).result(timeout=5)
+
+    assert run.ok
+    assert list(run.timings) == ['double', 'format']
+    pipeline.shutdown()
+
+
+def test_missed_deadline_abandons_run():
+    """
+    Test that a stage missing its deadline stops the run and blocks new runs until it actually finishes.
+    """
+
+    release = threading.Event()
+    stored = []
+
+    pipeline = StagedPipeline('test', [Stage('upload', lambda x: release.wait(5) and x, 0.05),
+                                       Stage('cache', stored.append, 1)], logger)
+
+    run = pipeline.submit('url').result(timeout=5)
+
+    assert run.abandoned_stage == 'upload'
+    assert 'cache' not in run.timings
+    assert pipeline.submit('url') is None  # the abandoned upload is still hanging
+
+    release.set()
+    pipeline.shutdown(wait=True)
+    assert stored == []
+
+
+def test_run_deadline_cuts_stages_short():
+    """
+    Test that stages only get what is left of the run's deadline, even when each of them is within its own.
+    """
+
+    pipeline = StagedPipeline('test', [Stage('render', lambda x: time.sleep(0.1) or x, 1),
+                                       Stage('upload', lambda x: time.sleep(0.1) or x, 1),
+                                       Stage('cache', lambda x: x, 1)], logger, deadline=0.15)
+
+    run = pipeline.submit('graph').result(timeout=5)
+
+    assert run.abandoned_stage == 'upload'
+    assert run.timings['upload'] < 0.1 and 'cache' not in run.timings
+    assert time.time() - run.started < 0.5
+    pipeline.shutdown(wait=True)
@@ -0,0 +1,80 @@
+import asyncio
+
+from pyrogram.types import User
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from bottypes.sessions import UserSessions
+from db import MemoryStore, SQLAlchemyStore, SQLiteStore
+from db.stores import NewUser, UserChanges
+
+
+STORES = {'memory': lambda path: MemoryStore(),
+          'sqlite': lambda path: SQLiteStore(path / 'users.db'),
+          'sqlalchemy url': lambda path: SQLAlchemyStore(f'sqlite+aiosqlite:///{path / "users.db"}')}
+
+
+@pytest.mark.parametrize('make_store', STORES.values(), ids=STORES.keys())
+def test_stores_behave_the_same(tmp_path, monkeypatch, make_store):
+    """Test that every store adds, finds and saves users and menu codes, and sessions work on top of any of them."""
+
+    async def main():
+        store = make_store(tmp_path)
+        await store.open()
+        if isinstance(store, SQLAlchemyStore):
+            monkeypatch.setattr(store, 'QUERY_CHUNK', 3)
+
+        added = await store.add_many([NewUser(user_id, 'en', None) for user_id in range(10)])
+        assert sorted(added) == list(range(10))
+        assert len({record.id for record in added.values()}) == 10
+
+        found = await store.get_many([3, 5, 7, 11, 13])
+        assert sorted(found) == [3, 5, 7]
+        assert found[5] == added[5]
+        assert await store.get(11) is None
+
+        big_id = 2 ** 40  # Telegram ids don't fit into 32 bits
+        await store.add_many([NewUser(big_id, 'en', None)])
+        assert (await store.get(big_id)).userid == big_id
+
+        await store.put_many([UserChanges(added[5].id, 1, 2, 'ru', 42)])
+        record = await store.get(5)
+        assert (record.userid, record.current_menu_id, record.previous_menu_id, record.language,
+                record.last_bot_pm_id) == (5, 1, 2, 'ru', 42)
+
+        sessions = UserSessions(store=store)
+        session = await sessions.register_session(User(id=5, language_code='en'), None)
+        assert session.lang_code == 'ru'
+        await sessions.register_session(User(id=20, language_code='uk'), None)
+        sessions[20].current_menu_id = 1
+        assert await sessions.flush() == 1
+        assert (await store.get(20)).current_menu_id == 1
+
+        assert await store.get_menu_codes() == {}
+        await store.add_menu_codes({'main_menu': 1, 'settings': 2})
+        await store.add_menu_codes({'guns': 3})
+        assert await store.get_menu_codes() == {'main_menu': 1, 'settings': 2, 'guns': 3}
+
+        await store.close()
+
+    asyncio.run(main())
+
+
+def test_store_refuses_an_unmigrated_database(tmp_path):
+    """Test that a database with menu ids of users still being strings isn't opened until it is migrated."""
+
+    async def main():
+        store = SQLiteStore(tmp_path / 'users.db')
+        engine = create_async_engine(store.url)
+        async with engine.begin() as conn:
+            await conn.execute(sa.text('CREATE TABLE users (id INTEGER PRIMARY KEY, userid INTEGER UNIQUE, '
+                                       'language VARCHAR, current_menu_id VARCHAR, previous_menu_id VARCHAR, '
+                                       'last_bot_pm_id INTEGER)'))
+        await engine.dispose()
+
+        with pytest.raises(RuntimeError, match='alembic upgrade head'):
+            await store.open()
+        await store.close()
+
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+
+import pytest
+
+from functions.telegram_photos import TelegramPhotoChannel
+
+
+class StubBotAPIHandler(BaseHTTPRequestHandler):
+    """Answers ``sendPhoto`` with a new message and ``editMessageMedia`` with the edited one, unless it's 'deleted'."""
+
+    calls = []
+    deleted = set()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        method = self.path.rsplit('/', 1)[-1]
+        self.calls.append(method)
+
+        if method == 'sendPhoto':
+            message_id = len(self.calls)
+            result = {'ok': True, 'result': {'message_id': message_id, 'photo': [{'file_id': f'small{message_id}'},
+                                                                                 {'file_id': f'big{message_id}'}]}}
+        elif len(self.calls) in self.deleted:
+            result = {'ok': False, 'error_code': 400, 'description': 'Bad Request: message to edit not found'}
+        else:
+            result = {'ok': True, 'result': {'message_id': 1, 'photo': [{'file_id': f'edited{len(self.calls)}'}]}}
+
+        body = json.dumps(result).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api_url():
+    StubBotAPIHandler.calls.clear()
+    StubBotAPIHandler.deleted.clear()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubBotAPIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+
+
+def test_photo_is_sent_once_then_replaced(api_url):
+    """
+    Test that a key gets one message, unchanged bytes skip Telegram and changed bytes replace the photo.
+    """
+
+    channel = TelegramPhotoChannel('token', -100, api_url=api_url)
+
+    assert channel.publish('24h', b'first', 'graph.png') == 'big1'
+    assert channel.publish('24h', b'first', 'graph.png') == 'big1'
+    assert channel.publish('24h', b'second', 'graph.png') == 'edited2'
+    assert StubBotAPIHandler.calls == ['sendPhoto', 'editMessageMedia']
+
+    StubBotAPIHandler.deleted.add(3)
+    assert channel.publish('24h', b'third', 'graph.png') == 'big4'
+    assert channel.photos['24h']['message_id'] == 4
@@ -0,0 +1,52 @@
+import asyncio
+import json
+
+from functions.tracing import JSONLExporter, Tracer, name_trace, span, traced
+
+
+@traced('format')
+def slow_format():
+    with span('cache.load'):
+        pass
+    return 'text'
+
+
+def test_traces_aggregate_self_time_per_menu(tmp_path):
+    """
+    Test that spans are aggregated by self time into per-menu histograms, waiting for the user doesn't count,
+    only the slowest traces are kept and every trace gets exported.
+    """
+
+    exporter = JSONLExporter(tmp_path / 'traces.jsonl')
+    tracer = Tracer(slowest=2, exporter=exporter)
+
+    async def handle(menu_id: str, delay: float):
+        with tracer.trace('callback'):
+            name_trace(menu_id)
+            name_trace('ignored')
+            with span('handler'):
+                slow_format()
+                await asyncio.sleep(delay)
+                with span('user_input', idle=True):
+                    await asyncio.sleep(0.05)
+
+    async def main():
+        await asyncio.gather(handle('fast', 0), handle('fast', 0), handle('slow', 0.02))
+
+    asyncio.run(main())
+    exporter.close()
+
+    assert set(tracer.histograms) == {'fast', 'slow'}
+    assert tracer.histograms['fast']['total'].count == 2
+    assert set(tracer.histograms['slow']) == {'total', 'handler', 'format', 'cache.load'}
+    assert tracer.histograms['slow']['total'].max < 50  # user_input is idle
+    assert tracer.histograms['slow']['handler'].max >= 20
+
+    assert [trace.name for trace in tracer.slowest()][0] == 'slow'
+    assert len(tracer.slowest()) == 2
+    assert tracer.report(top=1).startswith('slow:')
+
+    lines = (tmp_path / 'traces.jsonl').read_text().splitlines()
+    assert len(lines) == 3
+    assert {span['name'] for span in json.loads(lines[-1])['spans']} == {'handler', 'format', 'cache.load',
+                                                                           'user_input'}
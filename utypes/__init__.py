@@ -2,6 +2,8 @@ from .cache import *
 from .datacenters import *
 from .game_data import *
 from .gun_info import *
+from .player_count import *
+from .player_history import *
 from .profiles import *
 from .states import *
 from .steam_webapi import SteamWebAPI
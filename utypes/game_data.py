@@ -153,6 +153,9 @@ class MatchmakingStatsData(BasicServerStatusData):
     player_24h_peak: int
     player_alltime_peak: int
     monthly_unique_players: int
+    graph_urls: dict[str, str] = dataclasses.field(default_factory=dict)  # graph window name -> URL
+    graph_file_id: str = ''  # Telegram file ID of the default graph
+    graph_file_ids: dict[str, str] = dataclasses.field(default_factory=dict)  # graph window name -> file ID
 
 
 @dataclass(frozen=True, slots=True)
@@ -317,6 +320,9 @@ class GameServers:
         sl_state = States.get_or_unknown(core_cache.get('sessions_logon_state'))
 
         graph_url = graph_cache.get('graph_url', '')  # graph!!!!
+        graph_urls = graph_cache.get('graph_urls', {})
+        graph_file_id = graph_cache.get('graph_file_id', '')
+        graph_file_ids = graph_cache.get('graph_file_ids', {})
         online_players = gc_cache.get('online_players', 0)  # GC!!!!
 
         online_servers = core_cache.get('online_servers', 0)
@@ -333,7 +339,8 @@ class GameServers:
                                     graph_url,
                                     online_servers,
                                     online_players, active_players, searching_players, average_search_time,
-                                    player_24h_peak, player_alltime_peak, monthly_unique_players)
+                                    player_24h_peak, player_alltime_peak, monthly_unique_players,
+                                    graph_urls, graph_file_id, graph_file_ids)
     
     @staticmethod
     def latest_info_update(cache: CoreCache):
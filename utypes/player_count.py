@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import csv
+import datetime as dt
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+
+
+__all__ = ('PlayerCountBuffer', 'PlayerCountBucket', 'PlayerChart')
+
+
+HEADER_DTYPE = np.dtype([('capacity', '<u8'), ('written', '<u8')])
+RECORD_DTYPE = np.dtype([('timestamp', '<i8'), ('players', '<u4')])
+
+
+class PlayerCountBucket(NamedTuple):
+    start: int
+    min: int
+    max: int
+    last: int
+
+
+class PlayerCountBuffer:
+    """
+    Fixed-size ring buffer of ``(timestamp, players)`` records, backed by a memory-mapped file.
+
+    Every record is written twice (at ``i`` and ``i + capacity``), so the stored records
+    always form one contiguous slice and reads can return views instead of copies.
+    Views are live: copy them if you need to keep them around while someone appends.
+    """
+
+    FILENAME = 'online_players.ring'
+    DEFAULT_CAPACITY = 4096  # ~51 hours of samples taken every 45 seconds
+
+    def __init__(self, path: Path, capacity: int = None):
+        """Opens the buffer at ``path``, creating it with ``capacity`` if needed (an existing one keeps its own)."""
+
+        path = Path(path)
+        if not path.exists() or path.stat().st_size == 0:
+            self._create(path, capacity or self.DEFAULT_CAPACITY)
+
+        self.path = path
+        self._map()
+
+    def _map(self):
+        self._header = np.memmap(self.path, dtype=HEADER_DTYPE, mode='r+', shape=(1,))
+        self.capacity = int(self._header['capacity'][0])
+        self._records = np.memmap(self.path, dtype=RECORD_DTYPE, mode='r+',
+                                  offset=HEADER_DTYPE.itemsize, shape=(2 * self.capacity,))
+
+    @classmethod
+    def open(cls, folder: Path, capacity: int = None):
+        return cls(Path(folder) / cls.FILENAME, capacity)
+
+    @staticmethod
+    def _create(path: Path, capacity: int):
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['capacity'] = capacity
+        with open(path, 'wb') as f:
+            f.write(header.tobytes())
+            f.write(np.zeros(2 * capacity, dtype=RECORD_DTYPE).tobytes())
+
+    @property
+    def written(self) -> int:
+        return int(self._header['written'][0])
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def append(self, timestamp: float, players: int):
+        written = self.written
+        i = written % self.capacity
+        self._records[i] = self._records[i + self.capacity] = (int(timestamp), players)
+        self._header['written'] = written + 1  # published after the record, so readers never see a blank slot
+        self._records.flush()
+        self._header.flush()
+
+    def extend(self, timestamps: np.ndarray, players: np.ndarray):
+        """Appends many records at once, keeping only the latest ``capacity`` of them."""
+
+        timestamps, players = timestamps[-self.capacity:], players[-self.capacity:]
+        written = self.written
+
+        indices = (written + np.arange(len(timestamps))) % self.capacity
+        for offset in (0, self.capacity):
+            self._records['timestamp'][indices + offset] = timestamps
+            self._records['players'][indices + offset] = players
+        self._header['written'] = written + len(timestamps)
+        self._records.flush()
+        self._header.flush()
+
+    def import_csv(self, path: Path):
+        """Appends the latest ``capacity`` rows of a ``DateTime,Players`` CSV file (as the player chart used to be)."""
+
+        with open(path, encoding='utf-8', newline='') as f:
+            rows = list(csv.DictReader(f))[-self.capacity:]
+
+        timestamps = [dt.datetime.strptime(row['DateTime'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=dt.UTC).timestamp()
+                      for row in rows]
+        players = [int(float(row['Players'])) for row in rows]
+        self.extend(np.array(timestamps, dtype='<i8'), np.array(players, dtype='<u4'))
+
+    def records(self) -> np.ndarray:
+        """Returns the stored records in chronological order (a view, not a copy)."""
+
+        written = self.written
+        if written <= self.capacity:
+            return self._records[:written]
+
+        head = written % self.capacity
+        return self._records[head:head + self.capacity]
+
+    def snapshot(self) -> np.ndarray:
+        """Returns a copy of the stored records in chronological order."""
+
+        return np.array(self.records())
+
+    def window(self, start: float, end: float = None) -> np.ndarray:
+        """Returns records with ``start < timestamp <= end`` (a view, not a copy)."""
+
+        records = self.records()
+        timestamps = records['timestamp']
+
+        lo = np.searchsorted(timestamps, start, side='right')
+        hi = records.size if end is None else np.searchsorted(timestamps, end, side='right')
+        return records[lo:hi]
+
+    def latest(self) -> int | None:
+        written = self.written
+        if written == 0:
+            return
+
+        return int(self._records[(written - 1) % self.capacity]['players'])
+
+    def peak(self, start: float, end: float = None) -> int | None:
+        records = self.window(start, end)
+        if not records.size:
+            return
+
+        return int(records['players'].max())
+
+    def buckets(self, bucket_size: int, start: float, end: float = None) -> list[PlayerCountBucket]:
+        """Groups records into ``bucket_size``-second buckets, returning min, max and last value of each one."""
+
+        records = self.window(start, end)
+        if not records.size:
+            return []
+
+        bucket_starts = records['timestamp'] // bucket_size * bucket_size
+        edges = np.flatnonzero(np.diff(bucket_starts)) + 1
+        bounds = np.concatenate(([0], edges, [records.size]))
+
+        players = records['players']
+        return [PlayerCountBucket(int(bucket_starts[lo]),
+                                  int(players[lo:hi].min()),
+                                  int(players[lo:hi].max()),
+                                  int(players[hi - 1]))
+                for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+
+class PlayerChart(PlayerCountBuffer):
+    """Player count marks the graph is plotted from, replacing the old rewrite-on-every-mark CSV file."""
+
+    FILENAME = 'player_chart.ring'
+    DEFAULT_CAPACITY = 2016  # every 10 minutes for the last two weeks, older marks live in ``PlayerHistory``
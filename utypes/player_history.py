@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from .player_count import PlayerCountBuffer
+
+
+__all__ = ('PlayerHistory', 'RollupTier', 'ROLLUP_DTYPE')
+
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+ROLLUP_DTYPE = np.dtype([('start', '<i8'), ('min', '<u4'), ('max', '<u4'), ('mean', '<f4')])
+
+
+def rollup(rows: np.ndarray, resolution: int) -> np.ndarray:
+    """Groups ``ROLLUP_DTYPE`` rows (sorted by start) into ``resolution``-second ones."""
+
+    if not rows.size:
+        return np.empty(0, dtype=ROLLUP_DTYPE)
+
+    starts = rows['start'] // resolution * resolution
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(starts)) + 1))
+
+    result = np.empty(bounds.size, dtype=ROLLUP_DTYPE)
+    result['start'] = starts[bounds]
+    result['min'] = np.minimum.reduceat(rows['min'], bounds)
+    result['max'] = np.maximum.reduceat(rows['max'], bounds)
+    result['mean'] = np.add.reduceat(rows['mean'].astype('float64'), bounds) / np.diff(np.append(bounds, rows.size))
+    return result
+
+
+class RollupTier:
+    """
+    Append-only rollups of one resolution, stored column by column (``<name>.<column>`` files),
+    so a query only reads the columns it needs and only the rows it asks for.
+    A row only counts once all of its columns are written, and columns are re-aligned before appending
+    in case a previous write got interrupted halfway.
+    """
+
+    def __init__(self, folder: Path, name: str, resolution: int, retention: int = None):
+        self.folder = Path(folder)
+        self.name = name
+        self.resolution = resolution
+        self.retention = retention
+
+        self.folder.mkdir(parents=True, exist_ok=True)
+        for column in ROLLUP_DTYPE.names:
+            self._path(column).touch()
+
+    def _path(self, column: str) -> Path:
+        return self.folder / f'{self.name}.{column}'
+
+    def _rows_in(self, column: str) -> int:
+        return self._path(column).stat().st_size // ROLLUP_DTYPE[column].itemsize
+
+    def _realign(self):
+        rows = len(self)
+        for column in ROLLUP_DTYPE.names:
+            size = rows * ROLLUP_DTYPE[column].itemsize
+            if self._path(column).stat().st_size != size:
+                os.truncate(self._path(column), size)
+
+    def __len__(self):
+        return min(self._rows_in(column) for column in ROLLUP_DTYPE.names)
+
+    def column(self, column: str, lo: int = 0, hi: int = None) -> np.ndarray:
+        rows = len(self)
+        hi = rows if hi is None else min(hi, rows)
+        if hi <= lo:
+            return np.empty(0, dtype=ROLLUP_DTYPE[column])
+
+        dtype = ROLLUP_DTYPE[column]
+        return np.memmap(self._path(column), dtype=dtype, mode='r', offset=lo * dtype.itemsize, shape=(hi - lo,))
+
+    def first_start(self) -> int | None:
+        starts = self.column('start', 0, 1)
+        return int(starts[0]) if starts.size else None
+
+    def next_start(self) -> int | None:
+        """Start of the first period that isn't rolled up yet."""
+
+        rows = len(self)
+        if not rows:
+            return
+
+        return int(self.column('start', rows - 1, rows)[0]) + self.resolution
+
+    def append(self, rows: np.ndarray):
+        self._realign()
+        for column in ROLLUP_DTYPE.names:
+            with open(self._path(column), 'ab') as f:
+                f.write(np.ascontiguousarray(rows[column]).tobytes())
+
+    def range(self, start: float = None, end: float = None) -> np.ndarray:
+        """Returns a copy of rows with ``start <= row start < end``."""
+
+        starts = self.column('start')
+        lo = 0 if start is None else int(np.searchsorted(starts, start, side='left'))
+        hi = starts.size if end is None else int(np.searchsorted(starts, end, side='left'))
+
+        result = np.empty(max(hi - lo, 0), dtype=ROLLUP_DTYPE)
+        for column in ROLLUP_DTYPE.names:
+            result[column] = self.column(column, lo, hi)
+        return result
+
+    def peak(self) -> int | None:
+        maxes = self.column('max')
+        return int(maxes.max()) if maxes.size else None
+
+    def trim(self, before: float):
+        """Drops rows older than ``before``, rewriting the column files."""
+
+        rows = self.range(before)
+        for column in ROLLUP_DTYPE.names:
+            tmp_path = self._path(column).with_suffix('.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(np.ascontiguousarray(rows[column]).tobytes())
+            os.replace(tmp_path, self._path(column))
+
+
+class PlayerHistory:
+    """
+    Tiered player count history:
+
+    * raw - the 10-minute marks of the player chart ring (two weeks)
+    * hourly - min/max/mean of every hour, kept for a year
+    * daily - min/max/mean of every day, kept forever
+
+    ``compact()`` rolls finished hours and days up into the coarser tiers and trims the hourly one,
+    ``range()`` answers from the finest tier that reaches back far enough.
+    """
+
+    FOLDER = 'player_history'
+    HOURLY_RETENTION = 365 * DAY
+    TRIM_SLACK = 30 * DAY  # rewriting the hourly files once a month is plenty
+
+    def __init__(self, folder: Path, raw: PlayerCountBuffer):
+        folder = Path(folder)
+        self.raw = raw
+        self.hourly = RollupTier(folder, 'hourly', HOUR, self.HOURLY_RETENTION)
+        self.daily = RollupTier(folder, 'daily', DAY)
+
+    @classmethod
+    def open(cls, folder: Path, raw: PlayerCountBuffer):
+        return cls(Path(folder) / cls.FOLDER, raw)
+
+    def raw_rows(self, start: float = None, end: float = None) -> np.ndarray:
+        records = self.raw.snapshot()
+        timestamps = records['timestamp']
+        lo = 0 if start is None else np.searchsorted(timestamps, start, side='left')
+        hi = timestamps.size if end is None else np.searchsorted(timestamps, end, side='left')
+        records = records[lo:hi]
+
+        rows = np.empty(records.size, dtype=ROLLUP_DTYPE)
+        rows['start'] = records['timestamp']
+        rows['min'] = rows['max'] = rows['mean'] = records['players']
+        return rows
+
+    def compact(self, now: float):
+        """Rolls up every finished hour and day that isn't rolled up yet, then trims expired hourly rollups."""
+
+        this_hour = int(now) // HOUR * HOUR
+        hourly = rollup(self.raw_rows(self.hourly.next_start(), this_hour), HOUR)
+        self.hourly.append(hourly)
+
+        today = int(now) // DAY * DAY
+        daily = rollup(self.hourly.range(self.daily.next_start(), today), DAY)
+        self.daily.append(daily)
+
+        oldest = self.hourly.first_start()
+        if oldest is not None and oldest < now - self.HOURLY_RETENTION - self.TRIM_SLACK:
+            self.hourly.trim(now - self.HOURLY_RETENTION)
+
+        return hourly.size, daily.size
+
+    def range(self, start: float, end: float = None) -> np.ndarray:
+        """
+        Returns ``ROLLUP_DTYPE`` rows of ``start <= row start < end`` from the finest tier covering ``start``
+        (give or take one period of the next tier, so a ring that has just wrapped around still counts),
+        followed by finer rows of the periods the tier hasn't rolled up yet, like the current hour.
+        """
+
+        raw_start = self.raw.records()['timestamp'][:1]
+        if raw_start.size and raw_start[0] - start <= self.hourly.resolution:
+            return self.raw_rows(start, end)
+
+        hourly_start = self.hourly.first_start()
+        if hourly_start is not None and hourly_start - start <= self.daily.resolution:
+            return self._with_recent_rows(self.hourly, start, end)
+
+        return self._with_recent_rows(self.daily, start, end)
+
+    def _with_recent_rows(self, tier: RollupTier, start: float, end: float = None) -> np.ndarray:
+        rows = tier.range(start, end)
+        next_start = tier.next_start()
+        recent_start = start if next_start is None else max(start, next_start)
+
+        if tier is self.daily:
+            recent = self._with_recent_rows(self.hourly, recent_start, end)
+        else:
+            recent = self.raw_rows(recent_start, end)
+        return np.concatenate((rows, recent))
+
+    def peak(self) -> int | None:
+        """All-time peak of the recorded history (only the ``max`` columns get read)."""
+
+        peaks = (self.daily.peak(), self.hourly.peak(), self.raw.peak(0))
+        return max((peak for peak in peaks if peak is not None), default=None)